@@ -1,6 +1,7 @@
 # marketplace/backend/core/celery_config.py
 
 from celery import Celery
+from celery.schedules import crontab
 import os
 
 
@@ -12,4 +13,13 @@ app.autodiscover_tasks()
 
 
 # Использование DatabaseScheduler для хранения расписания в базе данных
-app.conf.beat_scheduler = 'django_celery_beat.schedulers:DatabaseScheduler'
\ No newline at end of file
+app.conf.beat_scheduler = 'django_celery_beat.schedulers:DatabaseScheduler'
+
+# Задачи, которые должны быть в расписании всегда. DatabaseScheduler при старте beat заносит их в БД
+app.conf.beat_schedule = {
+    # секции wb_orders на месяцы вперёд и удаление секций старше срока хранения
+    "maintain_orders_partitions": {
+        "task": "logger.tasks.maintain_orders_partitions_task",
+        "schedule": crontab(hour=3, minute=0),
+    },
+}
@@ -1,4 +1,7 @@
+import asyncio
 import os
+import time
+from contextlib import asynccontextmanager
 
 import psycopg2
 import asyncpg
@@ -24,21 +27,125 @@ def connect_to_database():
         return None
 
 
+# Один пул asyncpg на процесс воркера
+POOL_CONFIG = {
+    'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+    'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+    'statement_cache_size': int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 100)),
+    'max_inactive_connection_lifetime': 300,
+}
+POOL_HEALTH_CHECK_INTERVAL = 30  # сек, как часто проверяем живость пула
+
+_pool = None
+_pool_loop = None
+_pool_lock = None
+_pool_checked_at = 0.0
+_pool_stats = {
+    'acquired': 0,
+    'wait_seconds': 0.0,
+    'max_wait_seconds': 0.0,
+}
+
+
+async def _create_pool():
+    return await asyncpg.create_pool(
+        user=DATABASE_CONFIG['user'],
+        password=DATABASE_CONFIG['password'],
+        database=DATABASE_CONFIG['dbname'],
+        host=DATABASE_CONFIG['host'],
+        port=DATABASE_CONFIG['port'],
+        **POOL_CONFIG,
+    )
+
+
+async def _is_pool_healthy(pool) -> bool:
+    try:
+        await pool.fetchval("SELECT 1", timeout=5)
+        return True
+    except Exception as e:
+        print(f"Пул соединений с БД не отвечает: {e}")
+        return False
+
+
 async def async_connect_to_database():
     """
-    Асинхронное подключение к базе данных с использованием пула соединений.
+    Общий пул соединений процесса. Создаётся при первом обращении и переиспользуется всеми задачами воркера.
+    Закрывать его не нужно.
     """
-    try:
-        return await asyncpg.create_pool(
-            user=DATABASE_CONFIG['user'],
-            password=DATABASE_CONFIG['password'],
-            database=DATABASE_CONFIG['dbname'],
-            host=DATABASE_CONFIG['host'],
-            port=DATABASE_CONFIG['port']
-        )
-    except Exception as e:
-        print(f"Ошибка подключения к базе данных: {e}")
-        return None
+    global _pool, _pool_loop, _pool_lock, _pool_checked_at
+
+    loop = asyncio.get_running_loop()
+    if _pool_loop is not loop:
+        # пул привязан к event loop, в новом loop создаём заново.
+        # Старый loop уже не крутится, дождаться close() в нём нельзя - закрываем соединения сразу
+        if _pool is not None:
+            try:
+                _pool.terminate()
+            except Exception as e:
+                print(f"Не удалось закрыть пул старого event loop: {e}")
+        _pool, _pool_loop, _pool_lock = None, loop, asyncio.Lock()
+
+    async with _pool_lock:
+        try:
+            if _pool is not None and not _pool.is_closing():
+                if time.monotonic() - _pool_checked_at < POOL_HEALTH_CHECK_INTERVAL:
+                    return _pool
+                if await _is_pool_healthy(_pool):
+                    _pool_checked_at = time.monotonic()
+                    return _pool
+                _pool.terminate()
+
+            _pool = await _create_pool()
+            _pool_checked_at = time.monotonic()
+            return _pool
+        except Exception as e:
+            print(f"Ошибка подключения к базе данных: {e}")
+            _pool = None
+            return None
+
+
+@asynccontextmanager
+async def acquire():
+    """
+    Взять соединение из общего пула:
+        async with acquire() as conn:
+            await conn.fetch(...)
+    """
+    pool = await async_connect_to_database()
+    if not pool:
+        raise ConnectionError("Ошибка подключения к базе данных")
+
+    started = time.monotonic()
+    async with pool.acquire() as conn:
+        waited = time.monotonic() - started
+        _pool_stats['acquired'] += 1
+        _pool_stats['wait_seconds'] += waited
+        _pool_stats['max_wait_seconds'] = max(_pool_stats['max_wait_seconds'], waited)
+        yield conn
+
+
+def get_pool_stats() -> dict:
+    """
+    Состояние пула: размер, занятые соединения и ожидание acquire().
+    """
+    size = _pool.get_size() if _pool else 0
+    idle = _pool.get_idle_size() if _pool else 0
+    acquired = _pool_stats['acquired']
+    return {
+        'size': size,
+        'in_use': size - idle,
+        'max_size': POOL_CONFIG['max_size'],
+        'acquired': acquired,
+        'avg_wait_seconds': _pool_stats['wait_seconds'] / acquired if acquired else 0.0,
+        'max_wait_seconds': _pool_stats['max_wait_seconds'],
+    }
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
 
 
 def close_connection(conn):
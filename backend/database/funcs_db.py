@@ -1,6 +1,10 @@
-from datetime import datetime
+import json
+import uuid
+from datetime import datetime, timedelta
 
-from database.DataBase import async_connect_to_database
+import asyncpg
+
+from database.DataBase import async_connect_to_database, acquire
 from typing import List, Optional, Dict, Any
 
 import logging
@@ -64,8 +68,6 @@ async def get_data_from_db(
         return all_fields
     except Exception as e:
         logger.error(f"Ошибка получения данных из {table_name}. Запрос {request}. Error: {e}")
-    finally:
-        await conn.close()
 
 
 async def add_set_data_from_db(
@@ -82,7 +84,6 @@ async def add_set_data_from_db(
     :param conflict_fields: Список полей, по которым проверяем конфликт (например, ["nmid", "lk_id"]). Если не передан, используется ["id"]
     :return: None
     """
-    need_close = False
     if not data:
         logger.warning("Нет данных для вставки/обновления.")
         return
@@ -92,7 +93,6 @@ async def add_set_data_from_db(
         conflict_fields = ["id"]
 
     if not conn:
-        need_close = True
         conn = await async_connect_to_database()
         if not conn:
             logger.warning("Ошибка подключения к БД в add_set_data_from_db")
@@ -132,6 +132,320 @@ async def add_set_data_from_db(
 
     except Exception as e:
         logger.exception(f"Ошибка при UPSERT в {table_name}: {e}")
-    finally:
-        if need_close:
-            await conn.close()
\ No newline at end of file
+
+async def copy_upsert(
+    conn,
+    table_name: str,
+    columns: List[str],
+    records: List[tuple],
+    conflict_fields: List[str],
+    skip_update_fields: Optional[List[str]] = None,
+) -> int:
+    """
+    Массовый UPSERT через COPY: строки заливаются во временную staging-таблицу,
+    затем один INSERT ... SELECT ... ON CONFLICT DO UPDATE применяет их к таблице.
+
+    :param conn: пул или соединение asyncpg
+    :param table_name: Название таблицы
+    :param columns: Названия столбцов в порядке значений в records
+    :param records: Список кортежей со значениями
+    :param conflict_fields: Поля, по которым проверяем конфликт (например, ["nmid", "lk_id", "srid", "date"])
+    :param skip_update_fields: Поля, которые не перезаписываем при конфликте
+    :return: Сколько строк вставлено/обновлено
+    """
+    if not records:
+        return 0
+
+    if not conn or isinstance(conn, asyncpg.Pool):
+        # временная таблица живёт в рамках одного соединения
+        async with acquire() as connection:
+            return await copy_upsert(
+                connection, table_name, columns, records, conflict_fields, skip_update_fields
+            )
+
+    # имя уникальное: если вызывающий уже держит транзакцию, transaction() ниже - лишь savepoint,
+    # и ON COMMIT DROP сработает только на внешнем коммите
+    staging = f"_staging_{table_name}_{uuid.uuid4().hex[:8]}"
+    columns_str = ", ".join(_quote(col) for col in columns)
+    conflict_columns_str = ", ".join(_quote(col) for col in conflict_fields)
+    on_conflict_str = _on_conflict_str(columns, conflict_fields, skip_update_fields)
+
+    async with conn.transaction():
+        await conn.execute(
+            f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+            f"SELECT {columns_str} FROM {table_name} WITH NO DATA"
+        )
+        await conn.copy_records_to_table(staging, records=records, columns=columns)
+        # В одном INSERT нельзя дважды обновить одну строку, поэтому схлопываем дубли.
+        # staging только что залита и не менялась, так что ctid идёт в порядке записей - побеждает последняя
+        result = await conn.execute(f"""
+            INSERT INTO {table_name} ({columns_str})
+            SELECT DISTINCT ON ({conflict_columns_str}) {columns_str}
+            FROM {staging}
+            ORDER BY {conflict_columns_str}, ctid DESC
+            {on_conflict_str}
+        """)
+        await conn.execute(f"DROP TABLE {staging}")
+
+    return int(result.split()[-1])
+
+
+# Типы столбцов таблиц для unnest: {table_name: {column: type}}
+_column_types: Dict[str, Dict[str, str]] = {}
+
+
+def _quote(column: str) -> str:
+    # в wb_productsstat столбцы в camelCase, без кавычек postgres их не найдёт
+    return f'"{column}"'
+
+
+def _on_conflict_str(columns: List[str], conflict_fields: List[str], skip_update_fields: Optional[List[str]]) -> str:
+    skip = set(skip_update_fields or []) | set(conflict_fields)
+    conflict_columns_str = ", ".join(_quote(col) for col in conflict_fields)
+    update_str = ", ".join(
+        f"{_quote(col)} = EXCLUDED.{_quote(col)}" for col in columns if col not in skip
+    )
+    if not update_str:
+        return f"ON CONFLICT ({conflict_columns_str}) DO NOTHING"
+    return f"ON CONFLICT ({conflict_columns_str}) DO UPDATE SET {update_str}"
+
+
+def _sort_key(key: tuple) -> tuple:
+    # None отдельно, иначе сравнение с int/str упадёт
+    return tuple((value is None, value) for value in key)
+
+
+async def get_column_types(conn, table_name: str) -> Dict[str, str]:
+    """
+    Типы столбцов таблицы (кэшируются на процесс).
+    :return: {column: "integer", ...}
+    """
+    if table_name not in _column_types:
+        rows = await conn.fetch(
+            """
+            SELECT attname, format_type(atttypid, atttypmod) AS type
+            FROM pg_attribute
+            WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped
+            """,
+            table_name,
+        )
+        _column_types[table_name] = {row["attname"]: row["type"] for row in rows}
+    return _column_types[table_name]
+
+
+async def add_set_many(
+    conn,
+    table_name: str,
+    rows: List[Dict[str, Any]],
+    conflict_fields: list = None,
+    batch_size: int = 1000,
+    use_copy: bool = False,
+) -> int:
+    """
+    Добавить или обновить много строк в таблице БД (UPSERT пачками).
+    Дубли по conflict_fields схлопываются (побеждает последняя строка), строки сортируются по ключу,
+    чтобы параллельные писатели брали блокировки в одном порядке и не ловили deadlock.
+
+    :param table_name: Название таблицы
+    :param rows: Список словарей с данными (ключ = имя поля), у всех одинаковые ключи
+    :param conflict_fields: Список полей, по которым проверяем конфликт. Если не передан, используется ["id"]
+    :param batch_size: Сколько строк в одном запросе
+    :param use_copy: Писать через COPY в staging-таблицу (copy_upsert) вместо INSERT ... SELECT unnest(...)
+    :return: Сколько строк вставлено/обновлено
+    """
+    if not rows:
+        logger.warning(f"Нет данных для вставки/обновления в {table_name}.")
+        return 0
+
+    if not conflict_fields:
+        conflict_fields = ["id"]
+
+    if not conn or isinstance(conn, asyncpg.Pool):
+        # все пачки пишем через одно соединение из общего пула
+        async with acquire() as connection:
+            return await add_set_many(connection, table_name, rows, conflict_fields, batch_size, use_copy)
+
+    try:
+        column_types = await get_column_types(conn, table_name)
+
+        columns = list(rows[0].keys())
+        defaults = {}
+        if "updated_at" in column_types and "updated_at" not in columns:
+            columns.append("updated_at")
+            defaults["updated_at"] = datetime.now()
+        if "is_active" not in columns and table_name == "wb_nmids":
+            columns.append("is_active")
+            defaults["is_active"] = True
+
+        unique_rows = {}
+        for row in rows:
+            unique_rows[tuple(row.get(field) for field in conflict_fields)] = row
+        records = [
+            tuple(unique_rows[key].get(col, defaults.get(col)) for col in columns)
+            for key in sorted(unique_rows, key=_sort_key)
+        ]
+
+        skip_update_fields = ["tag_ids", "is_active"]
+        total = 0
+
+        if use_copy:
+            for batch_start in range(0, len(records), batch_size):
+                total += await copy_upsert(
+                    conn, table_name, columns, records[batch_start:batch_start + batch_size],
+                    conflict_fields, skip_update_fields
+                )
+            return total
+
+        # Текст запроса одинаковый для всех пачек - asyncpg держит его prepared statement в кэше
+        query = f"""
+            INSERT INTO {table_name} ({", ".join(_quote(col) for col in columns)})
+            SELECT * FROM unnest({", ".join(f"${i + 1}::{column_types[col]}[]" for i, col in enumerate(columns))})
+            {_on_conflict_str(columns, conflict_fields, skip_update_fields)}
+        """
+        for batch_start in range(0, len(records), batch_size):
+            batch = records[batch_start:batch_start + batch_size]
+            result = await conn.execute(query, *(list(values) for values in zip(*batch)))
+            total += int(result.split()[-1])
+        return total
+
+    except Exception as e:
+        logger.exception(f"Ошибка при UPSERT пачкой в {table_name}: {e}")
+        raise
+
+
+async def get_sync_state(conn, lk_id: int, job: str) -> Dict[str, Any]:
+    """
+    Состояние инкрементальной синхронизации кабинета (таблица wb_syncstate).
+    :return: {"watermark": datetime | None, "cursor": dict}
+    """
+    if not conn:
+        conn = await async_connect_to_database()
+
+    row = await conn.fetchrow(
+        "SELECT watermark, cursor FROM wb_syncstate WHERE lk_id = $1 AND job = $2", lk_id, job
+    )
+    if not row:
+        return {"watermark": None, "cursor": {}}
+    return {"watermark": row["watermark"], "cursor": json.loads(row["cursor"]) if row["cursor"] else {}}
+
+
+async def set_sync_state(
+    conn,
+    lk_id: int,
+    job: str,
+    watermark: Optional[datetime] = None,
+    cursor: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Сохранить состояние синхронизации. Вызывать после коммита данных, которые покрывает watermark:
+    сначала данные, потом watermark. Если процесс упадёт между ними, следующий прогон
+    заберёт те же строки ещё раз (запись идемпотентна), но watermark не уйдёт вперёд незаписанных строк.
+
+    :param watermark: новый watermark (None - не менять)
+    :param cursor: доп. состояние джобы (None - не менять)
+    """
+    if not conn:
+        conn = await async_connect_to_database()
+
+    await conn.execute(
+        """
+        INSERT INTO wb_syncstate (lk_id, job, watermark, cursor, updated_at)
+        VALUES ($1, $2, $3, COALESCE($4::jsonb, '{}'::jsonb), now())
+        ON CONFLICT (lk_id, job) DO UPDATE SET
+            watermark = COALESCE(EXCLUDED.watermark, wb_syncstate.watermark),
+            cursor = COALESCE($4::jsonb, wb_syncstate.cursor),
+            updated_at = now()
+        """,
+        lk_id, job, watermark, json.dumps(cursor) if cursor is not None else None,
+    )
+
+
+async def find_reusable_report(
+    lk_id: int,
+    report_type: str,
+    period_start,
+    period_end,
+    hours: int = 48,
+) -> Optional[Dict[str, Any]]:
+    """
+    Найти уже заказанный отчёт с теми же параметрами (таблица wb_reportjob).
+    WB хранит отчёты 48 часов, их можно скачать повторно без расхода суточного лимита.
+    Берём только ещё не загруженные отчёты ('created', 'ready'). Загруженный ('loaded') - только если
+    период закончился до сегодняшнего дня по МСК: иначе за последний день в нём неполные данные,
+    и повторное использование заморозило бы их до конца окна.
+    :return: {"report_id", "status"} или None
+    """
+    today = (datetime.now() + timedelta(hours=3)).date()  # день по МСК
+    conn = await async_connect_to_database()
+    row = await conn.fetchrow(
+        """
+        SELECT report_id, status FROM wb_reportjob
+        WHERE lk_id = $1 AND report_type = $2 AND period_start = $3 AND period_end = $4
+            AND (status IN ('created', 'ready') OR status = 'loaded' AND period_end < $6)
+            AND created_at > now() - make_interval(hours => $5)
+        ORDER BY created_at DESC
+        LIMIT 1
+        """,
+        lk_id, report_type, period_start, period_end, hours, today,
+    )
+    return dict(row) if row else None
+
+
+async def reserve_report_job(
+    lk_id: int,
+    report_id: str,
+    report_type: str,
+    period_start,
+    period_end,
+    daily_quota: int,
+) -> bool:
+    """
+    Занять место в суточном лимите отчётов кабинета и записать заказ отчёта.
+    Проверка и вставка под advisory lock кабинета, чтобы параллельные задачи не превысили лимит.
+    :return: False, если лимит за последние сутки исчерпан
+    """
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('wb_reportjob'), $1)", lk_id)
+            used = await conn.fetchval(
+                """
+                SELECT count(*) FROM wb_reportjob
+                WHERE lk_id = $1 AND created_at > now() - interval '1 day'
+                """,
+                lk_id,
+            )
+            if used >= daily_quota:
+                return False
+            await conn.execute(
+                """
+                INSERT INTO wb_reportjob (
+                    lk_id, report_id, report_type, period_start, period_end, status, attempts, created_at, updated_at
+                )
+                VALUES ($1, $2, $3, $4, $5, 'created', 0, now(), now())
+                """,
+                lk_id, report_id, report_type, period_start, period_end,
+            )
+            return True
+
+
+async def update_report_job(
+    report_id: str,
+    status: Optional[str] = None,
+    attempts: Optional[int] = None,
+    error: Optional[str] = None,
+) -> None:
+    """
+    Обновить статус/кол-во опросов/ошибку отчёта. None - поле не меняем.
+    """
+    conn = await async_connect_to_database()
+    await conn.execute(
+        """
+        UPDATE wb_reportjob SET
+            status = COALESCE($2, status),
+            attempts = COALESCE($3, attempts),
+            error = COALESCE($4, error),
+            updated_at = now()
+        WHERE report_id = $1
+        """,
+        report_id, status, attempts, error,
+    )
@@ -0,0 +1,153 @@
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from database.DataBase import acquire
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# Дневные итоги заказов (lk_id, nmid, day): заказов, отмен, сумма pricewithdisc.
+# Ведутся дельтами при записи заказов (apply_orders_daily), полностью пересчитываются rebuild_orders_daily
+ORDERS_DAILY_TABLE = "wb_ordersdaily"
+
+# Ключ pg_advisory_xact_lock(ключ, lk_id): запись заказов кабинета и дельты итогов идут по одному
+_LOCK_KEY = 0x6F64  # "od"
+
+
+def order_day(value: datetime) -> date:
+    """
+    День заказа как wb_orders.order_day: (date AT TIME ZONE 'UTC')::date.
+    Время без пояса asyncpg пишет как UTC.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.date()
+
+
+async def lock_orders_daily(conn, lk_id: int):
+    """
+    Заблокировать итоги кабинета до конца транзакции.
+    Без блокировки два писателя одного кабинета прочитают одинаковые старые строки и задвоят дельты.
+    """
+    await conn.execute("SELECT pg_advisory_xact_lock($1, $2)", _LOCK_KEY, lk_id)
+
+
+async def fetch_orders_daily_state(conn, lk_id: int, rows: List[Dict[str, Any]]) -> List[tuple]:
+    """
+    Что уже записано в wb_orders по заказам из rows - до upsert.
+    :param rows: строки wb_orders одного кабинета
+    :return: [(nmid, order_day, iscancel, pricewithdisc)]
+    """
+    if not rows:
+        return []
+    # дубли ключа дали бы старую строку дважды
+    keys = list({(row["nmid"], row["srid"], row["date"]) for row in rows})
+    dates = [key[2] for key in keys]
+    # границы по date - чтобы читать только нужные месячные секции
+    return await conn.fetch(
+        """
+        SELECT o.nmid, o.order_day, o.iscancel, o.pricewithdisc
+        FROM wb_orders o
+        JOIN unnest($2::int[], $3::text[], $4::timestamptz[]) AS k(nmid, srid, date)
+            ON o.nmid = k.nmid AND o.srid = k.srid AND o.date = k.date
+        WHERE o.lk_id = $1 AND o.date BETWEEN $5 AND $6
+        """,
+        lk_id,
+        [key[0] for key in keys],
+        [key[1] for key in keys],
+        dates,
+        min(dates),
+        max(dates),
+    )
+
+
+def orders_daily_deltas(old: Iterable[tuple], rows: List[Dict[str, Any]]) -> Dict[Tuple[int, date], List]:
+    """
+    Дельты итогов: новые строки минус то, что было по этим заказам раньше.
+    Дубли заказа в rows схлопываются, как в add_set_many - побеждает последняя строка.
+    :return: {(nmid, day): [заказов, отмен, сумма]}
+    """
+    deltas = defaultdict(lambda: [0, 0, 0.0])
+    for nmid, day, iscancel, price in old:
+        delta = deltas[(nmid, day)]
+        delta[0] -= 1
+        delta[1] -= int(iscancel)
+        delta[2] -= price
+
+    unique = {(row["nmid"], row["srid"], row["date"]): row for row in rows}
+    for row in unique.values():
+        delta = deltas[(row["nmid"], order_day(row["date"]))]
+        delta[0] += 1
+        delta[1] += int(row["iscancel"])
+        delta[2] += row["pricewithdisc"]
+
+    return {key: delta for key, delta in deltas.items() if delta[0] or delta[1] or delta[2]}
+
+
+async def apply_orders_daily(conn, lk_id: int, deltas: Dict[Tuple[int, date], List]) -> int:
+    """
+    Прибавить дельты к итогам кабинета.
+    :return: сколько строк итогов затронуто
+    """
+    if not deltas:
+        return 0
+    keys = sorted(deltas)  # один порядок блокировок у всех писателей
+    result = await conn.execute(
+        f"""
+        INSERT INTO {ORDERS_DAILY_TABLE} (lk_id, nmid, day, orders, cancels, revenue)
+        SELECT $1, * FROM unnest($2::int[], $3::date[], $4::int[], $5::int[], $6::float8[])
+        ON CONFLICT (lk_id, nmid, day) DO UPDATE SET
+            orders = {ORDERS_DAILY_TABLE}.orders + EXCLUDED.orders,
+            cancels = {ORDERS_DAILY_TABLE}.cancels + EXCLUDED.cancels,
+            revenue = {ORDERS_DAILY_TABLE}.revenue + EXCLUDED.revenue
+        """,
+        lk_id,
+        [nmid for nmid, _ in keys],
+        [day for _, day in keys],
+        [deltas[key][0] for key in keys],
+        [deltas[key][1] for key in keys],
+        [deltas[key][2] for key in keys],
+    )
+    return int(result.split()[-1])
+
+
+async def rebuild_orders_daily(conn=None, lk_ids: Optional[List[int]] = None) -> int:
+    """
+    Пересчитать итоги из wb_orders целиком (все кабинеты или lk_ids).
+    Таблица итогов на время пересчёта блокируется от записи: писатели заказов ждут и потом
+    досчитывают свои дельты поверх пересчитанных итогов.
+    :return: сколько строк итогов записано
+    """
+    if not conn:
+        async with acquire() as connection:
+            return await rebuild_orders_daily(connection, lk_ids)
+
+    lk_filter = "WHERE lk_id = ANY($1::int[])" if lk_ids else ""
+    args = [lk_ids] if lk_ids else []
+    async with conn.transaction():
+        await conn.execute(f"LOCK TABLE {ORDERS_DAILY_TABLE} IN EXCLUSIVE MODE")
+        await conn.execute(f"DELETE FROM {ORDERS_DAILY_TABLE} {lk_filter}", *args)
+        result = await conn.execute(
+            f"""
+            INSERT INTO {ORDERS_DAILY_TABLE} (lk_id, nmid, day, orders, cancels, revenue)
+            SELECT lk_id, nmid, order_day, count(*), count(*) FILTER (WHERE iscancel), sum(pricewithdisc)
+            FROM wb_orders
+            {lk_filter}
+            GROUP BY lk_id, nmid, order_day
+            """,
+            *args,
+        )
+    count = int(result.split()[-1])
+    logger.info(f"Итоги заказов пересчитаны: {count} строк{f' по кабинетам {lk_ids}' if lk_ids else ''}")
+    return count
+
+
+async def delete_orders_daily_before(conn, cutoff: date) -> int:
+    """
+    Удалить итоги за дни, заказов за которые уже нет (секции wb_orders старше срока хранения удалены).
+    """
+    result = await conn.execute(f"DELETE FROM {ORDERS_DAILY_TABLE} WHERE day < $1", cutoff)
+    return int(result.split()[-1])
@@ -0,0 +1,229 @@
+import os
+import re
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Set
+
+import asyncpg
+
+from database.DataBase import acquire
+from database.orders_daily import delete_orders_daily_before
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# wb_orders разбита по месяцам на секции wb_orders_pYYYYMM по полю date
+ORDERS_TABLE = "wb_orders"
+# На сколько месяцев вперёд держим готовые секции
+ORDERS_PARTITIONS_AHEAD = int(os.environ.get("ORDERS_PARTITIONS_AHEAD", 3))
+# Сколько месяцев истории храним (вместе с текущим). 0 - храним всё
+ORDERS_RETENTION_MONTHS = int(os.environ.get("ORDERS_RETENTION_MONTHS", 0))
+
+_PARTITION_RE = re.compile(rf"^{ORDERS_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+# секции, про которые этот процесс уже знает, что они есть
+_known_partitions: Set[str] = set()
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{ORDERS_TABLE}_p{month:%Y%m}"
+
+
+def retention_cutoff(today: Optional[date] = None) -> Optional[date]:
+    """
+    Первый месяц, который ещё храним. None - храним всё.
+    """
+    if ORDERS_RETENTION_MONTHS <= 0:
+        return None
+    return add_months(month_start(today or date.today()), -(ORDERS_RETENTION_MONTHS - 1))
+
+
+async def is_partitioned(conn, table: str = ORDERS_TABLE) -> bool:
+    relkind = await conn.fetchval("SELECT relkind FROM pg_class WHERE oid = to_regclass($1)", table)
+    return relkind == "p"
+
+
+async def _create_partition(conn, month: date) -> bool:
+    name = partition_name(month)
+    try:
+        status = await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {ORDERS_TABLE} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+    except asyncpg.DuplicateTableError:
+        # параллельный писатель успел создать ту же секцию
+        status = None
+    _known_partitions.add(name)
+    return status == "CREATE TABLE"
+
+
+async def ensure_orders_partitions(conn=None, months: Iterable = ()) -> List[str]:
+    """
+    Создать недостающие секции wb_orders: текущий месяц, ORDERS_PARTITIONS_AHEAD месяцев вперёд
+    и месяцы из months (даты заказов, которые сейчас будем писать). Месяцы старше срока хранения не создаём.
+    Если wb_orders ещё не секционирована (partition_orders не запускали), ничего не делает.
+    :return: имена созданных секций
+    """
+    if not conn:
+        async with acquire() as connection:
+            return await ensure_orders_partitions(connection, months)
+
+    current = month_start(date.today())
+    wanted = {add_months(current, offset) for offset in range(ORDERS_PARTITIONS_AHEAD + 1)}
+    wanted |= {month_start(value) for value in months}
+    cutoff = retention_cutoff()
+    missing = sorted(
+        month for month in wanted
+        if partition_name(month) not in _known_partitions and not (cutoff and month < cutoff)
+    )
+    if not missing or not await is_partitioned(conn):
+        return []
+
+    created = []
+    for month in missing:
+        if await _create_partition(conn, month):
+            created.append(partition_name(month))
+    if created:
+        logger.info(f"Созданы секции {ORDERS_TABLE}: {', '.join(created)}")
+    return created
+
+
+async def drop_expired_orders_partitions(conn=None) -> List[str]:
+    """
+    Удалить секции wb_orders старше срока хранения (ORDERS_RETENTION_MONTHS).
+    :return: имена удалённых секций
+    """
+    if not conn:
+        async with acquire() as connection:
+            return await drop_expired_orders_partitions(connection)
+
+    cutoff = retention_cutoff()
+    if not cutoff or not await is_partitioned(conn):
+        return []
+
+    partitions = await conn.fetch(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = $1::regclass",
+        ORDERS_TABLE,
+    )
+    dropped = []
+    for row in partitions:
+        match = _PARTITION_RE.match(row["relname"])
+        if match and date(int(match[1]), int(match[2]), 1) < cutoff:
+            await conn.execute(f"DROP TABLE {row['relname']}")
+            _known_partitions.discard(row["relname"])
+            dropped.append(row["relname"])
+    if dropped:
+        logger.info(f"Удалены секции {ORDERS_TABLE} старше {cutoff}: {', '.join(dropped)}")
+    return dropped
+
+
+async def maintain_orders_partitions():
+    """
+    Создать секции наперёд и удалить устаревшие.
+    """
+    async with acquire() as conn:
+        created = await ensure_orders_partitions(conn)
+        dropped = await drop_expired_orders_partitions(conn)
+        cutoff = retention_cutoff()
+        if cutoff:
+            # итоги за удалённые месяцы тоже не нужны
+            await delete_orders_daily_before(conn, cutoff)
+    return {"created": created, "dropped": dropped}
+
+
+def _with_partition_key(definition: str) -> str:
+    """
+    PRIMARY KEY (id) -> PRIMARY KEY (id, date): в секционированной таблице уникальность
+    возможна только вместе с ключом секционирования.
+    """
+    columns = definition[definition.index("(") + 1:definition.index(")")]
+    if "date" in [column.strip().strip('"') for column in columns.split(",")]:
+        return definition
+    return definition.replace(f"({columns})", f"({columns}, date)", 1)
+
+
+async def convert_orders_to_partitioned(conn) -> bool:
+    """
+    Переделать обычную wb_orders в секционированную по месяцам (PARTITION BY RANGE (date)).
+    Всё в одной транзакции: данные копируются в новую таблицу, ограничения и индексы пересоздаются
+    с прежними именами (чтобы миграции Django их находили), первичный ключ и уникальные
+    ограничения дополняются полем date.
+    :return: False, если таблица уже секционирована
+    """
+    if await is_partitioned(conn):
+        return False
+
+    heap = f"{ORDERS_TABLE}_heap"
+    async with conn.transaction():
+        await conn.execute(f"LOCK TABLE {ORDERS_TABLE} IN ACCESS EXCLUSIVE MODE")
+        constraints = await conn.fetch(
+            "SELECT conname, contype, pg_get_constraintdef(oid) AS definition "
+            "FROM pg_constraint WHERE conrelid = $1::regclass ORDER BY contype DESC",  # сначала p и u, потом f
+            ORDERS_TABLE,
+        )
+        indexes = await conn.fetch(
+            """
+            SELECT indexname, indexdef FROM pg_indexes
+            WHERE schemaname = current_schema() AND tablename = $1
+                AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = $1::regclass)
+            """,
+            ORDERS_TABLE,
+        )
+        # генерируемые колонки (order_day) не копируем - новая таблица посчитает их сама
+        columns = ", ".join(
+            f'"{row["attname"]}"' for row in await conn.fetch(
+                """
+                SELECT attname FROM pg_attribute
+                WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+                ORDER BY attnum
+                """,
+                ORDERS_TABLE,
+            )
+        )
+        bounds = await conn.fetchrow(f"SELECT min(date) AS first, max(date) AS last, max(id) AS max_id FROM {ORDERS_TABLE}")
+
+        await conn.execute(f"ALTER TABLE {ORDERS_TABLE} RENAME TO {heap}")
+        # IDENTITY у секционированных таблиц в PostgreSQL 15 не поддерживается - id берём из обычной последовательности
+        await conn.execute(
+            f"CREATE TABLE {ORDERS_TABLE} (LIKE {heap} INCLUDING DEFAULTS INCLUDING GENERATED) "
+            f"PARTITION BY RANGE (date)"
+        )
+
+        current = month_start(datetime.now())
+        month = month_start(bounds["first"]) if bounds["first"] else current
+        last = max(month_start(bounds["last"]) if bounds["last"] else current, add_months(current, ORDERS_PARTITIONS_AHEAD))
+        while month <= last:
+            await _create_partition(conn, month)
+            month = add_months(month, 1)
+
+        await conn.execute(f"INSERT INTO {ORDERS_TABLE} ({columns}) SELECT {columns} FROM {heap}")
+        # последовательность старого id (serial или identity) удаляется вместе со старой таблицей
+        await conn.execute(f"ALTER TABLE {ORDERS_TABLE} ALTER COLUMN id DROP DEFAULT")
+        await conn.execute(f"DROP TABLE {heap}")
+
+        await conn.execute(f"CREATE SEQUENCE {ORDERS_TABLE}_id_seq OWNED BY {ORDERS_TABLE}.id")
+        await conn.execute(f"ALTER TABLE {ORDERS_TABLE} ALTER COLUMN id SET DEFAULT nextval('{ORDERS_TABLE}_id_seq')")
+        await conn.execute(
+            f"SELECT setval('{ORDERS_TABLE}_id_seq', $1, $2)", bounds["max_id"] or 1, bounds["max_id"] is not None
+        )
+
+        for constraint in constraints:
+            definition = constraint["definition"]
+            if constraint["contype"] in ("p", "u"):
+                definition = _with_partition_key(definition)
+            await conn.execute(f'ALTER TABLE {ORDERS_TABLE} ADD CONSTRAINT "{constraint["conname"]}" {definition}')
+        for index in indexes:
+            await conn.execute(index["indexdef"])
+
+    logger.info(f"{ORDERS_TABLE} секционирована по месяцам, перенесено строк до id {bounds['max_id']}")
+    return True
@@ -0,0 +1,25 @@
+import asyncio
+import os
+
+import redis.asyncio as aioredis
+
+
+# Отдельная БД redis, чтобы не мешать брокеру celery (он на /0)
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/1')
+
+_client = None
+_client_loop = None
+
+
+def get_redis():
+    """
+    Клиент redis для текущего event loop.
+    Клиент привязан к loop, поэтому при смене loop создаём новый.
+    """
+    global _client, _client_loop
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = aioredis.from_url(REDIS_URL, decode_responses=True)
+        _client_loop = loop
+    return _client
@@ -0,0 +1,80 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import asyncpg
+
+from database.DataBase import acquire
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# История остатков за последние STOCK_HISTORY_DAYS дней на строку (lk_id, nmid, warehousename):
+#   day        - последний записанный день
+#   mask       - бит i = 1, если за i дней до day товар был в наличии (бит 0 - сам day)
+#   quantities - остаток по дням, quantities[1] - за day, quantities[i + 1] - за i дней до day
+# Дни, в которые остатки не забирались, считаются днями без наличия
+STOCK_HISTORY_TABLE = "wb_stockhistory"
+STOCK_HISTORY_DAYS = 32
+
+# days_in_stock_last_N в wb_stocks = число единиц в младших N битах mask
+DAYS_IN_STOCK = (3, 7, 14, 30)
+
+# На сколько дней сдвигаем историю строки: 0 - повторный прогон за тот же день
+_SHIFT = f"LEAST(GREATEST(EXCLUDED.day - {STOCK_HISTORY_TABLE}.day, 0), {STOCK_HISTORY_DAYS})"
+
+
+async def update_stock_history(conn=None, lk_id: int = None, day: Optional[date] = None) -> int:
+    """
+    Записать в историю остатки кабинета за day по текущему состоянию wb_stocks (размеры склада суммируются)
+    и пересчитать по ней days_in_stock_last_* в wb_stocks. Вызывается раз за прогон загрузки остатков.
+    Строки истории, которых больше нет в wb_stocks, получают день без наличия.
+    :param day: за какой день (по умолчанию сегодня по МСК)
+    :return: сколько строк wb_stocks обновлено
+    """
+    if not conn or isinstance(conn, asyncpg.Pool):
+        async with acquire() as connection:
+            return await update_stock_history(connection, lk_id, day)
+
+    day = day or (datetime.now() + timedelta(hours=3)).date()  # день по МСК
+    full_mask = (1 << STOCK_HISTORY_DAYS) - 1
+    async with conn.transaction():
+        await conn.execute(
+            f"""
+            INSERT INTO {STOCK_HISTORY_TABLE} (lk_id, nmid, warehousename, day, mask, quantities)
+            SELECT $1, nmid, warehousename, $2, (coalesce(s.quantity, 0) > 0)::int, ARRAY[coalesce(s.quantity, 0)]
+            FROM (
+                SELECT nmid, coalesce(warehousename, '') AS warehousename, sum(quantity)::int AS quantity
+                FROM wb_stocks WHERE lk_id = $1
+                GROUP BY 1, 2
+            ) s
+            FULL JOIN (
+                SELECT nmid, warehousename FROM {STOCK_HISTORY_TABLE} WHERE lk_id = $1
+            ) h USING (nmid, warehousename)
+            ORDER BY nmid, warehousename
+            ON CONFLICT (lk_id, nmid, warehousename) DO UPDATE SET
+                mask = ({STOCK_HISTORY_TABLE}.mask << {_SHIFT}) & {full_mask - 1} | EXCLUDED.mask,
+                quantities = (
+                    EXCLUDED.quantities
+                    || array_fill(0, ARRAY[GREATEST({_SHIFT} - 1, 0)])
+                    || {STOCK_HISTORY_TABLE}.quantities[CASE WHEN {_SHIFT} = 0 THEN 2 ELSE 1 END:{STOCK_HISTORY_DAYS} - {_SHIFT}]
+                )[1:{STOCK_HISTORY_DAYS}],
+                day = EXCLUDED.day
+            """,
+            lk_id,
+            day,
+        )
+        counters = {n: f"bit_count((h.mask & {(1 << n) - 1})::bit(64))::int" for n in DAYS_IN_STOCK}
+        result = await conn.execute(
+            f"""
+            UPDATE wb_stocks s SET {", ".join(f"days_in_stock_last_{n} = {expr}" for n, expr in counters.items())}
+            FROM {STOCK_HISTORY_TABLE} h
+            WHERE s.lk_id = $1 AND h.lk_id = $1
+                AND h.nmid = s.nmid AND h.warehousename = coalesce(s.warehousename, '')
+                AND ({", ".join(f"s.days_in_stock_last_{n}" for n in DAYS_IN_STOCK)})
+                    IS DISTINCT FROM ({", ".join(counters.values())})
+            """,
+            lk_id,
+        )
+    return int(result.split()[-1])
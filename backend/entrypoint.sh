@@ -14,6 +14,14 @@ python manage.py makemigrations
 echo "Running migrations..."
 python manage.py migrate
 
+# wb_orders секционирована по месяцам: перевести (один раз) и создать секции наперёд
+echo "Partitioning wb_orders..."
+python manage.py partition_orders
+
+# Дневные итоги заказов для аналитики: посчитать из wb_orders, если их ещё нет
+echo "Building daily order totals..."
+python manage.py rebuild_orders_daily --if-empty
+
 # Собираем статические файлы
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
@@ -4,8 +4,12 @@ from context_logger import ContextLogger
 import logging
 from celery import shared_task
 from decorators import with_task_context
-from parsers.wildberies import get_orders, get_nmids, get_stocks_data_2_weeks, get_stat_products
-import asyncio
+from parsers.wildberies import (
+    get_orders, get_nmids, get_stocks_data_2_weeks, get_stat_products, get_adverts, get_feedbacks,
+    get_prices, send_price_changes,
+)
+from database.partitions import maintain_orders_partitions
+from worker_loop import run_async
 
 logger = ContextLogger(logging.getLogger("logger"))
 
@@ -20,7 +24,7 @@ def get_area_warehouses_task():
 @with_task_context("get_nmids_to_db")
 def get_nmids_to_db():
     logger.info("🟢 Обновляем артикулы в DB")
-    asyncio.run(get_nmids())
+    run_async(get_nmids())
     logger.info("Артикулы в DB обновлены")
 
 
@@ -28,7 +32,7 @@ def get_nmids_to_db():
 @with_task_context("get_orders_to_db")
 def get_orders_to_db():
     logger.info("🟢 Обновляем заказы в DB")
-    asyncio.run(get_orders())
+    run_async(get_orders())
     logger.info("Заказы в DB обновлены")
 
 
@@ -36,7 +40,7 @@ def get_orders_to_db():
 @with_task_context("get_stocks_to_db")
 def get_stocks_to_db():
     logger.info("🟢 Обновляем остатки в DB")
-    asyncio.run(get_stocks_data_2_weeks())
+    run_async(get_stocks_data_2_weeks())
     logger.info("Остатки в DB обновлены")
 
 
@@ -44,5 +48,45 @@ def get_stocks_to_db():
 @with_task_context("get_stat_products_task")
 def get_stat_products_task():
     logger.info("🟢 Обновляем стату по товарам в БД")
-    asyncio.run(get_stat_products())
-    logger.info("Стата по товарам в БД обновлены")
\ No newline at end of file
+    run_async(get_stat_products())
+    logger.info("Стата по товарам в БД обновлены")
+
+
+@shared_task
+@with_task_context("get_adverts_task")
+def get_adverts_task():
+    logger.info("🟢 Обновляем рекламные кампании в БД")
+    run_async(get_adverts())
+    logger.info("Рекламные кампании в БД обновлены")
+
+
+@shared_task
+@with_task_context("get_feedbacks_task")
+def get_feedbacks_task():
+    logger.info("🟢 Обновляем отзывы и вопросы в БД")
+    run_async(get_feedbacks())
+    logger.info("Отзывы и вопросы в БД обновлены")
+
+
+@shared_task
+@with_task_context("get_prices_task")
+def get_prices_task():
+    logger.info("🟢 Обновляем цены в БД")
+    run_async(get_prices())
+    logger.info("Цены в БД обновлены")
+
+
+@shared_task
+@with_task_context("send_price_changes_task")
+def send_price_changes_task():
+    logger.info("🟢 Отправляем изменения цен в WB")
+    run_async(send_price_changes())
+    logger.info("Изменения цен отправлены")
+
+
+@shared_task
+@with_task_context("maintain_orders_partitions_task")
+def maintain_orders_partitions_task():
+    logger.info("🟢 Обслуживаем секции wb_orders")
+    result = run_async(maintain_orders_partitions())
+    logger.info(f"Секции wb_orders: создано {result['created']}, удалено {result['dropped']}")
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from database.redis_conn import get_redis
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# После скольких неудачных запросов подряд перестаём ходить в WB по (кабинет, категория)
+FAILURE_THRESHOLD = int(os.environ.get("WB_BREAKER_FAILURES", 5))
+COOLDOWN = float(os.environ.get("WB_BREAKER_COOLDOWN", 60))  # сек
+
+
+class WbApiError(Exception):
+    """
+    WB ответил ошибкой, которую не удалось пережить повторами (429, 5xx, обрыв соединения).
+    """
+
+    def __init__(self, status: Optional[int], message: str):
+        super().__init__(f"WB {status}: {message[:500]}")
+        self.status = status
+
+
+class CircuitOpenError(WbApiError):
+    """
+    Запросы по (кабинет, категория) временно не отправляются - предохранитель разомкнут.
+    """
+
+    def __init__(self, category: str, wait: float):
+        super().__init__(None, f"предохранитель {category} разомкнут ещё {wait:.0f} сек")
+        self.category = category
+        self.wait = wait
+
+
+def _breaker_key(api_key: str, category: str) -> str:
+    token_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return f"wb:cb:{token_hash}:{category}"
+
+
+class CircuitBreaker:
+    """
+    Предохранитель по (токен кабинета, категория метода WB), общий для воркеров через redis.
+    После FAILURE_THRESHOLD ошибок подряд (или сразу, если WB заблокировал надолго) размыкается
+    на время cooldown: вызовы падают с CircuitOpenError, не расходуя лимит и время воркера.
+    После cooldown пропускает запрос на пробу: успех замыкает, ошибка снова размыкает.
+    Короткую паузу из Retry-After не размыкает, а передаёт всем воркерам: check() вернёт, сколько подождать.
+    """
+
+    def __init__(self):
+        self._local: Dict[str, Tuple[int, float, float]] = {}
+
+    async def _get(self, key: str) -> Tuple[int, float, float]:
+        """
+        :return: (ошибок подряд, разомкнут до, пауза до)
+        """
+        try:
+            failures, open_until, pause_until = await get_redis().hmget(key, "failures", "open_until", "pause_until")
+            return int(failures or 0), float(open_until or 0), float(pause_until or 0)
+        except Exception as e:
+            logger.warning(f"Предохранитель: redis недоступен, считаем локально. Error: {e}")
+            return self._local.get(key, (0, 0.0, 0.0))
+
+    async def _set(self, key: str, failures: int, open_until: float, pause_until: float = 0.0):
+        self._local[key] = (failures, open_until, pause_until)
+        try:
+            redis = get_redis()
+            await redis.hset(key, mapping={"failures": failures, "open_until": open_until, "pause_until": pause_until})
+            await redis.expire(key, int(max(COOLDOWN, open_until - time.time())) + 3600)
+        except Exception as e:
+            logger.warning(f"Предохранитель: не удалось записать в redis. Error: {e}")
+
+    async def check(self, api_key: str, category: str) -> float:
+        """
+        :return: сколько секунд подождать перед запросом (WB попросил паузу), 0 - можно сразу
+        :raise CircuitOpenError: если предохранитель разомкнут
+        """
+        _, open_until, pause_until = await self._get(_breaker_key(api_key, category))
+        now = time.time()
+        if open_until > now:
+            raise CircuitOpenError(category, open_until - now)
+        return max(0.0, pause_until - now)
+
+    async def record_success(self, api_key: str, category: str):
+        key = _breaker_key(api_key, category)
+        failures, open_until, pause_until = await self._get(key)
+        if failures or open_until or pause_until:
+            await self._set(key, 0, 0.0)
+
+    async def record_failure(
+        self,
+        api_key: str,
+        category: str,
+        open_for: Optional[float] = None,
+        pause_for: Optional[float] = None,
+    ):
+        """
+        :param open_for: разомкнуть сразу на столько секунд (WB заблокировал надолго)
+        :param pause_for: WB прислал короткий Retry-After - все воркеры ждут столько секунд, не размыкая
+        """
+        key = _breaker_key(api_key, category)
+        failures, _, _ = await self._get(key)
+        failures += 1
+        if failures >= FAILURE_THRESHOLD:
+            cooldown = max(open_for or 0, pause_for or 0, COOLDOWN)
+            logger.warning(f"Предохранитель {category}: {failures} ошибок подряд, пауза {cooldown:.0f} сек")
+            # после паузы первая же ошибка снова размыкает (half-open)
+            await self._set(key, FAILURE_THRESHOLD - 1, time.time() + cooldown)
+        elif open_for:
+            await self._set(key, failures, time.time() + open_for)
+        elif pause_for:
+            # WB сам сказал, сколько ждать - пусть ждут все воркеры, а не только этот
+            await self._set(key, failures, 0.0, time.time() + pause_for)
+        else:
+            await self._set(key, failures, 0.0)
+
+
+circuit_breaker = CircuitBreaker()
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# Сколько кабинетов обрабатываем одновременно. Лимиты WB на аккаунт продавца, поэтому кабинеты друг другу не мешают
+CABINETS_CONCURRENCY = int(os.environ.get("WB_CABINETS_CONCURRENCY", 8))
+
+
+async def run_for_cabinets(
+        cabinets: List[Dict[str, Any]],
+        job: Callable[[Dict[str, Any]], Awaitable[Any]],
+        job_name: str,
+        concurrency: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Запустить job параллельно по всем кабинетам.
+    Ошибка в одном кабинете не останавливает остальные.
+
+    :param cabinets: строки из wb_wblk (нужны id и name)
+    :param job: корутина, принимающая кабинет
+    :param job_name: название для логов
+    :param concurrency: сколько кабинетов одновременно (по умолчанию WB_CABINETS_CONCURRENCY)
+    :return: список {"cabinet", "ok", "seconds", "result", "error"} по каждому кабинету
+    """
+    if not cabinets:
+        logger.warning(f"{job_name}: нет кабинетов для обработки")
+        return []
+
+    semaphore = asyncio.Semaphore(concurrency or CABINETS_CONCURRENCY)
+
+    async def run_one(cab):
+        async with semaphore:
+            started = time.monotonic()
+            summary = {"cabinet": cab["name"], "ok": True, "result": None, "error": None}
+            try:
+                summary["result"] = await job(cab)
+            except Exception as e:
+                summary["ok"] = False
+                summary["error"] = repr(e)
+                logger.exception(f"{job_name}: ошибка в кабинете {cab['name']}. Error: {e}")
+            summary["seconds"] = round(time.monotonic() - started, 2)
+            return summary
+
+    started = time.monotonic()
+    summaries = await asyncio.gather(*(run_one(cab) for cab in cabinets))
+
+    failed = [s for s in summaries if not s["ok"]]
+    slowest = max(summaries, key=lambda s: s["seconds"])
+    logger.info(
+        f"{job_name}: {len(summaries) - len(failed)}/{len(summaries)} кабинетов успешно "
+        f"за {time.monotonic() - started:.2f} сек. Самый долгий: {slowest['cabinet']} ({slowest['seconds']} сек). "
+        f"По кабинетам: " + ", ".join(f"{s['cabinet']}={s['seconds']}с{'' if s['ok'] else ' (ошибка)'}" for s in summaries)
+    )
+    return summaries
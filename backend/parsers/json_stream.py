@@ -0,0 +1,80 @@
+import codecs
+import json
+from json.decoder import WHITESPACE
+from typing import Any, AsyncIterator, List
+
+import aiohttp
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+async def iter_json_array(content: aiohttp.StreamReader, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[Any]:
+    """
+    Потоково разобрать JSON-массив верхнего уровня из тела ответа и отдавать элементы по одному.
+    В памяти держим только недочитанный хвост буфера, а не весь ответ.
+
+    :param content: response.content из aiohttp
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    started = False
+    finished = False
+
+    async def chunks():
+        async for chunk in content.iter_chunked(chunk_size):
+            yield text_decoder.decode(chunk), False
+        yield text_decoder.decode(b"", final=True), True
+
+    async for text, final in chunks():
+        buf += text
+        pos = 0
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"Ожидался JSON-массив, а пришло: {buf[pos:pos + 200]}")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ",":
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                finished = True
+                pos += 1
+                break
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break  # элемент ещё не докачан
+            if not final and (end == len(buf) or buf[end] not in " \t\r\n,]"):
+                break  # число на краю буфера может быть не дочитано (1 -> 1.5e10)
+            yield obj
+            pos = end
+        buf = buf[pos:]
+        if finished:
+            return
+
+    if not started:
+        return
+    raise ValueError("JSON-массив оборвался")
+
+
+async def batched(items: AsyncIterator[Any], size: int) -> AsyncIterator[List[Any]]:
+    """
+    Собрать элементы асинхронного итератора в пачки по size.
+    """
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,73 @@
+import json
+from typing import Dict, List, Optional
+
+from redis.exceptions import ResponseError
+
+from database.redis_conn import get_redis
+
+
+# Очередь изменений цен по кабинету: redis hash {nmID: {"price": ..., "discount": ...}}.
+# Повторное изменение того же nmID до отправки перезаписывает поле - в WB уходит только последнее значение
+QUEUE_KEY = "wb:price_queue:{lk_id}"
+PROCESSING_KEY = "wb:price_queue:{lk_id}:processing"
+LOCK_KEY = "wb:price_queue:{lk_id}:lock"
+LOCK_TTL = 600  # сек
+
+
+async def enqueue_price_changes(lk_id: int, changes: List[Dict[str, int]]) -> int:
+    """
+    Поставить изменения цен в очередь кабинета. Цена и скидка одного nmID сливаются:
+    изменение только скидки не затирает ранее поставленную цену.
+    :param changes: [{"nmID": int, "price": int, "discount": int}], price или discount можно не указывать
+    :return: сколько nmID сейчас в очереди
+    """
+    redis = get_redis()
+    key = QUEUE_KEY.format(lk_id=lk_id)
+    nm_ids = [str(change["nmID"]) for change in changes]
+    current = dict(zip(nm_ids, await redis.hmget(key, nm_ids))) if nm_ids else {}
+
+    mapping = {}
+    for nm_id, change in zip(nm_ids, changes):
+        item = json.loads(mapping.get(nm_id) or current.get(nm_id) or "{}")
+        item.update({k: change[k] for k in ("price", "discount") if change.get(k) is not None})
+        if item:
+            mapping[nm_id] = json.dumps(item)
+    if mapping:
+        await redis.hset(key, mapping=mapping)
+    return await redis.hlen(key)
+
+
+async def take_price_changes(lk_id: int) -> Optional[List[Dict[str, int]]]:
+    """
+    Забрать всё, что накопилось в очереди кабинета, для отправки в WB.
+    Новые изменения, пришедшие во время отправки, копятся в очереди уже к следующему разу.
+    Если прошлая отправка упала на полпути, сначала отдаём её остаток.
+    :return: [{"nmID", "price", "discount"}] или None, если кабинет уже отправляет другой воркер
+    """
+    redis = get_redis()
+    if not await redis.set(LOCK_KEY.format(lk_id=lk_id), "1", nx=True, ex=LOCK_TTL):
+        return None
+
+    processing = PROCESSING_KEY.format(lk_id=lk_id)
+    if not await redis.exists(processing):
+        try:
+            await redis.rename(QUEUE_KEY.format(lk_id=lk_id), processing)
+        except ResponseError:
+            return []  # очередь пуста
+
+    items = await redis.hgetall(processing)
+    return [{"nmID": int(nm_id), **json.loads(item)} for nm_id, item in items.items()]
+
+
+async def finish_price_changes(lk_id: int, failed: List[Dict[str, int]]):
+    """
+    Закрыть отправку: неотправленные изменения вернуть в очередь (если за это время по nmID
+    не пришло более свежее), снять блокировку.
+    """
+    redis = get_redis()
+    queue = QUEUE_KEY.format(lk_id=lk_id)
+    for change in failed:
+        await redis.hsetnx(
+            queue, str(change["nmID"]), json.dumps({k: v for k, v in change.items() if k != "nmID"})
+        )
+    await redis.delete(PROCESSING_KEY.format(lk_id=lk_id), LOCK_KEY.format(lk_id=lk_id))
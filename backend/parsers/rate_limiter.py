@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import time
+from typing import Dict, Tuple
+
+from database.redis_conn import get_redis
+from parsers.wb_endpoints import WB_ENDPOINTS, WB_QUOTAS, get_quota
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# Token bucket в redis. Время берём у redis, чтобы все воркеры жили по одним часам.
+# Возвращает {сколько ждать, сколько токенов осталось}. Токен списывается только если его хватает.
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if requested > 0 then
+    if tokens >= requested then
+        tokens = tokens - requested
+    else
+        wait = (requested - tokens) / rate
+    end
+end
+if wait == 0 then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+end
+return {tostring(wait), tostring(tokens)}
+"""
+
+
+def get_category(type_: str) -> str:
+    endpoint = WB_ENDPOINTS.get(type_)
+    return endpoint.category if endpoint else "default"
+
+
+def _bucket_key(api_key: str, category: str) -> str:
+    # сам токен в redis не светим
+    token_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return f"wb:rl:{token_hash}:{category}"
+
+
+def _bucket_params(category: str) -> Tuple[float, int]:
+    limit, period, burst = get_quota(category)
+    return limit / period, burst
+
+
+class RateLimiter:
+    """
+    Общий для всех воркеров celery лимитер запросов к WB.
+    Ключ бакета - (токен кабинета, категория метода WB).
+    Если redis недоступен, работаем по локальным бакетам процесса.
+    """
+
+    def __init__(self):
+        self._script = None
+        self._local: Dict[str, Tuple[float, float]] = {}
+
+    async def _call(self, key: str, rate: float, capacity: int, requested: int) -> Tuple[float, float]:
+        try:
+            redis = get_redis()
+            if self._script is None or self._script.registered_client is not redis:
+                self._script = redis.register_script(_TOKEN_BUCKET_LUA)
+            wait, tokens = await self._script(keys=[key], args=[rate, capacity, requested])
+            return float(wait), float(tokens)
+        except Exception as e:
+            logger.warning(f"Лимитер: redis недоступен, считаем лимит локально. Error: {e}")
+            return self._call_local(key, rate, capacity, requested)
+
+    def _call_local(self, key: str, rate: float, capacity: int, requested: int) -> Tuple[float, float]:
+        now = time.monotonic()
+        tokens, ts = self._local.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(0.0, now - ts) * rate)
+        wait = 0.0
+        if requested > 0:
+            if tokens >= requested:
+                tokens -= requested
+            else:
+                wait = (requested - tokens) / rate
+        if wait == 0:
+            self._local[key] = (tokens, now)
+        return wait, tokens
+
+    async def acquire(self, api_key: str, type_: str, requested: int = 1) -> float:
+        """
+        Дождаться разрешения на запрос.
+        :param api_key: токен кабинета
+        :param type_: param["type"] из wb_api
+        :param requested: сколько запросов списать
+        :return: сколько секунд прождали
+        """
+        category = get_category(type_)
+        key = _bucket_key(api_key, category)
+        rate, capacity = _bucket_params(category)
+
+        waited = 0.0
+        while True:
+            wait, _ = await self._call(key, rate, capacity, requested)
+            if wait <= 0:
+                return waited
+            waited += wait
+            await asyncio.sleep(wait)
+
+    async def remaining(self, api_key: str, type_: str) -> float:
+        """
+        Сколько запросов можно сделать прямо сейчас (ничего не списывает).
+        :param type_: param["type"] из wb_api или название категории
+        """
+        category = type_ if type_ in WB_QUOTAS else get_category(type_)
+        rate, capacity = _bucket_params(category)
+        _, tokens = await self._call(_bucket_key(api_key, category), rate, capacity, 0)
+        return tokens
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from database.redis_conn import get_redis
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# Сколько секунд держим ответ WB по param["type"]. Типов, которых здесь нет, кэш не касается.
+# Остатки и заказы WB сам обновляет раз в 30 минут
+WB_CACHE_TTL: Dict[str, int] = {
+    "get_balance_lk": 60,
+    "budget_advert": 60,
+    "list_adverts_id": 300,
+    "info_about_rks": 300,
+    "get_products_and_prices": 300,
+    "get_stocks_data": 1800,
+}
+
+# Изменяющие запросы -> какие закэшированные типы этого кабинета после них устаревают
+WB_CACHE_INVALIDATES: Dict[str, Tuple[str, ...]] = {
+    "start_advert": ("list_adverts_id", "info_about_rks"),
+    "add_bidget_to_adv": ("get_balance_lk", "budget_advert"),
+    "set_price_and_discount": ("get_products_and_prices",),
+}
+
+L1_MAX_ITEMS = 1000
+L1_MAX_TTL = 60  # в памяти процесса держим не дольше минуты, дальше перечитываем из redis
+
+
+def _cabinet_key(api_key: str) -> str:
+    # как и в лимитере, сам токен в redis не кладём
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+class WbCache:
+    """
+    Кэш ответов WB для редко меняющихся методов: L1 в памяти процесса + общий для воркеров redis.
+    Ключ - (кабинет, param["type"], параметры запроса).
+    """
+
+    def __init__(self):
+        self._l1: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._stats = {"l1_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    @staticmethod
+    def ttl(type_: str) -> int:
+        return WB_CACHE_TTL.get(type_, 0)
+
+    @staticmethod
+    def key(api_key: str, type_: str, request: Any) -> str:
+        """
+        :param request: то, что уходит в WB (url, params, body) - из prepare_wb_request
+        """
+        digest = hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()[:32]
+        return f"wb:cache:{_cabinet_key(api_key)}:{type_}:{digest}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._l1.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._l1.move_to_end(key)
+                self._stats["l1_hits"] += 1
+                return value
+            del self._l1[key]
+
+        try:
+            redis = get_redis()
+            raw, ttl = await redis.get(key), await redis.ttl(key)
+        except Exception as e:
+            logger.warning(f"Кэш WB: redis недоступен. Error: {e}")
+            raw, ttl = None, 0
+
+        if raw is None:
+            self._stats["misses"] += 1
+            return None
+
+        value = json.loads(raw)
+        self._stats["redis_hits"] += 1
+        self._set_l1(key, value, ttl)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: int):
+        self._set_l1(key, value, ttl)
+        self._stats["stores"] += 1
+        try:
+            await get_redis().set(key, json.dumps(value, default=str), ex=ttl)
+        except Exception as e:
+            logger.warning(f"Кэш WB: не удалось записать в redis. Error: {e}")
+
+    def _set_l1(self, key: str, value: Any, ttl: int):
+        if ttl <= 0:
+            return
+        self._l1[key] = (time.monotonic() + min(ttl, L1_MAX_TTL), value)
+        self._l1.move_to_end(key)
+        while len(self._l1) > L1_MAX_ITEMS:
+            self._l1.popitem(last=False)
+
+    async def invalidate(self, api_key: str, type_: Optional[str] = None) -> int:
+        """
+        Сбросить кэш кабинета: все типы или только type_.
+        L1 сбрасывается только в этом процессе, в остальных доживает не больше L1_MAX_TTL сек.
+        :return: сколько ключей удалено из redis
+        """
+        prefix = f"wb:cache:{_cabinet_key(api_key)}:{type_ + ':' if type_ else ''}"
+        for key in [key for key in self._l1 if key.startswith(prefix)]:
+            del self._l1[key]
+        self._stats["invalidations"] += 1
+
+        deleted = 0
+        try:
+            redis = get_redis()
+            keys = [key async for key in redis.scan_iter(match=prefix + "*", count=500)]
+            if keys:
+                deleted = await redis.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Кэш WB: не удалось сбросить ключи {prefix}*. Error: {e}")
+        return deleted
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+
+wb_cache = WbCache()
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import random
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import aiohttp
+
+from database.DataBase import get_pool_stats
+from parsers.rate_limiter import get_category, rate_limiter
+from parsers.circuit_breaker import circuit_breaker, WbApiError
+from parsers.wb_cache import wb_cache
+
+import logging
+from context_logger import ContextLogger
+logger = ContextLogger(logging.getLogger("parsers"))
+
+
+# Таймауты (сек) по категориям методов WB. Статистика и отчеты отвечают долго
+WB_TIMEOUTS: Dict[str, float] = {
+    "statistics_orders": 180,
+    "statistics_stocks": 180,
+    "statistics_incomes": 180,
+    "analytics_csv": 300,
+    "default": 60,
+}
+
+CONNECTOR_LIMIT = int(os.environ.get("WB_HTTP_LIMIT", 100))  # всего соединений
+CONNECTOR_LIMIT_PER_HOST = int(os.environ.get("WB_HTTP_LIMIT_PER_HOST", 30))  # на один *.wildberries.ru
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 60
+
+# Повторы запросов: на 429 и 5xx, с паузой из Retry-After / X-Ratelimit-Retry или экспоненциальной
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = int(os.environ.get("WB_MAX_RETRIES", 3))
+RETRY_BASE = 2  # сек
+RETRY_MAX = 60  # сек - если WB просит ждать дольше, не ждём, а размыкаем предохранитель
+
+
+def retry_after(headers) -> Optional[float]:
+    """
+    Сколько секунд WB просит подождать: Retry-After (секунды или HTTP-дата) или X-Ratelimit-Retry.
+    """
+    for header in ("Retry-After", "X-Ratelimit-Retry"):
+        value = headers.get(header)
+        if not value:
+            continue
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def backoff(attempt: int) -> float:
+    return min(RETRY_MAX, RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class WbClient:
+    """
+    Долгоживущий http-клиент к API WB на процесс воркера.
+    Держит одну aiohttp-сессию с пулом соединений, кэшем DNS и keep-alive,
+    и считает, сколько соединений переиспользовано.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._loop = None
+        self._stats = {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0,
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=CONNECTOR_LIMIT,
+                limit_per_host=CONNECTOR_LIMIT_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ssl=False,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, trace_configs=[self._trace_config()])
+            self._loop = loop
+        return self._session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        def counter(name):
+            async def inc(session, ctx, params):
+                self._stats[name] += 1
+            return inc
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(counter("requests"))
+        trace.on_connection_create_end.append(counter("new_connections"))
+        trace.on_connection_reuseconn.append(counter("reused_connections"))
+        trace.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        trace.on_dns_cache_miss.append(counter("dns_cache_misses"))
+        return trace
+
+    def request(self, method: str, url: str, type_: str, **kwargs):
+        """
+        Запрос к WB. Возвращает async context manager с ответом, как aiohttp.
+        :param method: get/post
+        :param type_: param["type"] из wb_api, по нему выбирается таймаут
+        """
+        timeout = WB_TIMEOUTS.get(get_category(type_), WB_TIMEOUTS["default"])
+        return self._get_session().request(
+            method.upper(), url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs
+        )
+
+    @asynccontextmanager
+    async def call(self, method: str, url: str, type_: str, api_key: str, **kwargs):
+        """
+        Запрос к WB с лимитером, повторами и предохранителем. Отдаёт ответ, как request().
+        429/5xx/обрыв соединения повторяются до MAX_RETRIES раз, остальные статусы отдаются как есть.
+            async with client.call("get", url, param["type"], param["API_KEY"], params=params) as response:
+                ...
+        :param api_key: токен кабинета - ключ лимитера и предохранителя
+        Короткую паузу, которую WB назначил кабинету (Retry-After до RETRY_MAX сек), выжидает и не считает за попытку.
+        :raise CircuitOpenError: предохранитель (кабинет, категория) разомкнут - ошибки подряд или блок дольше RETRY_MAX
+        :raise WbApiError: повторы не помогли
+        """
+        category = get_category(type_)
+        error = None
+        for attempt in range(MAX_RETRIES + 1):
+            # WB попросил паузу (Retry-After не длиннее RETRY_MAX) - ждём её, а не падаем
+            while (pause := await circuit_breaker.check(api_key, category)) > 0:
+                logger.info(f"WB {type_}: пауза по Retry-After, ждём {pause:.1f} сек")
+                await asyncio.sleep(pause + random.uniform(0, 0.5))
+            await rate_limiter.acquire(api_key, type_)
+
+            yielded = False
+            wait = None
+            try:
+                async with self.request(method, url, type_, **kwargs) as response:
+                    if response.status not in RETRY_STATUSES:
+                        await circuit_breaker.record_success(api_key, category)
+                        yielded = True
+                        yield response
+                        return
+                    wait = retry_after(response.headers)
+                    error = WbApiError(response.status, await response.text())
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                if yielded:
+                    raise
+                error = WbApiError(None, repr(e))
+
+            if wait is not None and wait > RETRY_MAX:
+                # WB заблокировал кабинет надолго (например, feedbacks на 60 сек+) - не ждём, а размыкаем
+                await circuit_breaker.record_failure(api_key, category, open_for=wait)
+                raise error
+            await circuit_breaker.record_failure(api_key, category, pause_for=wait)
+            if attempt == MAX_RETRIES:
+                break
+            # к паузе из заголовка небольшой запас, чтобы не упереться в собственный предохранитель
+            delay = wait + 0.5 if wait is not None else backoff(attempt)
+            logger.warning(f"WB {type_}: {error}. Повтор {attempt + 1}/{MAX_RETRIES} через {delay:.1f} сек")
+            await asyncio.sleep(delay)
+
+        raise error
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
+
+    @contextmanager
+    def report(self, job_name: str):
+        """
+        Залогировать статистику соединений (http к WB и пула БД) за время выполнения джобы.
+        """
+        before = self.stats()
+        cache_before = wb_cache.stats()
+        pool_before = get_pool_stats()
+        try:
+            yield
+        finally:
+            diff = {k: v - before[k] for k, v in self._stats.items()}
+            cache = {k: v - cache_before[k] for k, v in wb_cache.stats().items()}
+            pool = get_pool_stats()
+            acquired = pool["acquired"] - pool_before["acquired"]
+            pool_wait = pool["avg_wait_seconds"] * pool["acquired"] - pool_before["avg_wait_seconds"] * pool_before["acquired"]
+            opened = diff["new_connections"] + diff["reused_connections"]
+            reuse = diff["reused_connections"] / opened * 100 if opened else 0
+            logger.info(
+                f"{job_name}: запросов к WB {diff['requests']}, новых соединений {diff['new_connections']}, "
+                f"переиспользовано {diff['reused_connections']} ({reuse:.0f}%), "
+                f"DNS кэш {diff['dns_cache_hits']}/{diff['dns_cache_hits'] + diff['dns_cache_misses']}, "
+                f"ответов из кэша {cache['l1_hits'] + cache['redis_hits']} (промахов {cache['misses']}), "
+                f"пул БД {pool['in_use']}/{pool['size']} (макс. {pool['max_size']}), соединений взято {acquired}, "
+                f"ожидание acquire в среднем {pool_wait / acquired if acquired else 0:.3f} сек, "
+                f"максимум за процесс {pool['max_wait_seconds']:.3f} сек"
+            )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_client = WbClient()
+
+
+def get_wb_client() -> WbClient:
+    return _client
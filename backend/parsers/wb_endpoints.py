@@ -0,0 +1,319 @@
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+
+class Quota(NamedTuple):
+    """
+    Лимит WB на один аккаунт продавца: limit запросов за period секунд, burst - сколько можно сразу.
+    """
+    limit: int
+    period: float
+    burst: int
+
+
+class WbEndpoint(NamedTuple):
+    """
+    Метод API WB.
+    url может содержать {поля} из param, например {downloadId}.
+    build(param) -> (params, data): query-параметры и тело запроса.
+    daily_limit - отдельный суточный лимит метода (например, 20 отчётов в сутки), если есть.
+    """
+    type: str
+    method: str
+    url: str
+    category: str
+    build: Callable[[Dict[str, Any]], Tuple[Any, Any]]
+    daily_limit: Optional[int] = None
+
+
+# Лимиты WB по категориям методов. Все методы одной категории делят один бакет
+WB_QUOTAS: Dict[str, Quota] = {
+    "statistics_orders": Quota(1, 60, 1),  # 1 запрос в минуту
+    "statistics_stocks": Quota(1, 60, 1),  # 1 запрос в минуту
+    "statistics_incomes": Quota(1, 60, 1),  # 1 запрос в минуту
+    "advert_promotion": Quota(5, 1, 5),
+    "advert_balance": Quota(1, 1, 1),  # 1 запрос в секунду
+    "advert_budget": Quota(4, 1, 4),  # 4 запроса в секунду
+    "advert_start": Quota(5, 1, 5),  # 5 запросов в секунду
+    "advert_deposit": Quota(1, 1, 1),  # 1 запрос в секунду
+    "content": Quota(100, 60, 5),  # 100 в минуту на ВСЕ методы Контента
+    "prices": Quota(10, 6, 5),  # 10 запросов за 6 секунд
+    "analytics_nm_report": Quota(3, 60, 3),
+    "analytics_stocks_report": Quota(3, 60, 3),
+    "analytics_csv": Quota(3, 60, 3),  # генерация, статус и скачивание отчетов
+    "feedbacks": Quota(1, 1, 1),  # 1 в секунду, при 3 в секунду блок на 60 сек
+    "default": Quota(1, 1, 1),  # для неизвестных типов - осторожно
+}
+
+
+WB_ENDPOINTS: Dict[str, WbEndpoint] = {}
+
+
+def endpoint(type_: str, method: str, url: str, category: str, daily_limit: Optional[int] = None):
+    """
+    Декоратор: зарегистрировать метод WB с функцией, собирающей (params, data) из param.
+    """
+    def register(build):
+        WB_ENDPOINTS[type_] = WbEndpoint(type_, method, url, category, build, daily_limit)
+        return build
+    return register
+
+
+def get_endpoint(type_: str) -> WbEndpoint:
+    try:
+        return WB_ENDPOINTS[type_]
+    except KeyError:
+        raise ValueError(f"Неизвестный метод WB: {type_}")
+
+
+def get_quota(category: str) -> Quota:
+    return WB_QUOTAS.get(category, WB_QUOTAS["default"])
+
+
+@endpoint("info_about_rks", "post", "https://advert-api.wildberries.ru/adv/v1/promotion/adverts", "advert_promotion")
+def _info_about_rks(param):
+    return {}, param['id_lks']  # максимум 50 рк
+
+
+@endpoint("list_adverts_id", "get", "https://advert-api.wildberries.ru/adv/v1/promotion/count", "advert_promotion")
+def _list_adverts_id(param):
+    return {}, {}
+
+
+@endpoint("get_balance_lk", "get", "https://advert-api.wildberries.ru/adv/v1/balance", "advert_balance")
+def _get_balance_lk(param):
+    # получить balance-счет net-баланс bonus-бонусы личный кабинет
+    return {}, {}
+
+
+@endpoint("orders", "get", "https://statistics-api.wildberries.ru/api/v1/supplier/orders", "statistics_orders")
+def _orders(param):
+    # Данные обновляются раз в 30 минут.
+    params = {
+        "dateFrom": param["date_from"], #Дата и время последнего изменения по заказу. `2019-06-20` `2019-06-20T23:59:59`
+        "flag": param["flag"],  #если flag=1 то только за выбранный день если 0 то
+        # со дня до сегодня но не более 100000 строк
+    }
+    return params, {}
+
+
+@endpoint("start_advert", "get", "https://advert-api.wildberries.ru/adv/v0/start", "advert_start")
+def _start_advert(param):
+    # запустить рекламу
+    return {"id": param["advert_id"]}, {}  # int
+
+
+@endpoint("budget_advert", "get", "https://advert-api.wildberries.ru/adv/v1/budget", "advert_budget")
+def _budget_advert(param):
+    # получить бюджет кампании
+    return {"id": param["advert_id"]}, {}  # int
+
+
+@endpoint("add_bidget_to_adv", "post", "https://advert-api.wildberries.ru/adv/v1/budget/deposit", "advert_deposit")
+def _add_bidget_to_adv(param):
+    # пополнить бюджет рекламной кампании
+    params = {
+        "id": param["advert_id"],
+    }
+    data = {
+        "sum": param["sum"],  # int
+        "type": param["source"],  # int: 0-счет 1-баланс 3-бонусы
+        "return": param["return"],  # bool: в ответе вернется обновлённый размер бюджета кампании если True
+    }
+    return params, data
+
+
+@endpoint("get_nmids", "post", "https://content-api.wildberries.ru/content/v2/get/cards/list", "content")
+def _get_nmids(param):
+    # получить все артикулы
+    data = {
+        "settings": {
+            "cursor": {
+                "limit": 100
+            },
+            "filter": {
+                "withPhoto": -1
+            },
+        }
+    }
+    if param.get("updatedAt"):
+        data["settings"]["cursor"]["updatedAt"] = param["updatedAt"]
+    if param.get("nmID"):
+        data["settings"]["cursor"]["nmID"] = param["nmID"]
+    return {}, data
+
+
+@endpoint("get_delivery_fbw", "get", "https://statistics-api.wildberries.ru/api/v1/supplier/incomes", "statistics_incomes")
+def _get_delivery_fbw(param):
+    return {"dateFrom": param["dateFrom"]}, {}
+
+
+@endpoint(
+    "get_products_and_prices", "get", "https://discounts-prices-api.wildberries.ru/api/v2/list/goods/filter", "prices"
+)
+def _get_products_and_prices(param):
+    # получить товары с ценами
+    # максимальный лимит 1000
+    params = {
+        "limit": param.get("limit", 1000),
+        "offset": param.get("offset", 0),
+    }
+    if param.get("filterNmID"):  # int: только этот артикул
+        params["filterNmID"] = param["filterNmID"]
+    return params, {}
+
+
+@endpoint(
+    "get_stat_cart_sort_nm", "post", "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/detail",
+    "analytics_nm_report",
+)
+def _get_stat_cart_sort_nm(param):
+    # сортировка по nmID/предметам/брендам/тегам
+    data = {
+        "period": {
+            "begin": param["begin"],
+            "end": param["end"],
+        },
+        "page": 1
+    }
+    return {}, data
+
+
+@endpoint("get_feedback", "get", "https://feedbacks-api.wildberries.ru/api/v1/feedbacks", "feedbacks")
+def _get_feedback(param):
+    # Если превысить лимит в 3 запроса в секунду, отправка запросов будет заблокирована на 60 секунд
+    params = {
+        "isAnswered": param["isAnswered"],  # str: Обработанные отзывы (True) или необработанные отзывы(False)
+        "take": param["take"],  # int: Количество отзывов (max. 5 000)
+        "skip": param["skip"],  # int: Количество отзывов для пропуска (max. 199990)
+
+    }
+    if param.get("nmId"):  # по артикулу
+        params["nmId"] = param["nmId"]
+    if param.get("order"):  # str: сортировка по дате "dateAsc" "dateDesc"
+        params["order"] = param["order"]
+    if param.get("dateFrom"):  # int: Дата начала периода в формате Unix timestamp
+        params["dateFrom"] = param["dateFrom"]
+    if param.get("dateTo"):  # int: Дата конца периода в формате Unix timestamp
+        params["dateTo"] = param["dateTo"]
+    return params, {}
+
+
+@endpoint(
+    "warehouse_data", "post", "https://seller-analytics-api.wildberries.ru/api/v2/stocks-report/offices",
+    "analytics_stocks_report",
+)
+def _warehouse_data(param):
+    # Метод формирует набор данных об остатках по складам.
+    # Данные по складам Маркетплейс (FBS) приходят в агрегированном виде — по всем сразу, без детализации по
+    # конкретным складам — эти записи будут с "regionName":"Маркетплейс" и "offices":[].
+    data = {
+        "currentPeriod": {
+            "start": param["start"], #"2024-02-10" Не позднее end. Не ранее 3 месяцев от текущей даты
+            "end": param["end"], #Дата окончания периода. Не ранее 3 месяцев от текущей даты
+        },
+        "stockType": "" if not param.get("stockType") else param["stockType"], #"" — все wb—Склады WB mp—Склады Маркетплейс (FBS)
+        "skipDeletedNm": True if not param.get("skipDeletedNm") else param["skipDeletedNm"], #Скрыть удалённые товары
+    }
+    return {}, data
+
+
+@endpoint(
+    "seller_analytics_generate", "post", "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/downloads",
+    "analytics_csv", daily_limit=20,
+)
+def _seller_analytics_generate(param):
+    # Метод создаёт задание на генерацию отчёта с расширенной аналитикой продавца.
+    # https://dev.wildberries.ru/openapi/analytics#tag/Analitika-prodavca-CSV/paths/~1api~1v2~1nm-report~1downloads/post
+    # Ниже типы reportType
+    # DETAIL_HISTORY_REPORT GROUPED_HISTORY_REPORT SEARCH_QUERIES_PREMIUM_REPORT_GROUP
+    # SEARCH_QUERIES_PREMIUM_REPORT_PRODUCT SEARCH_QUERIES_PREMIUM_REPORT_TEXT STOCK_HISTORY_REPORT_CSV
+
+    statuses = [
+        "deficient",
+        "actual",
+        "balanced",
+        "nonActual",
+        "nonLiquid",
+        "invalidData"
+    ]
+
+    data = {
+        "id": param["id"], # ID отчёта в UUID-формате
+        "reportType": param["reportType"],
+        "userReportName": param["userReportName"], # Название отчета
+    }
+    if param["reportType"] == "DETAIL_HISTORY_REPORT":
+        data["params"] = {
+            "startDate": param["start"],  # str
+            "endDate": param["end"],
+            "skipDeletedNm": param.get("skipDeletedNm", True),  # скрыть удаленные товары
+        }
+    elif param["reportType"] == "STOCK_HISTORY_REPORT_CSV":
+        data["params"] = {
+            "currentPeriod": {
+                "start": param["start"],
+                "end": param["end"],
+            },  # str
+            "stockType": param.get("stockType", ""),
+            "skipDeletedNm": param.get("skipDeletedNm", True),  # скрыть удаленные товары
+            "availabilityFilters": param.get("availabilityFilters", statuses), # List[str]
+            "orderBy": {
+                "field": param.get("orderBy", "officeMissingTime"),
+                "mode": param.get("mode", "desc"),
+            }
+        }
+    return {}, data
+
+
+@endpoint(
+    "seller_analytics_report", "get",
+    "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/downloads/file/{downloadId}", "analytics_csv",
+)
+def _seller_analytics_report(param):
+    # Можно получить отчёт, который сгенерирован за последние 48 часов.
+    # Отчёт будет загружен внутри архива ZIP в формате CSV.
+    return {"downloadId": param["downloadId"]}, {}  # string <uuid>
+
+
+@endpoint(
+    "seller_analytics_status", "get", "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/downloads",
+    "analytics_csv",
+)
+def _seller_analytics_status(param):
+    # Статусы заказанных отчётов: WAITING PROCESSING SUCCESS RETRY FAILED
+    return [("filter[downloadIds]", download_id) for download_id in param["downloadIds"]], {}  # List[str] <uuid>
+
+
+@endpoint("get_stocks_data", "get", "https://statistics-api.wildberries.ru/api/v1/supplier/stocks", "statistics_stocks")
+def _get_stocks_data(param):
+    # Метод предоставляет количество остатков товаров на складах WB.
+    # Данные обновляются раз в 30 минут.
+    return {"dateFrom": param["dateFrom"]}, {}  #"2019-06-20"  Время передаётся в часовом поясе Мск (UTC+3).
+
+
+@endpoint("set_price_and_discount", "post", "https://discounts-prices-api.wildberries.ru/api/v2/upload/task", "prices")
+def _set_price_and_discount(param):
+    # Метод устанавливает цены и скидки для товаров.
+    # Максимум 1 000 товаров
+    # Цена и скидка не могут быть пустыми одновременно
+    # Если новая цена со скидкой будет хотя бы в 3 раза меньше старой, она попадёт в карантин, и товар будет продаваться по старой цене
+    return {}, {"data": param["data"]}  # List[dict]  где dict {"nmID": int, "price": int, "discount": int}
+
+
+@endpoint("get_question", "get", "https://feedbacks-api.wildberries.ru/api/v1/questions", "feedbacks")
+def _get_question(param):
+    # Метод предоставляет список вопросов по заданным фильтрам.
+    # Можно получить максимум 10 000 вопросов в одном ответе
+    # Если превысить лимит в 3 запроса в секунду, отправка запросов будет заблокирована на 60 секунд
+    params = {
+        "isAnswered": param["isAnswered"], # bool отвеченные (True)
+        "take": param.get("take", 10000), # Количество запрашиваемых вопросов (максимально допустимое значение для параметра - 10 000, при этом сумма значений параметров take и skip не должна превышать 10 000)
+        "skip": param.get("skip", 0), # Количество вопросов для пропуска (максимально допустимое значение для параметра - 10 000, при этом сумма значений параметров take и skip не должна превышать 10 000)
+    }
+    if param.get("order"):  # str: сортировка по дате "dateAsc" "dateDesc"
+        params["order"] = param["order"]
+    if param.get("dateFrom"):  # int: Дата начала периода в формате Unix timestamp
+        params["dateFrom"] = param["dateFrom"]
+    if param.get("dateTo"):  # int: Дата конца периода в формате Unix timestamp
+        params["dateTo"] = param["dateTo"]
+    return params, {}
@@ -0,0 +1,69 @@
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from parsers.wb_endpoints import get_endpoint, get_quota
+
+
+class PlannedCall(NamedTuple):
+    at: float  # через сколько секунд от начала плана выполнять
+    cabinet: str
+    api_key: str
+    type: str
+    index: int  # номер вызова внутри задачи
+
+
+def plan_calls(jobs: List[Dict[str, Any]]) -> Tuple[List[PlannedCall], List[Dict[str, Any]]]:
+    """
+    Разложить вызовы WB по времени так, чтобы каждый бакет (кабинет, категория лимита) был загружен
+    полностью, но не переполнен. Методы одной категории (например, все методы Контента - 100 в минуту)
+    делят один бакет, их вызовы чередуются.
+    Вызовы сверх суточного лимита метода (daily_limit) в план не попадают.
+    План только для оценки (manage.py plan_wb_quota): сами вызовы ограничивает rate_limiter в wb_api.
+
+    :param jobs: [{"cabinet": имя, "api_key": токен, "type": param["type"], "calls": сколько вызовов}]
+    :return: (вызовы по возрастанию at, сводка по бакетам {"cabinet", "category", "calls", "seconds", "dropped"})
+    """
+    buckets: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+    daily_used: Dict[Tuple[str, str], int] = defaultdict(int)
+    dropped: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    for job in jobs:
+        endpoint = get_endpoint(job["type"])
+        calls = job["calls"]
+        if endpoint.daily_limit is not None:
+            used_key = (job["api_key"], job["type"])
+            allowed = max(0, min(calls, endpoint.daily_limit - daily_used[used_key]))
+            daily_used[used_key] += allowed
+            dropped[(job["api_key"], endpoint.category)] += calls - allowed
+            calls = allowed
+        buckets[(job["api_key"], endpoint.category)].append({**job, "calls": calls})
+
+    plan = []
+    summary = []
+    for (api_key, category), bucket_jobs in buckets.items():
+        limit, period, burst = get_quota(category)
+        rate = limit / period
+
+        # по очереди по одному вызову от каждой задачи, пока вызовы не кончатся
+        queue = []
+        for index in range(max(job["calls"] for job in bucket_jobs)):
+            queue.extend((job, index) for job in bucket_jobs if index < job["calls"])
+
+        # бакет начинается полным (burst токенов) и пополняется на rate в секунду:
+        # k-й вызов (с нуля) можно сделать, когда накопится k + 1 токен
+        at = 0.0
+        for k, (job, index) in enumerate(queue):
+            at = max(0.0, (k + 1 - burst) / rate)
+            plan.append(PlannedCall(at, job["cabinet"], api_key, job["type"], index))
+
+        summary.append({
+            "cabinet": bucket_jobs[0]["cabinet"],
+            "category": category,
+            "calls": len(queue),
+            "seconds": round(at, 2),
+            "dropped": dropped[(api_key, category)],
+        })
+
+    plan.sort(key=lambda call: call.at)
+    return plan, summary
+
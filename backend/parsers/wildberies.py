@@ -1,283 +1,89 @@
 import asyncio
+import hashlib
+import random
+import tempfile
+import time
 import uuid
 import zipfile
 import io
 import csv
-import aiohttp
-from datetime import datetime, timedelta
+import itertools
+import operator
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 import json
-from database.funcs_db import get_data_from_db, add_set_data_from_db
-from database.DataBase import async_connect_to_database
+from database.funcs_db import (
+    get_data_from_db, add_set_many, get_sync_state, set_sync_state,
+    find_reusable_report, reserve_report_job, update_report_job, copy_upsert,
+)
+from database.DataBase import acquire, async_connect_to_database
+from database.orders_daily import (
+    apply_orders_daily, fetch_orders_daily_state, lock_orders_daily, orders_daily_deltas,
+)
+from database.partitions import ensure_orders_partitions, retention_cutoff
+from database.stock_history import update_stock_history
 from django.utils.dateparse import parse_datetime
+from parsers.fanout import run_for_cabinets
+from parsers.wb_client import get_wb_client
+from parsers.wb_cache import wb_cache, WB_CACHE_INVALIDATES
+from parsers.wb_endpoints import get_endpoint
+from parsers.json_stream import iter_json_array, batched
+from parsers.price_queue import take_price_changes, finish_price_changes
 
 import logging
 from context_logger import ContextLogger
 logger = ContextLogger(logging.getLogger("parsers"))
 
 
-async def wb_api(session, param):
+def prepare_wb_request(param):
     """
-    Асинхронная функция для получения данных по API Wildberries.
+    Собрать запрос к API Wildberries по param["type"] из реестра методов (parsers/wb_endpoints.py).
     :param param:
-    :return:
+    :return: (view, API_URL, params, data)
     """
+    endpoint = get_endpoint(param["type"])
+    params, data = endpoint.build(param)
+    return endpoint.method, endpoint.url.format(**param), params, data
 
-    API_URL = ''
-    view = ''
-    data = {}
-    params = {}
-
-    if param["type"] == "info_about_rks":
-        API_URL = "https://advert-api.wildberries.ru/adv/v1/promotion/adverts"
-        data = param['id_lks']  # максимум 50 рк
-        view = "post"
-
-    if param["type"] == "list_adverts_id":
-        API_URL = "https://advert-api.wildberries.ru/adv/v1/promotion/count"
-        view = "get"
-
-    if param["type"] == "get_balance_lk":
-        # получить balance-счет net-баланс bonus-бонусы личный кабинет
-        # Максимум 1 запрос в секунду на один аккаунт продавца
-        API_URL = "https://advert-api.wildberries.ru/adv/v1/balance"
-        view = "get"
-
-    if param["type"] == "orders":
-        # Максимум 1 запрос в минуту на один аккаунт продавца
-        # Данные обновляются раз в 30 минут.
-        API_URL = "https://statistics-api.wildberries.ru/api/v1/supplier/orders"
-        params = {
-            "dateFrom": param["date_from"], #Дата и время последнего изменения по заказу. `2019-06-20` `2019-06-20T23:59:59`
-            "flag": param["flag"],  #если flag=1 то только за выбранный день если 0 то
-            # со дня до сегодня но не более 100000 строк
-        }
-        view = "get"
-
-    if param["type"] == "start_advert":
-        # запустить рекламу
-        # Максимум 5 запросов в секунду на один аккаунт продавца
-        API_URL = "https://advert-api.wildberries.ru/adv/v0/start"
-        params = {
-            "id": param["advert_id"],  # int
-        }
-        view = "get"
-
-    if param["type"] == "budget_advert":
-        # получить бюджет кампании
-        # Максимум 4 запроса в секунду на один аккаунт продавца
-        API_URL = "https://advert-api.wildberries.ru/adv/v1/budget"
-        params = {
-            "id": param["advert_id"],  # int
-        }
-        view = "get"
-
-    if param["type"] == "add_bidget_to_adv":
-        # пополнить бюджет рекламной кампании
-        # Максимум 1 запрос в секунду на один аккаунт продавца
-        API_URL = "https://advert-api.wildberries.ru/adv/v1/budget/deposit"
-        params = {
-            "id": param["advert_id"],
-        }
-        data = {
-            "sum": param["sum"],  # int
-            "type": param["source"],  # int: 0-счет 1-баланс 3-бонусы
-            "return": param["return"],  # bool: в ответе вернется обновлённый размер бюджета кампании если True
-        }
-
-        view = "post"
-
-    if param["type"] == "get_nmids":
-        # получить все артикулы
-        # Максимум 100 запросов в минуту для всех методов категории Контент на один аккаунт продавца
-        API_URL = "https://content-api.wildberries.ru/content/v2/get/cards/list"
-
-        data = {
-            "settings": {
-                "cursor": {
-                    "limit": 100
-                },
-                "filter": {
-                    "withPhoto": -1
-                },
-            }
-        }
-        if param.get("updatedAt"):
-            data["settings"]["cursor"]["updatedAt"] = param["updatedAt"]
-        if param.get("nmID"):
-            data["settings"]["cursor"]["nmID"] = param["nmID"]
-        view = "post"
-
-    if param["type"] == "get_delivery_fbw":
-        API_URL = "https://statistics-api.wildberries.ru/api/v1/supplier/incomes"
-
-        params = {
-            "dateFrom": param["dateFrom"]
-        }
-
-        view = "get"
 
-    if param["type"] == "get_products_and_prices":
-        # получить товары с ценами
-        # максимальный лимит 1000
-        API_URL = "https://discounts-prices-api.wildberries.ru/api/v2/list/goods/filter"
-        params = {
-            "limit": param.get("limit", 1000)
-        }
-        view = "get"
-
-    # сортировка по nmID/предметам/брендам/тегам
-    if param["type"] == 'get_stat_cart_sort_nm':
-        API_URL = "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/detail"
-        data = {
-            "period": {
-                "begin": param["begin"],
-                "end": param["end"],
-            },
-            "page": 1
-        }
-        view = "post"
+async def wb_api(client, param):
+    """
+    Асинхронная функция для получения данных по API Wildberries.
+    Ответы редко меняющихся методов (WB_CACHE_TTL) берутся из кэша, изменяющие методы сбрасывают
+    кэш кабинета (WB_CACHE_INVALIDATES).
+    :param client: WbClient (get_wb_client())
+    :param param: param["cache"] = False - не читать из кэша, а запросить WB и обновить кэш
+    :return:
+    """
+    view, API_URL, params, data = prepare_wb_request(param)
 
-    if param["type"] == "get_feedback":
-        # Максимум 1 запрос в секунду
-        # Если превысить лимит в 3 запроса в секунду, отправка запросов будет заблокирована на 60 секунд
-        API_URL = "https://feedbacks-api.wildberries.ru/api/v1/feedbacks"
-        params = {
-            "isAnswered": param["isAnswered"],  # str: Обработанные отзывы (True) или необработанные отзывы(False)
-            "take": param["take"],  # int: Количество отзывов (max. 5 000)
-            "skip": param["skip"],  # int: Количество отзывов для пропуска (max. 199990)
+    cache_key = None
+    if wb_cache.ttl(param["type"]):
+        cache_key = wb_cache.key(param["API_KEY"], param["type"], [view, API_URL, params, data])
+        if param.get("cache", True):
+            cached = await wb_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-        }
-        if param.get("nmId"):  # по артикулу
-            params["nmId"] = param["nmId"]
-        if param.get("order"):  # str: сортировка по дате "dateAsc" "dateDesc"
-            params["order"] = param["order"]
-        if param.get("dateFrom"):  # int: Дата начала периода в формате Unix timestamp
-            params["dateFrom"] = param["dateFrom"]
-        if param.get("dateTo"):  # int: Дата конца периода в формате Unix timestamp
-            params["dateTo"] = param["dateTo"]
-        view = "get"
-
-    if param["type"] == "warehouse_data":
-        # Максимум 3 запроса в минуту на один аккаунт продавца
-        # Метод формирует набор данных об остатках по складам.
-        # Данные по складам Маркетплейс (FBS) приходят в агрегированном виде — по всем сразу, без детализации по
-        # конкретным складам — эти записи будут с "regionName":"Маркетплейс" и "offices":[].
-        API_URL = "https://seller-analytics-api.wildberries.ru/api/v2/stocks-report/offices"
-
-        data = {
-            "currentPeriod": {
-                "start": param["start"], #"2024-02-10" Не позднее end. Не ранее 3 месяцев от текущей даты
-                "end": param["end"], #Дата окончания периода. Не ранее 3 месяцев от текущей даты
-            },
-            "stockType": "" if not param.get("stockType") else param["stockType"], #"" — все wb—Склады WB mp—Склады Маркетплейс (FBS)
-            "skipDeletedNm": True if not param.get("skipDeletedNm") else param["skipDeletedNm"], #Скрыть удалённые товары
-        }
+    result = await _wb_api_request(client, param, view, API_URL, params, data)
 
-        view = "post"
-
-    if param["type"] == "seller_analytics_generate":
-        # Метод создаёт задание на генерацию отчёта с расширенной аналитикой продавца.
-        # Максимальное количество отчётов, генерируемых в сутки — 20.
-        # Максимум 3 запроса в минуту на один аккаунт продавца
-        API_URL = "https://seller-analytics-api.wildberries.ru/api/v2/nm-report/downloads"
-
-        # https://dev.wildberries.ru/openapi/analytics#tag/Analitika-prodavca-CSV/paths/~1api~1v2~1nm-report~1downloads/post
-        # Ниже типы reportType
-        # DETAIL_HISTORY_REPORT GROUPED_HISTORY_REPORT SEARCH_QUERIES_PREMIUM_REPORT_GROUP
-        # SEARCH_QUERIES_PREMIUM_REPORT_PRODUCT SEARCH_QUERIES_PREMIUM_REPORT_TEXT STOCK_HISTORY_REPORT_CSV
-
-        statuses = [
-            "deficient",
-            "actual",
-            "balanced",
-            "nonActual",
-            "nonLiquid",
-            "invalidData"
-        ]
-
-        data = {
-            "id": param["id"], # ID отчёта в UUID-формате
-            "reportType": param["reportType"],
-            "userReportName": param["userReportName"], # Название отчета
-        }
-        if param["reportType"] == "DETAIL_HISTORY_REPORT":
-            data["params"] = {
-                "startDate": param["start"],  # str
-                "endDate": param["end"],
-                "skipDeletedNm": param.get("skipDeletedNm", True),  # скрыть удаленные товары
-            }
-        elif param["reportType"] == "STOCK_HISTORY_REPORT_CSV":
-            data["params"] = {
-                "currentPeriod": {
-                    "start": param["start"],
-                    "end": param["end"],
-                },  # str
-                "stockType": param.get("stockType", ""),
-                "skipDeletedNm": param.get("skipDeletedNm", True),  # скрыть удаленные товары
-                "availabilityFilters": param.get("availabilityFilters", statuses), # List[str]
-                "orderBy": {
-                    "field": param.get("orderBy", "officeMissingTime"),
-                    "mode": param.get("mode", "desc"),
-                }
-            }
-
-        view = "post"
-
-    if param["type"] == "seller_analytics_report":
-        # Можно получить отчёт, который сгенерирован за последние 48 часов.
-        # Отчёт будет загружен внутри архива ZIP в формате CSV.
-        # Максимум 3 запроса в минуту на один аккаунт продавца
-        API_URL = f"https://seller-analytics-api.wildberries.ru/api/v2/nm-report/downloads/file/{param['downloadId']}"
-
-        params = {
-            "downloadId": param["downloadId"], # string <uuid>
-        }
-        view = "get"
-
-    if param["type"] == "get_stocks_data":
-        # Метод предоставляет количество остатков товаров на складах WB.
-        # Данные обновляются раз в 30 минут.
-        # Максимум 1 запрос в минуту на один аккаунт продавца
-
-        params = {"dateFrom": param["dateFrom"]} #"2019-06-20"  Время передаётся в часовом поясе Мск (UTC+3).
-        API_URL = "https://statistics-api.wildberries.ru/api/v1/supplier/stocks"
-
-        view = "get"
-
-    if param["type"] == "set_price_and_discount":
-        # Метод устанавливает цены и скидки для товаров.
-        # Максимум 10 запросов за 6 секунд
-        # Максимум 1 000 товаров
-        # Цена и скидка не могут быть пустыми одновременно
-        # Если новая цена со скидкой будет хотя бы в 3 раза меньше старой, она попадёт в карантин, и товар будет продаваться по старой цене
-        API_URL = "https://discounts-prices-api.wildberries.ru/api/v2/upload/task"
-
-        data = {
-            "data": param["data"]
-        } # List[dict]  где dict {"nmID": int, "price": int, "discount": int}
-        view = "post"
-
-    if param["type"] == "get_question":
-        # Метод предоставляет список вопросов по заданным фильтрам.
-        # Можно получить максимум 10 000 вопросов в одном ответе
-        # Максимум 1 запрос в секунду
-        # Если превысить лимит в 3 запроса в секунду, отправка запросов будет заблокирована на 60 секунд
-
-        API_URL = "https://feedbacks-api.wildberries.ru/api/v1/questions"
-        params = {
-            "isAnswered": param["isAnswered"], # bool отвеченные (True)
-            "take": param.get("take", 10000), # Количество запрашиваемых вопросов (максимально допустимое значение для параметра - 10 000, при этом сумма значений параметров take и skip не должна превышать 10 000)
-            "skip": param.get("skip", 0), # Количество вопросов для пропуска (максимально допустимое значение для параметра - 10 000, при этом сумма значений параметров take и skip не должна превышать 10 000)
-        }
-        view = "get"
+    if result is not None:
+        if cache_key:
+            await wb_cache.set(cache_key, result, wb_cache.ttl(param["type"]))
+        for type_ in WB_CACHE_INVALIDATES.get(param["type"], ()):
+            await wb_cache.invalidate(param["API_KEY"], type_)
+    return result
 
 
+async def _wb_api_request(client, param, view, API_URL, params, data):
     headers = {
         "Authorization": f"Bearer {param['API_KEY']}"  # Или просто API_KEY, если нужно
     }
 
+    # лимитер, повторы на 429/5xx и предохранитель по (кабинет, категория метода) - внутри client.call
     if view == 'get':
-        async with session.get(API_URL, headers=headers, params=params, timeout=60, ssl=False) as response:
+        async with client.call("get", API_URL, param["type"], param["API_KEY"], headers=headers,
+                               params=params) as response:
             if param["type"] == "seller_analytics_report":
                 try:
                     content = await response.read()
@@ -295,8 +101,8 @@ async def wb_api(session, param):
                 return None
 
     if view == 'post':
-        async with session.post(API_URL, headers=headers, params=params, json=data, timeout=60,
-                                ssl=False) as response:
+        async with client.call("post", API_URL, param["type"], param["API_KEY"], headers=headers,
+                               params=params, json=data) as response:
             response_text = await response.text()
             try:
                 response.raise_for_status()
@@ -308,356 +114,663 @@ async def wb_api(session, param):
                 return None
 
 
+async def wb_api_stream(client, param):
+    """
+    Потоковый вариант wb_api для методов, которые отдают большой JSON-массив (orders, get_stocks_data).
+    Элементы массива отдаются по одному по мере скачивания, весь ответ в памяти не держим:
+        async for order in wb_api_stream(client, param):
+            ...
+    :param client: WbClient (get_wb_client())
+    :param param:
+    """
+    view, API_URL, params, data = prepare_wb_request(param)
+
+    headers = {
+        "Authorization": f"Bearer {param['API_KEY']}"
+    }
+
+    kwargs = {"json": data} if view == "post" else {}
+    async with client.call(view, API_URL, param["type"], param["API_KEY"], headers=headers, params=params,
+                           **kwargs) as response:
+        if response.status >= 400:
+            response_text = await response.text()
+            logger.error(
+                f"Ошибка в wb_api_stream ({view} запрос): {response.status}. Ответ: {response_text}. Параметры: {param}"
+            )
+            response.raise_for_status()
+        async for item in iter_json_array(response.content):
+            yield item
+
+
+async def wb_api_download(client, param, dest) -> int:
+    """
+    Скачать файл из WB (seller_analytics_report) в файловый объект по частям, не собирая его в памяти.
+    :param client: WbClient (get_wb_client())
+    :param dest: открытый на запись бинарный файл (например, tempfile.SpooledTemporaryFile)
+    :return: сколько байт записано
+    """
+    view, API_URL, params, data = prepare_wb_request(param)
+
+    headers = {
+        "Authorization": f"Bearer {param['API_KEY']}"
+    }
+
+    size = 0
+    async with client.call(view, API_URL, param["type"], param["API_KEY"], headers=headers,
+                           params=params) as response:
+        if response.status >= 400:
+            response_text = await response.text()
+            logger.error(
+                f"Ошибка в wb_api_download: {response.status}. Ответ: {response_text}. Параметры: {param}"
+            )
+            response.raise_for_status()
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            dest.write(chunk)
+            size += len(chunk)
+    dest.seek(0)
+    return size
+
+
 def get_uuid()-> str:
     generated_uuid = str(uuid.uuid4())
     return generated_uuid
 
 
-# работает криво изза кривого API от wb
-async def get_orders():
-    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
-    for cab in cabinets:
+def order_to_row(lk_id: int, order: dict) -> dict:
+    """
+    Заказ из ответа WB -> строка wb_orders.
+    """
+    return dict(
+        lk_id=lk_id,
+        date=parse_datetime(order["date"]),
+        lastchangedate=parse_datetime(order["lastChangeDate"]),
+        warehousename=order["warehouseName"].replace("Виртуальный ", "") if order["warehouseName"].startswith("Виртуальный") else order["warehouseName"],
+        warehousetype=order["warehouseType"],
+        countryname=order["countryName"],
+        oblastokrugname=order["oblastOkrugName"],
+        regionname=order["regionName"],
+        supplierarticle=order["supplierArticle"],
+        nmid=order["nmId"],
+        barcode=int(order["barcode"]) if order.get("barcode") else None,
+        category=order["category"],
+        subject=order["subject"],
+        brand=order["brand"],
+        techsize=order["techSize"],
+        incomeid=order["incomeID"],
+        issupply=order["isSupply"],
+        isrealization=order["isRealization"],
+        totalprice=order["totalPrice"],
+        discountpercent=order["discountPercent"],
+        spp=order["spp"],
+        finishedprice=float(order["finishedPrice"]),
+        pricewithdisc=float(order["priceWithDisc"]),
+        iscancel=order["isCancel"],
+        canceldate=parse_datetime(order["cancelDate"]),
+        sticker=order["sticker"],
+        gnumber=order["gNumber"],
+        srid=order["srid"],
+    )
+
+
+def wb_date_from(value: datetime) -> str:
+    """
+    Время -> dateFrom для WB: по МСК, без пояса.
+    Время от WB пишется в БД как есть (МСК, помеченное как UTC) и из timestamptz читается с поясом UTC,
+    поэтому пояс снимаем, не пересчитывая часы - иначе окно сдвинется на 3 часа.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="seconds")
+
+
+# Сколько дней забираем при первой синхронизации кабинета, пока нет watermark
+ORDERS_INITIAL_DAYS = 14
+# Сколько строк максимум отдаёт orders при flag=0. Страница короче - значит данных больше нет
+ORDERS_PAGE_LIMIT = 80000
+# Сколько заказов пишем в БД за раз при потоковой загрузке
+ORDERS_WRITE_BATCH = 10000
+
+
+async def write_orders_page(cab: dict, orders: AsyncIterator[dict]) -> Tuple[int, Optional[datetime]]:
+    """
+    Записать страницу заказов пачками по мере скачивания и после этого сдвинуть watermark кабинета.
+    Watermark пишется только когда вся страница в БД, так что прерванная синхронизация
+    перечитает страницу целиком (upsert идемпотентен) и ничего не потеряет.
+    :param orders: поток заказов из wb_api_stream
+    :return: (сколько строк, новый watermark - максимальный lastChangeDate страницы)
+    """
+    count = 0
+    watermark = None
+    cutoff = retention_cutoff()
+    async for batch in batched(orders, ORDERS_WRITE_BATCH):
+        rows = [order_to_row(cab["id"], order) for order in batch]
+        # заказы старше срока хранения писать некуда - их секции уже удалены
+        fresh = [row for row in rows if not cutoff or row["date"].date() >= cutoff]
+        if fresh:
+            await ensure_orders_partitions(None, {row["date"] for row in fresh})
+            # заказы и дневные итоги по ним пишутся в одной транзакции
+            async with acquire() as conn, conn.transaction():
+                await lock_orders_daily(conn, cab["id"])
+                old = await fetch_orders_daily_state(conn, cab["id"], fresh)
+                await add_set_many(
+                    conn,
+                    table_name="wb_orders",
+                    rows=fresh,
+                    conflict_fields=['nmid', 'lk_id', 'srid', 'date'],
+                    batch_size=ORDERS_WRITE_BATCH,
+                    use_copy=True,
+                )
+                await apply_orders_daily(conn, cab["id"], orders_daily_deltas(old, fresh))
+        count += len(rows)
+        batch_watermark = max(row["lastchangedate"] for row in rows)
+        watermark = batch_watermark if watermark is None else max(watermark, batch_watermark)
+
+    if watermark is not None:
+        await set_sync_state(None, cab["id"], "orders", watermark=watermark)
+    return count, watermark
+
+
+async def get_orders_for_cabinet(cab: dict):
+    """
+    Инкрементальная синхронизация заказов: забираем только изменения с последнего lastChangeDate,
+    который уже записан в БД (wb_syncstate, job="orders").
+    Если страница полная (ORDERS_PAGE_LIMIT строк), запрашиваем следующую с lastChangeDate последней строки.
+    Лимит 1 запрос в минуту соблюдает rate_limiter внутри wb_api_stream.
+    """
+    client = get_wb_client()
+    state = await get_sync_state(None, cab["id"], "orders")
+    if state["watermark"]:
+        date_from = wb_date_from(state["watermark"])
+    else:
+        logger.info(f"Заказы {cab['name']}: первая синхронизация за {ORDERS_INITIAL_DAYS} дней")
+        date_from = str((datetime.now() + timedelta(hours=3) - timedelta(days=ORDERS_INITIAL_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0))
+
+    started = time.monotonic()
+    total = 0
+    pages = 0
+    last_watermark = None
+    while True:
+        param = {
+            "type": "orders",
+            "API_KEY": cab["token"],
+            "date_from": date_from,
+            "flag": 0
+        }
         try:
-            async with aiohttp.ClientSession() as session:
-                date_from = (datetime.now() + timedelta(hours=3) - timedelta(days=14)).replace(hour=0, minute=0, second=0, microsecond=0)
-                param = {
-                    "type": "orders",
-                    "API_KEY": cab["token"],
-                    "date_from": str(date_from),
-                    "flag": 0
-                }
-                response = await wb_api(session, param)
-                conn = await async_connect_to_database()
-                if not conn:
-                    logger.warning("Ошибка подключения к БД")
-                    raise
-                try:
-                    for order in response:
-                        await add_set_data_from_db(
-                            conn=conn,
-                            table_name="wb_orders",
-                            data=dict(
-                                lk_id=cab["id"],
-                                date=parse_datetime(order["date"]),
-                                lastchangedate=parse_datetime(order["lastChangeDate"]),
-                                warehousename=order["warehouseName"].replace("Виртуальный ", "") if order["warehouseName"].startswith("Виртуальный") else order["warehouseName"],
-                                warehousetype=order["warehouseType"],
-                                countryname=order["countryName"],
-                                oblastokrugname=order["oblastOkrugName"],
-                                regionname=order["regionName"],
-                                supplierarticle=order["supplierArticle"],
-                                nmid=order["nmId"],
-                                barcode=int(order["barcode"]) if order.get("barcode") else None,
-                                category=order["category"],
-                                subject=order["subject"],
-                                brand=order["brand"],
-                                techsize=order["techSize"],
-                                incomeid=order["incomeID"],
-                                issupply=order["isSupply"],
-                                isrealization=order["isRealization"],
-                                totalprice=order["totalPrice"],
-                                discountpercent=order["discountPercent"],
-                                spp=order["spp"],
-                                finishedprice=float(order["finishedPrice"]),
-                                pricewithdisc=float(order["priceWithDisc"]),
-                                iscancel=order["isCancel"],
-                                canceldate=parse_datetime(order["cancelDate"]),
-                                sticker=order["sticker"],
-                                gnumber=order["gNumber"],
-                                srid=order["srid"],
-                            ),
-                            conflict_fields=['nmid', 'lk_id', 'srid']
-                        )
-                except Exception as e:
-                    logger.error(f"Ошибка при добавлении заказов в БД. Error: {e}")
-                finally:
-                    await conn.close()
+            count, watermark = await write_orders_page(cab, wb_api_stream(client, param))
         except Exception as e:
-            logger.error(f"Ошибка обновления артикулов для {cab['name']}. Ошибка: {e}")
+            logger.error(f"Ошибка при загрузке заказов {cab['name']} с {date_from}. Error: {e}")
+            raise
+        if not count:
+            break
+        total += count
+        pages += 1
+
+        if count < ORDERS_PAGE_LIMIT:
+            break
+        if watermark == last_watermark:
+            # вся страница с одним lastChangeDate - дальше с него не сдвинуться
+            logger.warning(f"Заказы {cab['name']}: страница не сдвинула lastChangeDate {date_from}, останавливаемся")
+            break
+        last_watermark = watermark
+        date_from = wb_date_from(watermark)
+        logger.info(f"Заказы {cab['name']}: страница {pages} полная, продолжаем с {date_from}")
+
+    seconds = time.monotonic() - started
+    logger.info(
+        f"Заказы {cab['name']}: записано {total} строк за {pages} стр. за {seconds:.2f} сек "
+        f"({total / seconds if seconds else 0:.0f} строк/сек)"
+    )
+    return total
 
 
-async def get_nmids():
-    # получаем все карточки товаров
+async def get_orders():
     cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
+    with get_wb_client().report("get_orders"):
+        await run_for_cabinets(cabinets, get_orders_for_cabinet, "get_orders")
 
-    for cab in cabinets:
-        async with aiohttp.ClientSession() as session:
-            param = {
-                "type": "get_nmids",
-                "API_KEY": cab["token"],
-            }
-            while True:
-                response = await wb_api(session, param)
-
-                if response.get("cursor"):
-                    if response["cursor"]["total"] == 0:
-                        break
-
-                if not response.get("cards"):
-                    logger.error(f"Ошибка при получении артикулов для {cab['name']}: {response}")
-                    raise
-                conn = await async_connect_to_database()
-                if not conn:
-                    logger.error("Ошибка подключения к БД")
-                    raise
-                try:
-                    for resp in response["cards"]:
-                        await add_set_data_from_db(
-                            conn=conn,
-                            table_name="wb_nmids",
-                            data=dict(
-                                lk_id=cab["id"],
-                                nmid=resp["nmID"],
-                                imtid=resp["imtID"],
-                                nmuuid=resp["nmUUID"],
-                                subjectid=resp["subjectID"],
-                                subjectname=resp["subjectName"],
-                                vendorcode=resp["vendorCode"],
-                                brand=resp["brand"],
-                                title=resp["title"],
-                                description=resp.get("description", ""),
-                                needkiz=resp["needKiz"],
-                                photos=json.dumps(resp.get("photos", [])),
-                                dimensions=json.dumps(resp["dimensions"]),
-                                characteristics=json.dumps(resp["characteristics"]),
-                                sizes=json.dumps(resp["sizes"]),
-                                tag_ids = json.dumps([]),
-                                created_at=parse_datetime(resp["createdAt"]),
-                                updated_at=parse_datetime(resp["updatedAt"]),
-                                added_db=datetime.now()
-                            ),
-                            conflict_fields=["nmid", "lk_id"]
-                        )
-                except Exception as e:
-                    logger.error(f"Ошибка при добавлении артикулов в бд {e}")
-                    raise
-                finally:
-                    await conn.close()
 
+# Сколько страниц карточек может ждать записи. Если БД не успевает, фетчер останавливается
+NMIDS_QUEUE_SIZE = 10
+# Сколько карточек пишем в БД за раз
+NMIDS_WRITE_BATCH = 1000
 
-                if response["cursor"]["total"] < 100:
-                    break
-                else:
-                    param["updatedAt"] = response["cursor"]["updatedAt"]
-                    param["nmID"] = response["cursor"]["nmID"]
-                    # await asyncio.sleep(60)
 
+def card_hash(resp: dict) -> str:
+    """
+    Стабильный хэш содержимого карточки (ключи сортируются, порядок в ответе WB не важен).
+    """
+    return hashlib.sha256(
+        json.dumps(resp, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode()
+    ).hexdigest()
 
-async def get_stocks_data_2_weeks():
-    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
 
-    for cab in cabinets:
-        async with aiohttp.ClientSession() as session:
-            conn = await async_connect_to_database()
-            if not conn:
-                logger.error("Ошибка подключения к БД")
-                raise
+def card_to_row(lk_id: int, resp: dict) -> dict:
+    """
+    Карточка товара из ответа WB -> строка wb_nmids.
+    """
+    return dict(
+        lk_id=lk_id,
+        nmid=resp["nmID"],
+        imtid=resp["imtID"],
+        nmuuid=resp["nmUUID"],
+        subjectid=resp["subjectID"],
+        subjectname=resp["subjectName"],
+        vendorcode=resp["vendorCode"],
+        brand=resp["brand"],
+        title=resp["title"],
+        description=resp.get("description", ""),
+        needkiz=resp["needKiz"],
+        photos=json.dumps(resp.get("photos", [])),
+        dimensions=json.dumps(resp["dimensions"]),
+        characteristics=json.dumps(resp["characteristics"]),
+        sizes=json.dumps(resp["sizes"]),
+        tag_ids=json.dumps([]),
+        created_at=parse_datetime(resp["createdAt"]),
+        updated_at=parse_datetime(resp["updatedAt"]),
+        added_db=datetime.now(),
+        content_hash=card_hash(resp),
+    )
+
+
+async def drop_unchanged_cards(lk_id: int, rows: list) -> list:
+    """
+    Оставить только новые и изменённые карточки: сравниваем content_hash с тем, что уже лежит в wb_nmids.
+    Неизменённые не перезаписываем - иначе каждый прогон переписывает JSON всех карточек (WAL, TOAST, bloat).
+    """
+    conn = await async_connect_to_database()
+    if not conn:
+        logger.error("Ошибка подключения к БД")
+        raise ConnectionError("Ошибка подключения к БД")
 
-            req_is_rows_in_db = """
-                SELECT * from wb_stocks WHERE lk_id = $1 LIMIT 1 
-            """
-            all_fields = await conn.fetch(req_is_rows_in_db, cab["id"])
+    stored = await conn.fetch(
+        "SELECT nmid, content_hash FROM wb_nmids WHERE lk_id = $1 AND nmid = ANY($2::integer[])",
+        lk_id, [row["nmid"] for row in rows],
+    )
+    stored_hashes = {row["nmid"]: row["content_hash"] for row in stored}
+    return [row for row in rows if stored_hashes.get(row["nmid"]) != row["content_hash"]]
 
-            if all_fields:
-                days = 1
-            else:
-                logger.info("Пишим остатки в БД впервые")
-                days = 250
 
-            param = {
-                "type": "get_stocks_data",
-                "API_KEY": cab["token"],
-                "dateFrom": str(datetime.now() - timedelta(days=days)),
-            }
-            response = await wb_api(session, param)
+async def get_nmids_for_cabinet(cab: dict):
+    """
+    Карточки товаров кабинета. Фетчер идёт по курсору updatedAt/nmID и кладёт страницы в очередь,
+    writer параллельно пишет их в БД пачками - сеть и БД работают одновременно.
+    Очередь ограничена NMIDS_QUEUE_SIZE, так что если БД отстаёт, фетчер ждёт.
+    """
+    client = get_wb_client()
+    queue = asyncio.Queue(maxsize=NMIDS_QUEUE_SIZE)
+    stats = {"pages": 0, "written": 0, "skipped": 0}
+
+    async def fetch():
+        param = {
+            "type": "get_nmids",
+            "API_KEY": cab["token"],
+        }
+        while True:
+            response = await wb_api(client, param)
+            if response is None:
+                raise ValueError(f"Не удалось получить артикулы для {cab['name']}")
+
+            if response.get("cursor"):
+                if response["cursor"]["total"] == 0:
+                    break
 
+            if not response.get("cards"):
+                logger.error(f"Ошибка при получении артикулов для {cab['name']}: {response}")
+                raise ValueError(f"Пустой ответ по артикулам для {cab['name']}")
+
+            await queue.put([card_to_row(cab["id"], card) for card in response["cards"]])
+            stats["pages"] += 1
+
+            if response["cursor"]["total"] < 100:
+                break
+            else:
+                param["updatedAt"] = response["cursor"]["updatedAt"]
+                param["nmID"] = response["cursor"]["nmID"]
+        await queue.put(None)
+
+    async def write():
+        done = False
+        while not done:
+            rows = await queue.get()
+            if rows is None:
+                break
+            # забираем всё, что накопилось, пока писали прошлую пачку
+            while len(rows) < NMIDS_WRITE_BATCH and not queue.empty():
+                page = queue.get_nowait()
+                if page is None:
+                    done = True
+                    break
+                rows.extend(page)
+            fetched = len(rows)
             try:
-                for quant in response:
-                    await add_set_data_from_db(
-                        conn=conn,
-                        table_name="wb_stocks",
-                        data=dict(
-                            lk_id=cab["id"],
-                            lastchangedate=parse_datetime(quant["lastChangeDate"]),
-                            warehousename=quant["warehouseName"],
-                            supplierarticle=quant["supplierArticle"],
-                            nmid=quant["nmId"],
-                            barcode=int(quant["barcode"]) if quant.get("barcode") else None,
-                            quantity=quant["quantity"],
-                            inwaytoclient=quant["inWayToClient"],
-                            inwayfromclient=quant["inWayFromClient"],
-                            quantityfull=quant["quantityFull"],
-                            category=quant["category"],
-                            techsize=quant["techSize"],
-                            issupply=quant["isSupply"],
-                            isrealization=quant["isRealization"],
-                            sccode=quant["SCCode"],
-                            added_db=datetime.now()
-
-                        ),
-                        conflict_fields=['nmid', 'lk_id', 'supplierarticle', 'warehousename']
-                    )
+                rows = await drop_unchanged_cards(cab["id"], rows)
+                stats["skipped"] += fetched - len(rows)
+                if not rows:
+                    continue
+                stats["written"] += await add_set_many(
+                    None,
+                    table_name="wb_nmids",
+                    rows=rows,
+                    conflict_fields=["nmid", "lk_id"],
+                    batch_size=NMIDS_WRITE_BATCH,
+                )
             except Exception as e:
-                logger.error(f"Ошибка при добавлении остатков в БД. Error: {e}")
-            finally:
-                await conn.close()
+                logger.error(f"Ошибка при добавлении артикулов в бд {e}")
+                raise
 
+    try:
+        # упал один - второй отменяется
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(fetch())
+            tg.create_task(write())
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0]
 
-async def get_stat_products():
+    logger.info(
+        f"Артикулы {cab['name']}: страниц {stats['pages']}, записано {stats['written']}, "
+        f"без изменений пропущено {stats['skipped']}"
+    )
+    return stats
+
+
+async def get_nmids():
+    # получаем все карточки товаров
     cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
+    with get_wb_client().report("get_nmids"):
+        await run_for_cabinets(cabinets, get_nmids_for_cabinet, "get_nmids")
 
-    async def get_analitics(cab: dict, period_get: dict):
-        async with aiohttp.ClientSession() as session:
-            id_report = get_uuid()
-            param = {
-                "type": "seller_analytics_generate",
-                "API_KEY": cab["token"],
-                "reportType": "DETAIL_HISTORY_REPORT",
-                "start": period["start"],
-                "end": period["end"],
-                "id": id_report,  # '685d17f6-ed17-44b4-8a86-b8382b05873c'
-                "userReportName": get_uuid(),
-            }
-            response = await wb_api(session, param)
-
-            if not (response and response.get("data") and response["data"] == "Началось формирование файла/отчета"):
-                logger.error(
-                    f"Ошибка формирования отчета. Период {period_get}. Кабинет: {cab['name']}. Ответ: {response}")
-                raise
 
-            for attempt in range(4):
-                if attempt == 3:
-                    logger.error(
-                        f"‼️Ошибка получения данных в get_stat_products. Кабинет {cab['name']}. ID: {id_report}. Period: {period_get}")
-                    raise
-                await asyncio.sleep(10)
-                param = {
-                    "type": "seller_analytics_report",
-                    "API_KEY": cab["token"],
-                    "downloadId": id_report
-                }
-
-                response = await wb_api(session, param)
-                if not isinstance(response, bytes):
-                    await asyncio.sleep(55)
-                else:
+# С самой ранней даты WB отдаёт полный остаток по всем товарам и складам, а не только изменения
+STOCKS_DATE_FROM = "2019-06-20"
+STOCKS_COLUMNS = [
+    "lk_id", "lastchangedate", "warehousename", "supplierarticle", "nmid", "barcode", "quantity",
+    "inwaytoclient", "inwayfromclient", "quantityfull", "category", "techsize", "issupply",
+    "isrealization", "sccode", "added_db", "updated_at",
+]
+# уникальность в модели Stocks включает techsize
+STOCKS_KEY = ["nmid", "lk_id", "supplierarticle", "warehousename", "techsize"]
+
+
+def stock_to_row(lk_id: int, quant: dict, now: datetime) -> dict:
+    """
+    Остаток из ответа WB -> строка wb_stocks.
+    """
+    return dict(
+        lk_id=lk_id,
+        lastchangedate=parse_datetime(quant["lastChangeDate"]),
+        warehousename=quant["warehouseName"],
+        supplierarticle=quant["supplierArticle"],
+        nmid=quant["nmId"],
+        barcode=int(quant["barcode"]) if quant.get("barcode") else None,
+        quantity=quant["quantity"],
+        inwaytoclient=quant["inWayToClient"],
+        inwayfromclient=quant["inWayFromClient"],
+        quantityfull=quant["quantityFull"],
+        category=quant["category"],
+        techsize=quant["techSize"],
+        issupply=quant["isSupply"],
+        isrealization=quant["isRealization"],
+        sccode=quant["SCCode"],
+        added_db=now,
+        updated_at=now,
+    )
+
+
+async def get_stocks_for_cabinet(cab: dict):
+    """
+    Полный снимок остатков кабинета: WB отдаёт все остатки, после скачивания они заливаются COPY
+    во временную таблицу и затем одной транзакцией заменяют строки кабинета в wb_stocks (DELETE + INSERT).
+    Читатели видят либо старый снимок, либо новый целиком. Пропавшие у WB артикулы и склады удаляются.
+    """
+    client = get_wb_client()
+    param = {
+        "type": "get_stocks_data",
+        "API_KEY": cab["token"],
+        "dateFrom": STOCKS_DATE_FROM,
+    }
+    columns_str = ", ".join(STOCKS_COLUMNS)
+    started = time.monotonic()
+
+    # сначала весь снимок из WB: скачивание идёт под лимитом 1 запрос в минуту,
+    # соединение из пула и временная таблица на это время не занимаются
+    now = datetime.now()
+    records = []
+    try:
+        async for quant in wb_api_stream(client, param):
+            row = stock_to_row(cab["id"], quant, now)
+            records.append(tuple(row[col] for col in STOCKS_COLUMNS))
+    except Exception as e:
+        logger.error(f"Ошибка при получении остатков {cab['name']}. Error: {e}")
+        raise
+    downloaded = time.monotonic()
+
+    if not records:
+        # пустой ответ скорее сбой WB, чем кабинет без остатков - старый снимок не трогаем
+        logger.warning(f"Остатки {cab['name']}: WB вернул пустой список, снимок не заменяем")
+        return 0
+
+    async with acquire() as conn:
+        await conn.execute(
+            f"CREATE TEMP TABLE _snapshot_wb_stocks AS SELECT {columns_str} FROM wb_stocks WITH NO DATA"
+        )
+        try:
+            await conn.copy_records_to_table("_snapshot_wb_stocks", records=records, columns=STOCKS_COLUMNS)
+            async with conn.transaction():
+                deleted = await conn.execute("DELETE FROM wb_stocks WHERE lk_id = $1", cab["id"])
+                # дубли ключа схлопываем: staging залита подряд, побеждает последняя строка
+                inserted = await conn.execute(f"""
+                    INSERT INTO wb_stocks ({columns_str})
+                    SELECT DISTINCT ON ({", ".join(STOCKS_KEY)}) {columns_str}
+                    FROM _snapshot_wb_stocks
+                    ORDER BY {", ".join(STOCKS_KEY)}, ctid DESC
+                """)
+                # остатки за сегодня - в историю, и по ней days_in_stock_last_* - в той же транзакции,
+                # чтобы новый снимок не был виден с обнулёнными счётчиками
+                await update_stock_history(conn, cab["id"])
+        except Exception as e:
+            logger.error(f"Ошибка при записи остатков {cab['name']}. Error: {e}")
+            raise
+        finally:
+            await conn.execute("DROP TABLE IF EXISTS _snapshot_wb_stocks")
+
+    count = int(inserted.split()[-1])
+    logger.info(
+        f"Остатки {cab['name']}: снимок {count} строк (было {int(deleted.split()[-1])}), "
+        f"скачивание {downloaded - started:.2f} сек, запись {time.monotonic() - downloaded:.2f} сек"
+    )
+    return count
+
+
+async def get_stocks_data_2_weeks():
+    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
+    with get_wb_client().report("get_stocks_data_2_weeks"):
+        await run_for_cabinets(cabinets, get_stocks_for_cabinet, "get_stocks_data_2_weeks")
+
+
+# Сколько отчётов seller-analytics WB даёт сгенерировать в сутки на кабинет
+REPORT_DAILY_QUOTA = 20
+# Сколько часов WB хранит сгенерированный отчёт - его можно скачать повторно
+REPORT_REUSE_HOURS = 48
+# Опрос статуса отчёта: экспоненциальная пауза с джиттером от REPORT_POLL_BASE до REPORT_POLL_MAX сек
+REPORT_POLL_BASE = 10
+REPORT_POLL_MAX = 120
+REPORT_POLL_TIMEOUT = 30 * 60
+# Отчёт качаем во временный файл: до REPORT_SPOOL_SIZE байт он живёт в памяти, дальше уходит на диск
+REPORT_SPOOL_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+ANALYTICS_WRITE_BATCH = 10000
+ANALYTICS_INT_FIELDS = [
+    "openCardCount", "addToCartCount", "ordersCount", "ordersSumRub", "buyoutsCount", "buyoutsSumRub",
+    "cancelCount", "cancelSumRub", "addToCartConversion", "cartToOrderConversion", "buyoutPercent",
+]
+
+
+# Столбцы wb_productsstat в порядке значений в analytics_records
+ANALYTICS_FIELDS = ["nmid", "date_wb", *ANALYTICS_INT_FIELDS]
+
+
+def analytics_records(rows: Iterator[List[str]], header: Dict[str, int]) -> Iterator[tuple]:
+    """
+    Строки CSV отчёта DETAIL_HISTORY_REPORT -> кортежи для COPY в wb_productsstat (порядок ANALYTICS_FIELDS).
+    Дат в отчёте единицы, поэтому parse_datetime вызывается один раз на дату, а не на каждую строку.
+    :param rows: csv.reader после чтения шапки
+    :param header: имя колонки -> индекс в строке
+    """
+    nmid_index = header["nmID"]
+    dt_index = header["dt"]
+    int_values = operator.itemgetter(*(header[field] for field in ANALYTICS_INT_FIELDS))
+    dates = {}
+    for row in rows:
+        if not row:
+            continue
+        dt = row[dt_index]
+        date_wb = dates.get(dt)
+        if date_wb is None:
+            date_wb = dates[dt] = parse_datetime(dt)
+        yield (int(row[nmid_index]), date_wb, *map(int, int_values(row)))
+
+
+async def load_analytics_report(zip_file_obj) -> int:
+    """
+    Загрузить ZIP с CSV отчёта DETAIL_HISTORY_REPORT в wb_productsstat.
+    CSV читается из архива построчно, строки сразу собираются в кортежи и пишутся через COPY
+    пачками по ANALYTICS_WRITE_BATCH, так что в памяти не больше одной пачки.
+    :param zip_file_obj: файл с архивом (seekable), например результат wb_api_download
+    :return: сколько строк записано
+    """
+    written = 0
+    with zipfile.ZipFile(zip_file_obj) as zip_file:
+        for file_name in zip_file.namelist():
+            with zip_file.open(file_name) as csv_file:
+                reader = csv.reader(io.TextIOWrapper(csv_file, encoding='utf-8', newline=''))
+                header = {name: index for index, name in enumerate(next(reader, []))}
+
+                records = analytics_records(reader, header)
+                while batch := list(itertools.islice(records, ANALYTICS_WRITE_BATCH)):
                     try:
-                        text = response.decode('utf-8')
-                        if "check correctness of download id or supplier id" in text:
-                            await asyncio.sleep(55)
-                            logger.info(
-                                f"ВНИМАНИЕ!!!: check correctness of download id or supplier id. ПОПЫТКА: {attempt + 1}. Кабинет {cab['name']}. ID: {id_report}. Period: {period_get}")
-                            continue
-                        text = json.loads(text)
-                        if text.get("title"):
-                            await asyncio.sleep(55)
-                            continue
+                        written += await copy_upsert(None, "wb_productsstat", ANALYTICS_FIELDS, batch, ["nmid", "date_wb"])
                     except Exception as e:
-                        break
-            with zipfile.ZipFile(io.BytesIO(response)) as zip_file:
-                for file_name in zip_file.namelist():
-                    with zip_file.open(file_name) as csv_file:
-                        # читаем CSV построчно
-                        reader = csv.reader(io.TextIOWrapper(csv_file, encoding='utf-8'))
-
-                        data = []
-                        header = next(reader)
-
-                        nmid_index = header.index("nmID")
-                        date_wb = header.index("dt")
-                        openCardCount = header.index("openCardCount")
-                        addToCartCount = header.index("addToCartCount")
-                        ordersCount = header.index("ordersCount")
-                        ordersSumRub = header.index("ordersSumRub")
-                        buyoutsCount = header.index("buyoutsCount")
-                        buyoutsSumRub = header.index("buyoutsSumRub")
-                        cancelCount = header.index("cancelCount")
-                        cancelSumRub = header.index("cancelSumRub")
-                        addToCartConversion = header.index("addToCartConversion")
-                        cartToOrderConversion = header.index("cartToOrderConversion")
-                        buyoutPercent = header.index("buyoutPercent")
-
-
-                        for index, row in enumerate(reader):
-                            if index == 0: continue  # пропускаем шапку
-                            data.append(
-                                (
-                                    int(row[nmid_index]),
-                                    parse_datetime(row[date_wb]),
-                                    int(row[openCardCount]),
-                                    int(row[addToCartCount]),
-                                    int(row[ordersCount]),
-                                    int(row[ordersSumRub]),
-                                    int(row[buyoutsCount]),
-                                    int(row[buyoutsSumRub]),
-                                    int(row[cancelCount]),
-                                    int(row[cancelSumRub]),
-                                    int(row[addToCartConversion]),
-                                    int(row[cartToOrderConversion]),
-                                    int(row[buyoutPercent]),
-                                )
-                            )
-
-                        conn = await async_connect_to_database()
-                        if not conn:
-                            logger.error("Ошибка подключения к БД в get_stat_products")
-                            raise
-
-                        try:
-                            BATCH_SIZE = 1000
-                            for batch_start in range(0, len(data), BATCH_SIZE):
-                                batch = data[batch_start:batch_start + BATCH_SIZE]
-                                # Подготовка VALUES и параметров
-                                values_placeholders = []
-                                values_data = []
-
-                                for idx, (
-                                        nmid, date_wb, openCardCount, addToCartCount, ordersCount, ordersSumRub, buyoutsCount,
-                                        buyoutsSumRub, cancelCount, cancelSumRub, addToCartConversion, cartToOrderConversion,
-                                        buyoutPercent) in enumerate(batch):
-                                    base = idx * 13
-                                    values_placeholders.append(
-                                        f"(${base + 1}::integer, ${base + 2}, ${base + 3}::integer, "
-                                        f"${base + 4}::integer, ${base + 5}::integer, ${base + 6}::integer, "
-                                        f"${base + 7}::integer, ${base + 8}::integer, ${base + 9}::integer, "
-                                        f"${base + 10}::integer, ${base + 11}::integer, ${base + 12}::integer, "
-                                        f"${base + 13}::integer)"
-                                    )
-                                    values_data.extend([
-                                        nmid, date_wb, openCardCount, addToCartCount, ordersCount, ordersSumRub,
-                                        buyoutsCount, buyoutsSumRub, cancelCount, cancelSumRub,
-                                        addToCartConversion, cartToOrderConversion, buyoutPercent
-                                    ])
-
-                                query = f"""
-                                    INSERT INTO wb_productsstat (
-                                        nmid, date_wb, "openCardCount", "addToCartCount", "ordersCount", "ordersSumRub",
-                                        "buyoutsCount", "buyoutsSumRub", "cancelCount", "cancelSumRub",
-                                        "addToCartConversion", "cartToOrderConversion", "buyoutPercent"
-                                    )
-                                    VALUES {', '.join(values_placeholders)}
-                                    ON CONFLICT (nmid, date_wb) DO UPDATE SET
-                                        "openCardCount" = EXCLUDED."openCardCount",
-                                        "addToCartCount" = EXCLUDED."addToCartCount",
-                                        "ordersCount" = EXCLUDED."ordersCount",
-                                        "ordersSumRub" = EXCLUDED."ordersSumRub",
-                                        "buyoutsCount" = EXCLUDED."buyoutsCount",
-                                        "buyoutsSumRub" = EXCLUDED."buyoutsSumRub",
-                                        "cancelCount" = EXCLUDED."cancelCount",
-                                        "cancelSumRub" = EXCLUDED."cancelSumRub",
-                                        "addToCartConversion" = EXCLUDED."addToCartConversion",
-                                        "cartToOrderConversion" = EXCLUDED."cartToOrderConversion",
-                                        "buyoutPercent" = EXCLUDED."buyoutPercent";
-                                """
-                                await conn.execute(query, *values_data)
-
-                        except Exception as e:
-                            logger.error(
-                                f"Ошибка обновления данных в myapp_productsstat. Error: {e}"
-                            )
-                            raise
-                        finally:
-                            await conn.close()
+                        logger.error(f"Ошибка обновления данных в wb_productsstat. Error: {e}")
+                        raise
+    return written
+
+
+async def request_analytics_report(client, cab: dict, period: dict) -> Optional[Dict[str, str]]:
+    """
+    Найти отчёт за период, заказанный за последние REPORT_REUSE_HOURS часов, или заказать новый,
+    если суточный лимит кабинета не исчерпан.
+    :return: {"report_id", "status"} или None, если лимит исчерпан
+    """
+    report = await find_reusable_report(
+        cab["id"], "DETAIL_HISTORY_REPORT", date.fromisoformat(period["start"]), date.fromisoformat(period["end"]),
+        REPORT_REUSE_HOURS,
+    )
+    if report:
+        logger.info(f"Отчёт {report['report_id']} за {period} для {cab['name']} уже заказан ({report['status']}), используем его")
+        return report
+
+    id_report = get_uuid()
+    reserved = await reserve_report_job(
+        cab["id"], id_report, "DETAIL_HISTORY_REPORT",
+        date.fromisoformat(period["start"]), date.fromisoformat(period["end"]), REPORT_DAILY_QUOTA,
+    )
+    if not reserved:
+        logger.warning(f"Кабинет {cab['name']}: исчерпан лимит {REPORT_DAILY_QUOTA} отчётов в сутки, период {period} пропущен")
+        return None
+
+    param = {
+        "type": "seller_analytics_generate",
+        "API_KEY": cab["token"],
+        "reportType": "DETAIL_HISTORY_REPORT",
+        "start": period["start"],
+        "end": period["end"],
+        "id": id_report,  # '685d17f6-ed17-44b4-8a86-b8382b05873c'
+        "userReportName": get_uuid(),
+    }
+    try:
+        response = await wb_api(client, param)
+    except Exception as e:
+        # иначе заказ так и останется 'created' и find_reusable_report будет отдавать его 48 часов
+        await update_report_job(id_report, status="failed", error=f"Ошибка запроса формирования: {e!r}")
+        raise
+
+    if not (response and response.get("data") and response["data"] == "Началось формирование файла/отчета"):
+        await update_report_job(id_report, status="failed", error=f"Ошибка формирования: {response}")
+        raise ValueError(f"Ошибка формирования отчета. Период {period}. Кабинет: {cab['name']}. Ответ: {response}")
+
+    return {"report_id": id_report, "status": "created"}
+
+
+async def wait_analytics_report(client, cab: dict, report_id: str) -> bool:
+    """
+    Дождаться готовности отчёта. Статус опрашиваем с экспоненциальной паузой и джиттером,
+    лимит 3 запроса в минуту соблюдает rate_limiter.
+    :return: True - отчёт готов, False - WB не смог его сформировать
+    """
+    started = time.monotonic()
+    attempt = 0
+    while time.monotonic() - started < REPORT_POLL_TIMEOUT:
+        delay = min(REPORT_POLL_MAX, REPORT_POLL_BASE * 2 ** attempt)
+        await asyncio.sleep(random.uniform(delay / 2, delay))
+        attempt += 1
+
+        response = await wb_api(client, {
+            "type": "seller_analytics_status",
+            "API_KEY": cab["token"],
+            "downloadIds": [report_id],
+        })
+        await update_report_job(report_id, attempts=attempt)
+        reports = response.get("data") if response else None
+        status = reports[0].get("status") if reports else None
+
+        if status == "SUCCESS":
+            await update_report_job(report_id, status="ready")
+            return True
+        if status == "FAILED":
+            await update_report_job(report_id, status="failed", error="WB: FAILED")
+            return False
+        logger.info(f"Отчёт {report_id} ({cab['name']}): статус {status}, попытка {attempt}")
+
+    await update_report_job(report_id, status="failed", error=f"Не готов за {REPORT_POLL_TIMEOUT} сек")
+    return False
+
+
+async def get_analitics(cab: dict, period: dict):
+    client = get_wb_client()
+    report = await request_analytics_report(client, cab, period)
+    if not report:
+        return
+    report_id = report["report_id"]
+
+    if report["status"] == "created" and not await wait_analytics_report(client, cab, report_id):
+        raise ValueError(f"‼️Отчёт не сформирован. Кабинет {cab['name']}. ID: {report_id}. Period: {period}")
+
+    param = {
+        "type": "seller_analytics_report",
+        "API_KEY": cab["token"],
+        "downloadId": report_id
+    }
+    with tempfile.SpooledTemporaryFile(max_size=REPORT_SPOOL_SIZE) as report_file:
+        try:
+            await wb_api_download(client, param, report_file)
+        except Exception as e:
+            await update_report_job(report_id, status="failed", error=f"Не удалось скачать: {e}")
+            raise
+        if not zipfile.is_zipfile(report_file):
+            report_file.seek(0)
+            head = report_file.read(500)
+            await update_report_job(report_id, status="failed", error=f"Не ZIP: {head!r}")
+            raise ValueError(f"Ошибка скачивания отчёта. Кабинет {cab['name']}. ID: {report_id}. Period: {period}")
+
+        report_file.seek(0)
+        written = await load_analytics_report(report_file)
+    await update_report_job(report_id, status="loaded")
+    logger.info(f"Отчёт {report_id} ({cab['name']}, {period}): записано строк {written}")
+
+
+async def get_stat_products():
+    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
     periods = [
         {
             "start": (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'),
@@ -668,8 +781,399 @@ async def get_stat_products():
             "end": (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d')
         }
     ]
-    for index, period in enumerate(periods):
-        tasks = [get_analitics(cab, period) for cab in cabinets]
-        await asyncio.gather(*tasks, return_exceptions=True)
-        if index != len(periods) - 1:
-            await asyncio.sleep(60)
\ No newline at end of file
+
+    async def get_for_cabinet(cab):
+        # оба периода заказываем сразу: WB формирует отчёты параллельно, а лимит запросов держит rate_limiter
+        results = await asyncio.gather(*(get_analitics(cab, period) for period in periods), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise errors[0]
+
+    with get_wb_client().report("get_stat_products"):
+        await run_for_cabinets(cabinets, get_for_cabinet, "get_stat_products")
+
+
+# info_about_rks принимает максимум 50 ID кампаний
+ADVERTS_CHUNK_SIZE = 50
+ADVERTS_FIELDS = {
+    "advertId", "name", "type", "status", "paymentType", "dailyBudget",
+    "createTime", "changeTime", "startTime", "endTime",
+}
+
+
+def _wb_time(value):
+    return parse_datetime(value) if value else None
+
+
+def advert_to_row(lk_id: int, advert: dict) -> dict:
+    """
+    Кампания из ответа info_about_rks -> строка wb_adverts.
+    """
+    return dict(
+        lk_id=lk_id,
+        advert_id=advert["advertId"],
+        name=advert.get("name") or "",
+        type=advert.get("type"),
+        status=advert.get("status"),
+        payment_type=advert.get("paymentType"),
+        daily_budget=advert.get("dailyBudget"),
+        create_time=_wb_time(advert.get("createTime")),
+        change_time=_wb_time(advert.get("changeTime")),
+        start_time=_wb_time(advert.get("startTime")),
+        end_time=_wb_time(advert.get("endTime")),
+        params=json.dumps({k: v for k, v in advert.items() if k not in ADVERTS_FIELDS}),
+    )
+
+
+async def get_changed_advert_ids(client, cab: dict) -> list:
+    """
+    ID кампаний кабинета, которые появились или изменились (changeTime / статус) с прошлой синхронизации.
+    """
+    response = await wb_api(client, {"type": "list_adverts_id", "API_KEY": cab["token"], "cache": False})
+    if response is None:
+        raise ValueError(f"Не удалось получить список кампаний для {cab['name']}")
+
+    listed = {}
+    for group in response.get("adverts") or []:
+        for advert in group.get("advert_list") or []:
+            listed[advert["advertId"]] = (_wb_time(advert.get("changeTime")), group.get("status"))
+
+    conn = await async_connect_to_database()
+    if not conn:
+        logger.error("Ошибка подключения к БД в get_changed_advert_ids")
+        raise ConnectionError("Нет подключения к БД")
+    stored = await conn.fetch(
+        "SELECT advert_id, change_time, status FROM wb_adverts WHERE lk_id = $1 AND advert_id = ANY($2::bigint[])",
+        cab["id"], list(listed),
+    )
+    known = {row["advert_id"]: (row["change_time"], row["status"]) for row in stored}
+    return [advert_id for advert_id, state in listed.items() if known.get(advert_id) != state]
+
+
+async def get_adverts_for_cabinet(cab: dict):
+    """
+    Рекламные кампании кабинета. Детали запрашиваются только по новым/изменённым кампаниям,
+    пачками по ADVERTS_CHUNK_SIZE, все пачки параллельно - темп держит rate_limiter (5 запросов в секунду).
+    """
+    client = get_wb_client()
+    advert_ids = await get_changed_advert_ids(client, cab)
+    if not advert_ids:
+        logger.info(f"Кампании {cab['name']}: изменений нет")
+        return {"changed": 0, "written": 0}
+
+    async def fetch_chunk(chunk):
+        response = await wb_api(client, {
+            "type": "info_about_rks",
+            "API_KEY": cab["token"],
+            "id_lks": chunk,
+            "cache": False,
+        })
+        if response is None:
+            raise ValueError(f"Не удалось получить кампании {chunk[:3]}... для {cab['name']}")
+        return response
+
+    chunks = [advert_ids[i:i + ADVERTS_CHUNK_SIZE] for i in range(0, len(advert_ids), ADVERTS_CHUNK_SIZE)]
+    responses = await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))
+    rows = [advert_to_row(cab["id"], advert) for response in responses for advert in response]
+
+    try:
+        written = await add_set_many(None, "wb_adverts", rows, conflict_fields=["lk_id", "advert_id"])
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении кампаний в бд {e}")
+        raise
+
+    logger.info(f"Кампании {cab['name']}: изменилось {len(advert_ids)}, записано {written}")
+    return {"changed": len(advert_ids), "written": written}
+
+
+async def get_adverts():
+    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
+    with get_wb_client().report("get_adverts"):
+        await run_for_cabinets(cabinets, get_adverts_for_cabinet, "get_adverts")
+
+
+# Отзывы и вопросы: максимальный take у WB и сколько дней перечитываем назад, чтобы забрать ответы,
+# данные на отзывы после прошлой синхронизации
+FEEDBACKS_TAKE = 5000
+QUESTIONS_TAKE = 10000
+FEEDBACKS_OVERLAP_DAYS = 7
+FEEDBACK_ITEM_FIELDS = {
+    "id", "text", "pros", "cons", "productValuation", "userName", "state", "answer", "wasViewed",
+    "createdDate",
+}
+
+
+def feedback_to_row(lk_id: int, item: dict) -> dict:
+    """
+    Отзыв из ответа WB -> строка wb_feedbacks.
+    """
+    details = item.get("productDetails") or {}
+    answer = item.get("answer") or {}
+    return dict(
+        lk_id=lk_id,
+        feedback_id=item["id"],
+        nmid=details.get("nmId"),
+        supplierarticle=details.get("supplierArticle"),
+        text=item.get("text") or "",
+        pros=item.get("pros") or "",
+        cons=item.get("cons") or "",
+        product_valuation=item.get("productValuation"),
+        user_name=item.get("userName") or "",
+        state=item.get("state") or "",
+        answer=answer.get("text"),
+        is_answered=bool(answer),
+        was_viewed=bool(item.get("wasViewed")),
+        created_date=parse_datetime(item["createdDate"]),
+        data=json.dumps({k: v for k, v in item.items() if k not in FEEDBACK_ITEM_FIELDS}),
+    )
+
+
+def question_to_row(lk_id: int, item: dict) -> dict:
+    """
+    Вопрос из ответа WB -> строка wb_questions.
+    """
+    details = item.get("productDetails") or {}
+    answer = item.get("answer") or {}
+    return dict(
+        lk_id=lk_id,
+        question_id=item["id"],
+        nmid=details.get("nmId"),
+        supplierarticle=details.get("supplierArticle"),
+        text=item.get("text") or "",
+        state=item.get("state") or "",
+        answer=answer.get("text"),
+        is_answered=bool(answer),
+        was_viewed=bool(item.get("wasViewed")),
+        created_date=parse_datetime(item["createdDate"]),
+        data=json.dumps({k: v for k, v in item.items() if k not in FEEDBACK_ITEM_FIELDS}),
+    )
+
+
+# job в wb_syncstate -> как забирать и куда писать
+FEEDBACK_SOURCES = {
+    "feedbacks": {
+        "type": "get_feedback", "take": FEEDBACKS_TAKE, "key": "feedbacks",
+        "table": "wb_feedbacks", "id_field": "feedback_id", "to_row": feedback_to_row,
+    },
+    "questions": {
+        "type": "get_question", "take": QUESTIONS_TAKE, "key": "questions",
+        "table": "wb_questions", "id_field": "question_id", "to_row": question_to_row,
+    },
+}
+
+
+async def fetch_feedback_pages(client, cab: dict, source: dict, is_answered: bool, date_from: Optional[int]):
+    """
+    Страницы отзывов/вопросов по возрастанию даты, по source["take"] штук.
+    Вместо skip (у вопросов take + skip не больше 10 000) сдвигаем dateFrom на дату последнего элемента,
+    дубли на границе страниц схлопнет upsert. Запросы идут по одному - лимит 1 в секунду держит rate_limiter.
+    :param date_from: unix timestamp, с которого забирать (None - всё)
+    """
+    param = {
+        "type": source["type"],
+        "API_KEY": cab["token"],
+        "isAnswered": "true" if is_answered else "false",
+        "take": source["take"],
+        "skip": 0,
+        "order": "dateAsc",
+    }
+    while True:
+        if date_from:
+            param["dateFrom"] = date_from
+        response = await wb_api(client, param)
+        if response is None or response.get("error"):
+            raise ValueError(f"Ошибка получения {source['key']} для {cab['name']}: {response}")
+
+        items = (response.get("data") or {}).get(source["key"]) or []
+        if items:
+            yield items
+        if len(items) < source["take"]:
+            return
+
+        next_from = max(int(parse_datetime(item["createdDate"]).timestamp()) for item in items)
+        if next_from == date_from:
+            logger.warning(f"{source['key']} {cab['name']}: страница не сдвинула dateFrom {date_from}, останавливаемся")
+            return
+        date_from = next_from
+
+
+async def sync_feedback_source(client, cab: dict, job: str) -> int:
+    """
+    Инкрементальная синхронизация отзывов или вопросов кабинета.
+    Неотвеченные забираем целиком (их немного, и у них меняется статус), отвеченные - начиная
+    с watermark (wb_syncstate) минус FEEDBACKS_OVERLAP_DAYS.
+    """
+    source = FEEDBACK_SOURCES[job]
+    state = await get_sync_state(None, cab["id"], job)
+    watermark = state["watermark"]
+    answered_from = int((watermark - timedelta(days=FEEDBACKS_OVERLAP_DAYS)).timestamp()) if watermark else None
+
+    total = 0
+    unanswered_ids = []
+    for is_answered, date_from in ((False, None), (True, answered_from)):
+        async for items in fetch_feedback_pages(client, cab, source, is_answered, date_from):
+            rows = [source["to_row"](cab["id"], item) for item in items]
+            try:
+                total += await add_set_many(
+                    None, source["table"], rows, conflict_fields=["lk_id", source["id_field"]],
+                    batch_size=source["take"],
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при добавлении {source['key']} в бд {e}")
+                raise
+            if is_answered:
+                page_watermark = max(row["created_date"] for row in rows)
+                watermark = page_watermark if watermark is None else max(watermark, page_watermark)
+            else:
+                unanswered_ids.extend(row[source["id_field"]] for row in rows)
+
+    # на старые отзывы ответили в кабинете WB: в списке неотвеченных их больше нет
+    conn = await async_connect_to_database()
+    if not conn:
+        logger.error("Ошибка подключения к БД в sync_feedback_source")
+        raise ConnectionError("Нет подключения к БД")
+    await conn.execute(
+        f"""
+        UPDATE {source["table"]} SET is_answered = true, updated_at = now()
+        WHERE lk_id = $1 AND NOT is_answered AND NOT ({source["id_field"]} = ANY($2::text[]))
+        """,
+        cab["id"], unanswered_ids,
+    )
+    if watermark is not None:
+        await set_sync_state(None, cab["id"], job, watermark=watermark)
+    return total
+
+
+async def get_feedbacks_for_cabinet(cab: dict):
+    # отзывы и вопросы делят один лимит, поэтому по очереди
+    client = get_wb_client()
+    stats = {}
+    for job in FEEDBACK_SOURCES:
+        stats[job] = await sync_feedback_source(client, cab, job)
+    logger.info(f"Отзывы и вопросы {cab['name']}: записано отзывов {stats['feedbacks']}, вопросов {stats['questions']}")
+    return stats
+
+
+async def get_feedbacks():
+    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
+    with get_wb_client().report("get_feedbacks"):
+        await run_for_cabinets(cabinets, get_feedbacks_for_cabinet, "get_feedbacks")
+
+
+# get_products_and_prices отдаёт максимум 1000 товаров, set_price_and_discount принимает максимум 1000
+PRICES_PAGE_LIMIT = 1000
+PRICES_UPLOAD_SIZE = 1000
+
+
+def price_to_row(lk_id: int, good: dict) -> dict:
+    """
+    Товар из ответа get_products_and_prices -> строка wb_prices.
+    """
+    sizes = good.get("sizes") or []
+    first_size = sizes[0] if sizes else {}
+    return dict(
+        lk_id=lk_id,
+        nmid=good["nmID"],
+        vendorcode=good.get("vendorCode") or "",
+        price=first_size.get("price"),
+        discounted_price=first_size.get("discountedPrice"),
+        discount=good.get("discount"),
+        club_discount=good.get("clubDiscount"),
+        currency=good.get("currencyIsoCode4217") or "",
+        editable_size_price=bool(good.get("editableSizePrice")),
+        sizes=json.dumps(sizes),
+    )
+
+
+async def get_prices_for_cabinet(cab: dict):
+    """
+    Цены всех товаров кабинета: страницами по PRICES_PAGE_LIMIT (limit/offset), каждая страница - один upsert.
+    """
+    client = get_wb_client()
+    offset = 0
+    written = 0
+    while True:
+        response = await wb_api(client, {
+            "type": "get_products_and_prices",
+            "API_KEY": cab["token"],
+            "limit": PRICES_PAGE_LIMIT,
+            "offset": offset,
+            "cache": False,
+        })
+        if response is None:
+            raise ValueError(f"Не удалось получить цены для {cab['name']} (offset {offset})")
+
+        goods = (response.get("data") or {}).get("listGoods") or []
+        if goods:
+            try:
+                written += await add_set_many(
+                    None, "wb_prices", [price_to_row(cab["id"], good) for good in goods],
+                    conflict_fields=["lk_id", "nmid"], batch_size=PRICES_PAGE_LIMIT,
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при добавлении цен в бд {e}")
+                raise
+        if len(goods) < PRICES_PAGE_LIMIT:
+            break
+        offset += PRICES_PAGE_LIMIT
+
+    logger.info(f"Цены {cab['name']}: записано {written}")
+    return written
+
+
+async def get_prices():
+    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
+    with get_wb_client().report("get_prices"):
+        await run_for_cabinets(cabinets, get_prices_for_cabinet, "get_prices")
+
+
+async def send_price_changes_for_cabinet(cab: dict):
+    """
+    Отправить в WB накопившиеся в очереди (parsers/price_queue.py) изменения цен кабинета.
+    Изменения уходят задачами по PRICES_UPLOAD_SIZE товаров, все задачи сразу - темп (10 запросов за 6 сек)
+    держит rate_limiter. Задачи, упавшие на 429/5xx, возвращаются в очередь; отклонённые WB (4xx) - нет,
+    иначе одна ошибочная цена вечно крутилась бы в очереди.
+    """
+    changes = await take_price_changes(cab["id"])
+    if changes is None:
+        logger.info(f"Цены {cab['name']}: очередь уже отправляет другой воркер")
+        return None
+
+    client = get_wb_client()
+    failed = []
+    rejected = 0
+
+    async def upload(chunk):
+        nonlocal rejected
+        try:
+            response = await wb_api(client, {
+                "type": "set_price_and_discount",
+                "API_KEY": cab["token"],
+                "data": chunk,
+            })
+        except Exception as e:
+            logger.error(f"Цены {cab['name']}: задача на {len(chunk)} товаров не отправлена, вернём в очередь. Error: {e}")
+            failed.extend(chunk)
+            return
+        if response is None or response.get("error"):
+            logger.error(f"Цены {cab['name']}: WB отклонил задачу на {len(chunk)} товаров: {response}")
+            rejected += len(chunk)
+
+    try:
+        chunks = [changes[i:i + PRICES_UPLOAD_SIZE] for i in range(0, len(changes), PRICES_UPLOAD_SIZE)]
+        await asyncio.gather(*(upload(chunk) for chunk in chunks))
+    finally:
+        await finish_price_changes(cab["id"], failed)
+
+    stats = {"queued": len(changes), "failed": len(failed), "rejected": rejected}
+    logger.info(
+        f"Цены {cab['name']}: отправлено {len(changes) - len(failed) - rejected} из {len(changes)} "
+        f"в {len(chunks)} задачах, возвращено в очередь {len(failed)}, отклонено {rejected}"
+    )
+    return stats
+
+
+async def send_price_changes():
+    cabinets = await get_data_from_db("wb_wblk", ["id", "name", "token"])
+    with get_wb_client().report("send_price_changes"):
+        await run_for_cabinets(cabinets, send_price_changes_for_cabinet, "send_price_changes")
@@ -1,5 +1,9 @@
-from django.contrib import admin
-from .models import WbLk, nmids, Stocks, Orders, ProductsStat
+import asyncio
+
+from django.contrib import admin, messages
+
+from parsers.price_queue import enqueue_price_changes
+from .models import WbLk, nmids, Stocks, StockHistory, Orders, OrdersDaily, ProductsStat, SyncState, ReportJob, Adverts, Feedbacks, Questions, Prices
 
 
 @admin.register(WbLk)
@@ -32,6 +36,13 @@ class StocksAdmin(admin.ModelAdmin):
     ordering = ('-lastchangedate',)
 
 
+@admin.register(StockHistory)
+class StockHistoryAdmin(admin.ModelAdmin):
+    list_display = ('lk', 'nmid', 'warehousename', 'day', 'mask')
+    list_filter = ('lk', 'warehousename')
+    search_fields = ('nmid',)
+
+
 @admin.register(Orders)
 class OrdersAdmin(admin.ModelAdmin):
     list_display = (
@@ -44,9 +55,72 @@ class OrdersAdmin(admin.ModelAdmin):
     ordering = ('-date',)
 
 
+@admin.register(OrdersDaily)
+class OrdersDailyAdmin(admin.ModelAdmin):
+    list_display = ('lk', 'nmid', 'day', 'orders', 'cancels', 'revenue')
+    list_filter = ('lk',)
+    search_fields = ('nmid',)
+    ordering = ('-day',)
+
+
 @admin.register(ProductsStat)
 class ProductsStatAdmin(admin.ModelAdmin):
     list_display = ('nmid', 'date_wb', 'buyoutPercent')
     search_fields = ('nmid',)
     ordering = ('-date_wb',)  # Сортировка по умолчанию
-    list_filter = ('date_wb',)
\ No newline at end of file
+    list_filter = ('date_wb',)
+
+
+@admin.register(SyncState)
+class SyncStateAdmin(admin.ModelAdmin):
+    list_display = ('lk', 'job', 'watermark', 'updated_at')
+    list_filter = ('job', 'lk')
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ('lk', 'report_type', 'period_start', 'period_end', 'status', 'attempts', 'created_at')
+    list_filter = ('status', 'report_type', 'lk')
+    search_fields = ('report_id',)
+    ordering = ('-created_at',)
+
+
+@admin.register(Adverts)
+class AdvertsAdmin(admin.ModelAdmin):
+    list_display = ('advert_id', 'name', 'lk', 'type', 'status', 'daily_budget', 'change_time')
+    list_filter = ('lk', 'type', 'status')
+    search_fields = ('advert_id', 'name')
+    ordering = ('-change_time',)
+
+
+@admin.register(Feedbacks)
+class FeedbacksAdmin(admin.ModelAdmin):
+    list_display = ('nmid', 'supplierarticle', 'product_valuation', 'is_answered', 'lk', 'created_date')
+    list_filter = ('lk', 'is_answered', 'product_valuation')
+    search_fields = ('feedback_id', 'nmid', 'supplierarticle', 'text')
+    ordering = ('-created_date',)
+
+
+@admin.register(Questions)
+class QuestionsAdmin(admin.ModelAdmin):
+    list_display = ('nmid', 'supplierarticle', 'is_answered', 'lk', 'created_date')
+    list_filter = ('lk', 'is_answered')
+    search_fields = ('question_id', 'nmid', 'supplierarticle', 'text')
+    ordering = ('-created_date',)
+
+
+@admin.register(Prices)
+class PricesAdmin(admin.ModelAdmin):
+    list_display = ('nmid', 'vendorcode', 'price', 'discount', 'discounted_price', 'lk', 'updated_at')
+    list_editable = ('price', 'discount')
+    list_filter = ('lk',)
+    search_fields = ('nmid', 'vendorcode')
+    ordering = ('-updated_at',)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # в WB изменение уходит через очередь кабинета - его отправит send_price_changes_task
+        changed = {field: getattr(obj, field) for field in ('price', 'discount') if field in form.changed_data}
+        if change and changed:
+            asyncio.run(enqueue_price_changes(obj.lk_id, [{"nmID": obj.nmid, **changed}]))
+            self.message_user(request, f'{obj.nmid}: изменение цены поставлено в очередь на отправку в WB', messages.INFO)
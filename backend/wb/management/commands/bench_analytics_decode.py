@@ -0,0 +1,94 @@
+import csv
+import io
+import itertools
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_datetime
+
+from parsers.wildberies import ANALYTICS_FIELDS, ANALYTICS_INT_FIELDS, ANALYTICS_WRITE_BATCH, analytics_records
+
+
+def make_report(rows: int, days: int) -> str:
+    """
+    Синтетический CSV в формате DETAIL_HISTORY_REPORT.
+    """
+    header = ["nmID", "dt", *ANALYTICS_INT_FIELDS]
+    start = date.today() - timedelta(days=days)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(header)
+    for i in range(rows):
+        writer.writerow([
+            100000 + i // days,
+            (start + timedelta(days=i % days)).isoformat(),
+            *(random.randint(0, 10000) for _ in ANALYTICS_INT_FIELDS),
+        ])
+    return out.getvalue()
+
+
+def decode_previous(text: str) -> int:
+    """
+    Прежний путь целиком: словарь на строку (analytics_row), затем add_set_many собирает
+    из пачки словарей кортежи для copy_upsert (схлопывая дубли по nmid, date_wb).
+    """
+    reader = csv.reader(io.StringIO(text))
+    header = {name: index for index, name in enumerate(next(reader))}
+    decoded = 0
+    batch = []
+
+    def to_records(rows):
+        unique_rows = {}
+        for row in rows:
+            unique_rows[(row["nmid"], row["date_wb"])] = row
+        return [tuple(row.get(col) for col in ANALYTICS_FIELDS) for row in unique_rows.values()]
+
+    for row in reader:
+        if not row:
+            continue
+        record = {"nmid": int(row[header["nmID"]]), "date_wb": parse_datetime(row[header["dt"]])}
+        for field in ANALYTICS_INT_FIELDS:
+            record[field] = int(row[header[field]])
+        batch.append(record)
+        if len(batch) >= ANALYTICS_WRITE_BATCH:
+            decoded += len(to_records(batch))
+            batch = []
+    return decoded + len(to_records(batch))
+
+
+def decode_records(text: str) -> int:
+    reader = csv.reader(io.StringIO(text))
+    header = {name: index for index, name in enumerate(next(reader))}
+    records = analytics_records(reader, header)
+    decoded = 0
+    while batch := list(itertools.islice(records, ANALYTICS_WRITE_BATCH)):
+        decoded += len(batch)
+    return decoded
+
+
+class Command(BaseCommand):
+    help = "Сравнить прежний и текущий разбор CSV отчёта seller-analytics в кортежи для COPY (без записи в БД)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=500000)
+        parser.add_argument("--days", type=int, default=7)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        text = make_report(options["rows"], options["days"])
+
+        results = {}
+        for name, decode in (("прежний", decode_previous), ("текущий", decode_records)):
+            timings = []
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                decoded = decode(text)
+                timings.append(time.perf_counter() - started)
+            if decoded != options["rows"]:
+                raise AssertionError(f"{name}: разобрано {decoded} строк из {options['rows']}")
+            results[name] = min(timings)
+            self.stdout.write(f"{name}: {results[name]:.3f} сек, {options['rows'] / results[name]:,.0f} строк/сек")
+
+        self.stdout.write(f"ускорение: x{results['прежний'] / results['текущий']:.2f}")
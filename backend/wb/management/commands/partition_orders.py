@@ -0,0 +1,34 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from database.DataBase import acquire, close_pool
+from database.partitions import (
+    ORDERS_PARTITIONS_AHEAD, ORDERS_RETENTION_MONTHS, convert_orders_to_partitioned, maintain_orders_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Секционировать wb_orders по месяцам (если ещё не), создать секции на "
+        "ORDERS_PARTITIONS_AHEAD месяцев вперёд и удалить секции старше ORDERS_RETENTION_MONTHS"
+    )
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        try:
+            async with acquire() as conn:
+                converted = await convert_orders_to_partitioned(conn)
+            result = await maintain_orders_partitions()
+        finally:
+            await close_pool()
+
+        if converted:
+            self.stdout.write("wb_orders переведена на секционирование по месяцам")
+        self.stdout.write(
+            f"Секций создано: {len(result['created'])}, удалено: {len(result['dropped'])} "
+            f"(вперёд {ORDERS_PARTITIONS_AHEAD} мес., хранение "
+            f"{ORDERS_RETENTION_MONTHS or 'без ограничения'}{' мес.' if ORDERS_RETENTION_MONTHS else ''})"
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from parsers.wb_endpoints import WB_ENDPOINTS
+from parsers.wb_planner import plan_calls
+from wb.models import WbLk
+
+
+class Command(BaseCommand):
+    help = (
+        "Показать, за сколько времени по лимитам WB выполнятся вызовы на все кабинеты. "
+        "Пример: plan_wb_quota --call get_nmids:40 --call orders:3 --call seller_analytics_generate:2"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--call", action="append", default=[], help="param type:сколько вызовов на кабинет")
+
+    def handle(self, *args, **options):
+        calls = []
+        for item in options["call"]:
+            type_, _, count = item.partition(":")
+            if type_ not in WB_ENDPOINTS or not count.isdigit():
+                raise CommandError(f"Неверный --call {item}. Известные методы: {', '.join(sorted(WB_ENDPOINTS))}")
+            calls.append((type_, int(count)))
+        if not calls:
+            raise CommandError("Нужен хотя бы один --call type:N")
+
+        jobs = [
+            {"cabinet": cab["name"], "api_key": cab["token"], "type": type_, "calls": count}
+            for cab in WbLk.objects.values("name", "token")
+            for type_, count in calls
+        ]
+        _, summary = plan_calls(jobs)
+
+        for bucket in sorted(summary, key=lambda b: -b["seconds"]):
+            line = f"{bucket['cabinet']:<30} {bucket['category']:<25} вызовов {bucket['calls']:>6}  {bucket['seconds']:>9.1f} сек"
+            if bucket["dropped"]:
+                line += f"  (сверх суточного лимита: {bucket['dropped']})"
+            self.stdout.write(line)
@@ -0,0 +1,32 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from database.DataBase import acquire, close_pool
+from database.orders_daily import ORDERS_DAILY_TABLE, rebuild_orders_daily
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитать дневные итоги заказов (wb_ordersdaily) из wb_orders. "
+        "Обычно итоги ведутся дельтами при загрузке заказов, пересчёт нужен после ручных правок wb_orders"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lk", type=int, nargs="+", help="id кабинетов (по умолчанию все)")
+        parser.add_argument("--if-empty", action="store_true", help="только если итогов ещё нет (первый запуск)")
+
+    def handle(self, *args, **options):
+        asyncio.run(self._run(options["lk"], options["if_empty"]))
+
+    async def _run(self, lk_ids, if_empty):
+        try:
+            async with acquire() as conn:
+                if if_empty and await conn.fetchval(f"SELECT EXISTS (SELECT 1 FROM {ORDERS_DAILY_TABLE})"):
+                    self.stdout.write("Итоги заказов уже есть, пересчёт не нужен")
+                    return
+                count = await rebuild_orders_daily(conn, lk_ids)
+        finally:
+            await close_pool()
+
+        self.stdout.write(f"Итоги заказов пересчитаны: {count} строк")
@@ -1,4 +1,9 @@
+from datetime import timezone
+
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import TruncDate
 
 
 # Модель для таблицы wb_lk
@@ -58,9 +63,14 @@ class nmids(models.Model):
     updated_at = models.DateTimeField() # Дата изменения карточки товара (по данным WB)
     added_db = models.DateTimeField(auto_now_add=True) # по МСК
     is_active = models.BooleanField(default=True) # поле для понимания нужен им товар или нет
+    content_hash = models.CharField(max_length=64, null=True, blank=True) # sha256 карточки от WB, чтобы не перезаписывать неизменённые
 
     class Meta:
         unique_together = ['nmid', 'lk']
+        indexes = [
+            # /analytics/products: активные артикулы выбранных кабинетов
+            models.Index(fields=['lk', 'nmid'], condition=Q(is_active=True), name='wb_nmids_active_lk_nmid_idx'),
+        ]
         verbose_name = "Товар WB"
         verbose_name_plural = "Товары WB"
 
@@ -93,12 +103,35 @@ class Stocks(models.Model):
 
     class Meta:
         unique_together = ['nmid', 'lk', 'supplierarticle', 'warehousename', 'techsize']
+        indexes = [
+            # /analytics/stocks и подзапрос остатков в /analytics/products - index-only scan
+            models.Index(fields=['lk', 'nmid'], include=['quantity'], name='wb_stocks_lk_nmid_qty_idx'),
+        ]
         verbose_name_plural = "Отстаки товаров на складах"
 
     def __str__(self):
         return f"{self.supplierarticle} | {self.techsize} | {self.quantity} шт."
 
 
+class StockHistory(models.Model):
+    # Остатки за последние 32 дня одной строкой на артикул и склад (размеры суммируются).
+    # Пишется раз за прогон загрузки остатков (database/stock_history.py), по ней считаются days_in_stock_last_* в wb_stocks
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    nmid = models.IntegerField()  # Артикул WB
+    warehousename = models.CharField(max_length=255)  # Склад, '' если WB склад не указал
+    day = models.DateField()  # Последний записанный день
+    mask = models.BigIntegerField(default=0)  # Бит i - товар был в наличии за i дней до day (бит 0 - сам day)
+    quantities = ArrayField(models.IntegerField(), size=32, default=list)  # Остаток по дням, первый элемент - за day
+
+    class Meta:
+        unique_together = ['lk', 'nmid', 'warehousename']
+        verbose_name = "История остатков"
+        verbose_name_plural = "История остатков"
+
+    def __str__(self):
+        return f"{self.nmid} | {self.warehousename} | {self.day}"
+
+
 class Orders(models.Model):
     lk = models.ForeignKey(WbLk, on_delete=models.CASCADE, default=1) #lk_id в бд
     date = models.DateTimeField() #Дата и время заказа. Это поле соответствует параметру dateFrom в запросе, если параметр flag=1. Если часовой пояс не указан, то берётся Московское время (UTC+3)
@@ -129,11 +162,190 @@ class Orders(models.Model):
     gnumber = models.CharField() #Номер заказа
     srid = models.CharField(max_length=255) #Уникальный ID заказа. Примечание для использующих API Маркетплейс: srid равен rid в ответах методов сборочных заданий.
     updated_at = models.DateTimeField(auto_now_add=True, null=True)  # время обновления в бд в UTC
+    # День заказа. WB отдаёт время по МСК без пояса, и оно пишется в БД как есть (как будто UTC),
+    # поэтому день по UTC и есть день по МСК. Хранимая колонка - по ней группируются дневные итоги
+    order_day = models.GeneratedField(
+        expression=TruncDate('date', tzinfo=timezone.utc),
+        output_field=models.DateField(),
+        db_persist=True,
+    )
 
     class Meta:
-        unique_together = ['nmid', 'lk', 'srid']
+        # аналитика читает дневные итоги (OrdersDaily), а не wb_orders - отдельные индексы под неё здесь не нужны.
+        # wb_orders секционирована по месяцам по date (manage.py partition_orders),
+        # поэтому date входит в уникальный ключ. Дата заказа у srid не меняется
+        unique_together = ['nmid', 'lk', 'srid', 'date']
         verbose_name = "Заказ WB"
         verbose_name_plural = "Заказы WB"
 
     def __str__(self):
-        return f"{self.supplierarticle} | {self.techsize} | {self.brand} | Заказ: {self.gnumber}"
\ No newline at end of file
+        return f"{self.supplierarticle} | {self.techsize} | {self.brand} | Заказ: {self.gnumber}"
+
+class OrdersDaily(models.Model):
+    # Дневные итоги заказов для аналитики. Ведутся дельтами при записи заказов (database/orders_daily.py),
+    # полностью пересчитываются manage.py rebuild_orders_daily
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    nmid = models.IntegerField()  # Артикул WB
+    day = models.DateField()  # День заказа (order_day, по МСК)
+    orders = models.IntegerField(default=0)  # Заказов за день, вместе с отменёнными
+    cancels = models.IntegerField(default=0)  # Из них отменено
+    revenue = models.FloatField(default=0)  # Сумма pricewithdisc по всем заказам дня
+
+    class Meta:
+        indexes = [
+            # /analytics/orders-chart и /analytics/products: lk_id IN (...) + период, всё нужное - в индексе
+            models.Index(fields=['lk', 'day'], include=['nmid', 'orders', 'revenue'], name='wb_ordersdaily_lk_day_idx'),
+        ]
+        unique_together = ['lk', 'nmid', 'day']
+        verbose_name = "Заказы WB за день"
+        verbose_name_plural = "Заказы WB по дням"
+
+    def __str__(self):
+        return f"{self.nmid} | {self.day} | {self.orders}"
+
+class SyncState(models.Model):
+    # Состояние инкрементальной синхронизации по кабинету: до какого момента данные уже забраны
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    job = models.CharField(max_length=100)  # что синхронизируем: orders, ...
+    watermark = models.DateTimeField(null=True, blank=True)  # максимальный lastChangeDate, который уже записан в БД
+    cursor = models.JSONField(default=dict, blank=True)  # доп. состояние джобы
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['lk', 'job']
+        verbose_name = "Состояние синхронизации"
+        verbose_name_plural = "Состояния синхронизации"
+
+    def __str__(self):
+        return f"{self.lk_id} | {self.job} | {self.watermark}"
+
+
+class ReportJob(models.Model):
+    # Отчёты seller-analytics (CSV), которые мы заказали у WB. Лимит WB - 20 отчётов в сутки на кабинет
+    STATUSES = [
+        ('created', 'Заказан'),
+        ('ready', 'Готов'),
+        ('loaded', 'Загружен в БД'),
+        ('failed', 'Ошибка'),
+    ]
+
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    report_id = models.CharField(max_length=36, unique=True)  # ID отчёта в UUID-формате (downloadId)
+    report_type = models.CharField(max_length=100)  # DETAIL_HISTORY_REPORT, ...
+    period_start = models.DateField()
+    period_end = models.DateField()
+    status = models.CharField(max_length=20, choices=STATUSES, default='created')
+    attempts = models.IntegerField(default=0)  # сколько раз опрашивали статус
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['lk', 'created_at'])]
+        verbose_name = "Отчёт WB"
+        verbose_name_plural = "Отчёты WB"
+
+    def __str__(self):
+        return f"{self.lk_id} | {self.report_type} | {self.period_start} - {self.period_end} | {self.status}"
+
+
+class Adverts(models.Model):
+    # Рекламные кампании WB (adv/v1/promotion/adverts)
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    advert_id = models.BigIntegerField()  # ID кампании
+    name = models.CharField(max_length=255, blank=True, default='')
+    type = models.IntegerField(null=True)  # 8 - автоматическая, 9 - аукцион, ...
+    status = models.IntegerField(null=True)  # 4 - готова к запуску, 7 - завершена, 9 - идут показы, 11 - пауза, ...
+    payment_type = models.CharField(max_length=50, null=True, blank=True)  # cpm / cpc
+    daily_budget = models.IntegerField(null=True)
+    create_time = models.DateTimeField(null=True)
+    change_time = models.DateTimeField(null=True)  # время последнего изменения кампании в WB
+    start_time = models.DateTimeField(null=True)
+    end_time = models.DateTimeField(null=True)
+    params = models.JSONField(default=dict, blank=True)  # остальные поля ответа WB (autoParams, unitedParams, ...)
+    updated_at = models.DateTimeField(auto_now=True)  # время обновления в бд
+
+    class Meta:
+        unique_together = ['lk', 'advert_id']
+        verbose_name = "Рекламная кампания"
+        verbose_name_plural = "Рекламные кампании"
+
+    def __str__(self):
+        return f"{self.advert_id} | {self.name} | {self.status}"
+
+
+class Feedbacks(models.Model):
+    # Отзывы покупателей (feedbacks-api /api/v1/feedbacks)
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    feedback_id = models.CharField(max_length=50)  # ID отзыва в WB
+    nmid = models.IntegerField(null=True)  # Артикул WB
+    supplierarticle = models.CharField(max_length=255, null=True, blank=True)  # Артикул продавца
+    text = models.TextField(blank=True, default='')
+    pros = models.TextField(blank=True, default='')
+    cons = models.TextField(blank=True, default='')
+    product_valuation = models.IntegerField(null=True)  # Оценка 1-5
+    user_name = models.CharField(max_length=255, blank=True, default='')
+    state = models.CharField(max_length=50, blank=True, default='')  # none / wbRu
+    answer = models.TextField(null=True, blank=True)  # текст ответа продавца
+    is_answered = models.BooleanField(default=False)
+    was_viewed = models.BooleanField(default=False)
+    created_date = models.DateTimeField()  # дата отзыва в WB
+    data = models.JSONField(default=dict, blank=True)  # остальные поля ответа WB
+    updated_at = models.DateTimeField(auto_now=True)  # время обновления в бд
+
+    class Meta:
+        unique_together = ['lk', 'feedback_id']
+        indexes = [models.Index(fields=['lk', 'created_date'])]
+        verbose_name = "Отзыв"
+        verbose_name_plural = "Отзывы"
+
+    def __str__(self):
+        return f"{self.nmid} | {self.product_valuation} | {self.created_date}"
+
+
+class Questions(models.Model):
+    # Вопросы покупателей (feedbacks-api /api/v1/questions)
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    question_id = models.CharField(max_length=50)  # ID вопроса в WB
+    nmid = models.IntegerField(null=True)  # Артикул WB
+    supplierarticle = models.CharField(max_length=255, null=True, blank=True)  # Артикул продавца
+    text = models.TextField(blank=True, default='')
+    state = models.CharField(max_length=50, blank=True, default='')  # suppliersPortalSynch / none / wbRu
+    answer = models.TextField(null=True, blank=True)  # текст ответа продавца
+    is_answered = models.BooleanField(default=False)
+    was_viewed = models.BooleanField(default=False)
+    created_date = models.DateTimeField()  # дата вопроса в WB
+    data = models.JSONField(default=dict, blank=True)  # остальные поля ответа WB
+    updated_at = models.DateTimeField(auto_now=True)  # время обновления в бд
+
+    class Meta:
+        unique_together = ['lk', 'question_id']
+        indexes = [models.Index(fields=['lk', 'created_date'])]
+        verbose_name = "Вопрос"
+        verbose_name_plural = "Вопросы"
+
+    def __str__(self):
+        return f"{self.nmid} | {self.created_date}"
+
+
+class Prices(models.Model):
+    # Цены и скидки товаров (discounts-prices-api /api/v2/list/goods/filter)
+    lk = models.ForeignKey(WbLk, on_delete=models.CASCADE)  # lk_id в бд
+    nmid = models.IntegerField()  # Артикул WB
+    vendorcode = models.CharField(max_length=255, blank=True, default='')  # Артикул продавца
+    price = models.IntegerField(null=True)  # Цена до скидки (первого размера)
+    discounted_price = models.FloatField(null=True)  # Цена со скидкой продавца
+    discount = models.IntegerField(null=True)  # Скидка продавца, %
+    club_discount = models.IntegerField(null=True)  # Скидка WB Клуба, %
+    currency = models.CharField(max_length=10, blank=True, default='')  # ISO 4217
+    editable_size_price = models.BooleanField(default=False)  # можно ли ставить цены по размерам
+    sizes = models.JSONField(default=list, blank=True)  # цены по размерам
+    updated_at = models.DateTimeField(auto_now=True)  # время обновления в бд
+
+    class Meta:
+        unique_together = ['lk', 'nmid']
+        verbose_name = "Цена товара"
+        verbose_name_plural = "Цены товаров"
+
+    def __str__(self):
+        return f"{self.nmid} | {self.price} | {self.discount}%"
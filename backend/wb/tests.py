@@ -1,3 +1,178 @@
-from django.test import TestCase
+import asyncio
+import time
+import unittest
+import uuid
+from datetime import datetime, timedelta, timezone
 
-# Create your tests here.
+import asyncpg
+from aiohttp import web
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from database.funcs_db import copy_upsert
+from database.redis_conn import get_redis
+from parsers.price_queue import (
+    LOCK_KEY, PROCESSING_KEY, QUEUE_KEY, enqueue_price_changes, finish_price_changes, take_price_changes,
+)
+from parsers.wb_client import WbClient
+from parsers.wildberies import wb_date_from
+
+
+class WbDateFromTests(SimpleTestCase):
+    def test_aware_watermark_round_trip(self):
+        # lastChangeDate от WB - МСК без пояса; asyncpg пишет его в timestamptz как UTC и так же читает обратно
+        last_change = datetime(2025, 3, 1, 23, 59, 58)
+        watermark = last_change.replace(tzinfo=timezone.utc)
+        self.assertEqual(wb_date_from(watermark), "2025-03-01T23:59:58")
+
+    def test_same_instant_in_other_zone(self):
+        # тот же момент, прочитанный с другим поясом сессии, даёт тот же dateFrom
+        watermark = datetime(2025, 3, 2, 2, 59, 58, tzinfo=timezone(timedelta(hours=3)))
+        self.assertEqual(wb_date_from(watermark), "2025-03-01T23:59:58")
+
+    def test_naive_and_no_offset(self):
+        value = wb_date_from(datetime(2025, 3, 1, 10, 0, 0, 123456))
+        self.assertEqual(value, "2025-03-01T10:00:00")
+        self.assertNotIn("+", value)
+
+
+class ScratchDatabase:
+    """
+    Временная БД test_wb_* на сервере из settings.DATABASES - тесты не трогают рабочую базу.
+    Если Postgres недоступен, тест пропускается.
+        async with ScratchDatabase() as conn:
+            ...
+    """
+
+    def __init__(self):
+        db = settings.DATABASES["default"]
+        self.params = dict(
+            user=db["USER"], password=db["PASSWORD"], host=db["HOST"], port=int(db["PORT"] or 5432),
+        )
+        self.name = f"test_wb_{uuid.uuid4().hex[:8]}"
+        self.admin = None
+        self.conn = None
+
+    async def __aenter__(self):
+        try:
+            self.admin = await asyncpg.connect(database=settings.DATABASES["default"]["NAME"], timeout=5, **self.params)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            raise unittest.SkipTest(f"Postgres недоступен: {e}")
+        await self.admin.execute(f"CREATE DATABASE {self.name}")
+        self.conn = await asyncpg.connect(database=self.name, **self.params)
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        if self.conn is not None:
+            await self.conn.close()
+        await self.admin.execute(f"DROP DATABASE IF EXISTS {self.name}")
+        await self.admin.close()
+
+
+class CopyUpsertTests(SimpleTestCase):
+    def test_twice_in_one_transaction(self):
+        # как write_orders_page: несколько пачек в транзакции вызывающего
+        async def run():
+            async with ScratchDatabase() as conn:
+                await conn.execute("CREATE TABLE upsert_target (nmid int, srid text, qty int, PRIMARY KEY (nmid, srid))")
+                columns = ["nmid", "srid", "qty"]
+                async with conn.transaction():
+                    first = await copy_upsert(conn, "upsert_target", columns, [(1, "a", 1), (2, "b", 1)], ["nmid", "srid"])
+                    second = await copy_upsert(conn, "upsert_target", columns, [(2, "b", 5), (3, "c", 1)], ["nmid", "srid"])
+                    # staging удалена сразу, не дожидаясь коммита внешней транзакции
+                    staging = await conn.fetchval(
+                        "SELECT count(*) FROM pg_class WHERE relpersistence = 't' AND relname LIKE '\\_staging\\_%'"
+                    )
+                rows = await conn.fetch("SELECT nmid, srid, qty FROM upsert_target ORDER BY nmid")
+                return first, second, staging, [tuple(row) for row in rows]
+
+        first, second, staging, rows = asyncio.run(run())
+        self.assertEqual((first, second), (2, 2))
+        self.assertEqual(staging, 0)
+        self.assertEqual(rows, [(1, "a", 1), (2, "b", 5), (3, "c", 1)])
+
+
+class RetryAfterTests(SimpleTestCase):
+    def test_short_retry_after_pauses_other_callers(self):
+        # первый запрос получает 429 с Retry-After: 2, второй приходит, пока пауза ещё идёт
+        async def run():
+            hits = []
+            rejected = asyncio.Event()
+
+            async def handler(request):
+                hits.append(time.monotonic())
+                if len(hits) == 1:
+                    rejected.set()
+                    return web.Response(status=429, headers={"Retry-After": "2"})
+                return web.json_response({"ok": True})
+
+            app = web.Application()
+            app.router.add_get("/", handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            url = f"http://127.0.0.1:{runner.addresses[0][1]}/"
+            client = WbClient()
+            api_key = f"test-{uuid.uuid4().hex}"
+
+            async def call():
+                async with client.call("get", url, "info_about_rks", api_key) as response:
+                    return response.status
+
+            async def second_call():
+                await rejected.wait()
+                await asyncio.sleep(0.2)  # первый успевает записать паузу
+                return await call()
+
+            try:
+                statuses = await asyncio.gather(call(), second_call())
+            finally:
+                await client.close()
+                await runner.cleanup()
+            return statuses, hits
+
+        statuses, hits = asyncio.run(run())
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(len(hits), 3)
+        # до конца паузы в WB никто не ходил
+        self.assertGreaterEqual(min(hits[1:]) - hits[0], 1.9)
+
+
+class PriceQueueTests(SimpleTestCase):
+    def test_enqueue_take_finish(self):
+        lk_id = -1 - uuid.uuid4().int % 10 ** 9  # кабинета с таким id нет
+        keys = [key.format(lk_id=lk_id) for key in (QUEUE_KEY, PROCESSING_KEY, LOCK_KEY)]
+
+        async def run():
+            redis = get_redis()
+            try:
+                await asyncio.wait_for(redis.ping(), 5)
+            except Exception as e:
+                raise unittest.SkipTest(f"redis недоступен: {e}")
+            try:
+                await enqueue_price_changes(lk_id, [{"nmID": 1, "price": 100}])
+                # скидка к уже поставленной цене сливается с ней
+                queued = await enqueue_price_changes(lk_id, [{"nmID": 1, "discount": 10}, {"nmID": 2, "price": 50}])
+                taken = await take_price_changes(lk_id)
+                busy = await take_price_changes(lk_id)
+                # пришло во время отправки - копится к следующему разу и не затирается возвратом
+                await enqueue_price_changes(lk_id, [{"nmID": 1, "price": 120}])
+                await finish_price_changes(lk_id, failed=taken)
+                retaken = await take_price_changes(lk_id)
+                await finish_price_changes(lk_id, failed=[])
+                empty = await take_price_changes(lk_id)
+                await finish_price_changes(lk_id, failed=[])
+                left = await redis.exists(*keys)
+            finally:
+                await redis.delete(*keys)
+            return queued, taken, busy, retaken, empty, left
+
+        queued, taken, busy, retaken, empty, left = asyncio.run(run())
+        by_nm = lambda changes: sorted(changes, key=lambda change: change["nmID"])
+        self.assertEqual(queued, 2)
+        self.assertEqual(by_nm(taken), [{"nmID": 1, "price": 100, "discount": 10}, {"nmID": 2, "price": 50}])
+        self.assertIsNone(busy)
+        self.assertEqual(by_nm(retaken), [{"nmID": 1, "price": 120}, {"nmID": 2, "price": 50}])
+        self.assertEqual(empty, [])
+        self.assertEqual(left, 0)
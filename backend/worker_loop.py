@@ -0,0 +1,20 @@
+# marketplace/backend/worker_loop.py
+
+import asyncio
+
+
+# Один event loop на процесс воркера. asyncio.run() создаёт и закрывает loop на каждую задачу,
+# а вместе с ним и все соединения (http-клиент WB, redis), поэтому задачи запускаем здесь.
+_loop = None
+
+
+def run_async(coro):
+    """
+    Выполнить корутину в event loop процесса воркера.
+    """
+    global _loop
+
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop.run_until_complete(coro)
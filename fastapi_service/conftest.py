@@ -0,0 +1,128 @@
+# marketplace/fastapi_service/conftest.py
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from database import DATABASE_URL
+from models import Base
+
+
+# Индексы и ограничения, которые в проде создают миграции Django (backend/wb/models.py), а не create_all.
+# Без них планы в тестовой БД не совпадут с рабочими
+DJANGO_INDEXES = [
+    "CREATE UNIQUE INDEX ON wb_ordersdaily (lk_id, nmid, day)",
+    "CREATE INDEX ON wb_ordersdaily (lk_id)",
+    "CREATE INDEX wb_ordersdaily_lk_day_idx ON wb_ordersdaily (lk_id, day) INCLUDE (nmid, orders, revenue)",
+    "CREATE UNIQUE INDEX ON wb_stocks (nmid, lk_id, supplierarticle, warehousename, techsize)",
+    "CREATE INDEX ON wb_stocks (lk_id)",
+    "CREATE INDEX wb_stocks_lk_nmid_qty_idx ON wb_stocks (lk_id, nmid) INCLUDE (quantity)",
+    "CREATE UNIQUE INDEX ON wb_nmids (nmid, lk_id)",
+    "CREATE INDEX ON wb_nmids (lk_id)",
+    "CREATE INDEX wb_nmids_active_lk_nmid_idx ON wb_nmids (lk_id, nmid) WHERE is_active",
+]
+
+# Значения для обязательных колонок, которые синтетике не важны
+FILLERS = {
+    "integer": "0",
+    "bigint": "0",
+    "boolean": "false",
+    "character varying": "''",
+    "timestamp with time zone": "now()",
+    "timestamp without time zone": "now()",
+}
+
+CABINETS = 20
+NMIDS = 200  # на кабинет
+DAYS = 365
+
+
+def insert_synthetic(conn, table, count, values):
+    """
+    INSERT ... SELECT из generate_series(1, count) AS i.
+    :param values: колонка -> SQL-выражение от i; остальные обязательные колонки заполняются FILLERS
+    """
+    required = conn.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :table
+            AND is_nullable = 'NO' AND column_default IS NULL AND is_generated = 'NEVER'
+    """), {"table": table})
+    columns = dict(values)
+    for column, data_type in required:
+        columns.setdefault(column, FILLERS[data_type])
+    names = ", ".join(f'"{name}"' for name in columns)
+    conn.execute(text(
+        f"INSERT INTO {table} ({names}) SELECT {', '.join(columns.values())} FROM generate_series(1, :count) AS i"
+    ), {"count": count})
+
+
+def load_synthetic(engine):
+    """Схема как в проде и синтетика: CABINETS кабинетов по NMIDS артикулов, дневные итоги за DAYS дней"""
+    with engine.begin() as conn:
+        # защита от запуска по рабочей базе: ниже create_all, вставка и VACUUM
+        database = conn.execute(text("SELECT current_database()")).scalar()
+        if not database.startswith("test_"):
+            raise RuntimeError(f"Синтетика пишется только в тестовую БД test_*, а не в {database}")
+
+        Base.metadata.create_all(bind=conn)
+        for statement in DJANGO_INDEXES:
+            conn.execute(text(statement))
+
+        # каждая четвёртая (кабинет, артикул, день) - с заказами
+        conn.execute(text("""
+            INSERT INTO wb_ordersdaily (lk_id, nmid, day, orders, cancels, revenue)
+            SELECT lk, 1000000 + n, current_date - d, 1 + (lk + n + d) % 7, 0, ((lk * n + d) % 5000)::float
+            FROM generate_series(1, :cabinets) lk, generate_series(1, :nmids) n, generate_series(0, :days - 1) d
+            WHERE (lk + n + d) % 4 = 0
+        """), {"cabinets": CABINETS, "nmids": NMIDS, "days": DAYS})
+        insert_synthetic(conn, "wb_nmids", CABINETS * NMIDS, {
+            "lk_id": f"1 + i % {CABINETS}",
+            "nmid": f"1000000 + 1 + i / {CABINETS} % {NMIDS}",
+            "is_active": "i % 10 <> 0",
+        })
+        insert_synthetic(conn, "wb_stocks", CABINETS * NMIDS * 10, {
+            "lk_id": f"1 + i % {CABINETS}",
+            "nmid": f"1000000 + 1 + i / {CABINETS} % {NMIDS}",
+            "supplierarticle": "'art-' || i",
+            "warehousename": f"'склад ' || (i / {CABINETS * NMIDS})",
+            "quantity": "i % 100",
+        })
+
+    # VACUUM вне транзакции: visibility map нужна для index-only scan
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in ("wb_ordersdaily", "wb_stocks", "wb_nmids"):
+            conn.execute(text(f"VACUUM ANALYZE {table}"))
+
+
+@pytest.fixture(scope="session")
+def plan_db():
+    """
+    Сессия SQLAlchemy к одноразовой БД test_plans_* на том же сервере, что и DATABASE_URL, с синтетикой.
+    После тестов БД удаляется целиком. Если сервер недоступен, тесты пропускаются.
+    """
+    url = make_url(DATABASE_URL)
+    name = f"test_plans_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(url, isolation_level="AUTOCOMMIT")
+    try:
+        with admin.connect() as conn:
+            conn.execute(text(f"CREATE DATABASE {name}"))
+    except OperationalError as e:
+        admin.dispose()
+        pytest.skip(f"Postgres недоступен: {e}")
+
+    engine = create_engine(url.set(database=name))
+    try:
+        load_synthetic(engine)
+        db = sessionmaker(bind=engine)()
+        try:
+            yield db
+        finally:
+            db.close()
+    finally:
+        engine.dispose()
+        with admin.connect() as conn:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {name}"))
+        admin.dispose()
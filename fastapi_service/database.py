@@ -24,4 +24,7 @@ def get_db():
         db.close()
 
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    # таблицы с info["skip_create"] создаёт Django - если FastAPI стартует раньше миграций,
+    # create_all создал бы их без ограничений и миграция упала бы
+    tables = [table for table in Base.metadata.sorted_tables if not table.info.get("skip_create")]
+    Base.metadata.create_all(bind=engine, tables=tables)
\ No newline at end of file
@@ -2,11 +2,11 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Header
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case, and_
+from sqlalchemy import func, case
 from datetime import datetime, timedelta
 from typing import Optional, List
 from database import get_db, create_tables
-from models import User, WbOrders, Stocks, Nmids, Base, WbLk
+from models import User, OrdersDaily, Stocks, Nmids, Base, WbLk
 from schemas import UserRegister, UserLogin, UserLoginResponse, UserRegisterResponse, OrdersChartResponse, OrdersChartData, UserResponse, WbLkResponse, WbLkCreate, UserWithWbLksResponse, ShareWbLkRequest
 
 app = FastAPI(title="Marketplace API")
@@ -287,6 +287,90 @@ async def get_wb_lk_users(
     }
 
 
+def parse_lk_ids(wb_lk_ids: Optional[str]) -> List[int]:
+    """Разобрать wb_lk_ids ("1,2,3") в список id. Пустой список - ничего не выбрано"""
+    if not wb_lk_ids:
+        return []
+    return [int(id.strip()) for id in wb_lk_ids.split(',') if id.strip()]
+
+
+def orders_chart_queries(db: Session, start_date: datetime, end_date: datetime, lk_ids: List[int]):
+    """Запросы для графика заказов по дневным итогам: (количество по дням, всего заказов и сумма продаж)"""
+    period_filter = [
+        OrdersDaily.lk_id.in_(lk_ids or [-1]),  # -1 - несуществующий ID
+        OrdersDaily.day >= start_date.date(),
+        OrdersDaily.day <= end_date.date(),
+    ]
+    by_day = db.query(
+        OrdersDaily.day.label('order_date'),
+        func.sum(OrdersDaily.orders).label('count')
+    ).filter(
+        *period_filter
+    ).group_by(
+        OrdersDaily.day
+    ).order_by(
+        OrdersDaily.day
+    )
+    totals = db.query(
+        func.sum(OrdersDaily.orders).label('total_orders'),
+        func.sum(OrdersDaily.revenue).label('total_sales')
+    ).filter(
+        *period_filter
+    )
+    return by_day, totals
+
+
+def stocks_total_query(db: Session, lk_ids: List[int]):
+    """Сумма остатков по кабинетам"""
+    return db.query(func.sum(Stocks.quantity)).filter(Stocks.lk_id.in_(lk_ids or [-1]))
+
+
+def products_query(db: Session, start_date: datetime, end_date: datetime, lk_ids: List[int]):
+    """Артикулы выбранных кабинетов с заказами за период, заказами за 7 дней и остатками"""
+    last_7_days = datetime.now().date() - timedelta(days=6)  # сегодня и 6 дней до
+
+    # Заказы артикулов за период по дневным итогам
+    orders_query = db.query(
+        OrdersDaily.nmid,
+        func.sum(OrdersDaily.orders).label('orders'),
+        func.sum(case((OrdersDaily.day >= last_7_days, OrdersDaily.orders), else_=0)).label('orders_7d'),
+    ).filter(
+        OrdersDaily.lk_id.in_(lk_ids or [-1]),
+        OrdersDaily.day >= start_date.date(),
+        OrdersDaily.day <= end_date.date(),
+    ).group_by(
+        OrdersDaily.nmid
+    ).subquery()
+
+    # Фильтрация артикулов по выбранным ЛК
+    nmids_filter = (Nmids.is_active == True) & (Nmids.lk_id.in_(lk_ids or [-1]))
+
+    # Подготавливаем условия для Stocks
+    stocks_query = db.query(func.sum(Stocks.quantity)).filter(
+        Stocks.nmid == Nmids.nmid,
+        Stocks.lk_id.in_(lk_ids or [-1]),
+    )
+
+    # max - артикул может быть в нескольких выбранных ЛК, заказы у него одни
+    return db.query(
+        Nmids.nmid,
+        func.coalesce(func.max(orders_query.c.orders), 0).label('orders'),
+        func.coalesce(
+            stocks_query.scalar_subquery(),
+            0
+        ).label('quantity'),
+        # количество заказов за последние 7 дней / 7
+        (func.coalesce(func.max(orders_query.c.orders_7d), 0) / 7.0).label("orders_per_day_7d")
+    ).outerjoin(
+        orders_query,
+        orders_query.c.nmid == Nmids.nmid
+    ).filter(
+        nmids_filter
+    ).group_by(
+        Nmids.nmid
+    )
+
+
 @app.get("/analytics/orders-chart", response_model=OrdersChartResponse)
 async def get_orders_chart(
     date_from: str = None, 
@@ -322,71 +406,23 @@ async def get_orders_chart(
         )
     
     try:
-        # Подготавливаем базовый запрос
-        query = db.query(
-            func.date(WbOrders.date).label('order_date'),
-            func.count(WbOrders.id).label('count')
-        ).filter(
-            WbOrders.date >= start_date,
-            WbOrders.date <= end_date + timedelta(days=1),  # +1 день чтобы включить end_date
-        )
-        
-        # Добавляем фильтрацию по WB кабинетам если указаны
-        if wb_lk_ids and wb_lk_ids.strip():
-            wb_lk_id_list = [int(id.strip()) for id in wb_lk_ids.split(',') if id.strip()]
-            if wb_lk_id_list:
-                query = query.filter(WbOrders.lk_id.in_(wb_lk_id_list))
-            else:
-                # Если wb_lk_ids пустая строка или содержит только пробелы - возвращаем пустые данные
-                query = query.filter(WbOrders.lk_id == -1)  # Несуществующий ID
-        
-        # Получаем количество заказов по дням в указанном диапазоне
-        orders_by_date = query.group_by(
-            func.date(WbOrders.date)
-        ).order_by(
-            func.date(WbOrders.date)
-        ).all()
-        
+        by_day_query, totals_query = orders_chart_queries(db, start_date, end_date, parse_lk_ids(wb_lk_ids))
+
         # Преобразуем в нужный формат
         chart_data = []
-        for row in orders_by_date:
+        for row in by_day_query.all():
             chart_data.append(OrdersChartData(
                 date=row.order_date.strftime('%Y-%m-%d'),
-                count=row.count
+                count=int(row.count)
             ))
         
-        # Подготавливаем базовые запросы для total_orders и total_sales
-        total_orders_query = db.query(func.count(WbOrders.id)).filter(
-            WbOrders.date >= start_date,
-            WbOrders.date <= end_date + timedelta(days=1),
-        )
-        
-        total_sales_query = db.query(func.sum(WbOrders.pricewithdisc)).filter(
-            WbOrders.date >= start_date,
-            WbOrders.date <= end_date + timedelta(days=1),
-        )
-        
-        # Добавляем фильтрацию по WB кабинетам если указаны
-        if wb_lk_ids and wb_lk_ids.strip():
-            wb_lk_id_list = [int(id.strip()) for id in wb_lk_ids.split(',') if id.strip()]
-            if wb_lk_id_list:
-                total_orders_query = total_orders_query.filter(WbOrders.lk_id.in_(wb_lk_id_list))
-                total_sales_query = total_sales_query.filter(WbOrders.lk_id.in_(wb_lk_id_list))
-            else:
-                # Если wb_lk_ids пустая строка или содержит только пробелы - возвращаем пустые данные
-                total_orders_query = total_orders_query.filter(WbOrders.lk_id == -1)
-                total_sales_query = total_sales_query.filter(WbOrders.lk_id == -1)
-        
-        # Получаем общее количество заказов за период
-        total_orders = total_orders_query.scalar()
-        
-        # Получаем общую сумму продаж по полю pricewithdisc
-        total_sales = total_sales_query.scalar()
+        # Общее количество заказов и сумма продаж по полю pricewithdisc за период - одним запросом
+        totals = totals_query.one()
         
         return OrdersChartResponse(
             data=chart_data,
-            total_orders=total_orders or 0,
-            total_sales=float(total_sales or 0)
+            total_orders=int(totals.total_orders or 0),
+            total_sales=float(totals.total_sales or 0)
         )
         
     except Exception as e:
@@ -408,20 +444,8 @@ async def get_stocks(
         return {"total_stocks": 0}
     
     try:
-        # Подготавливаем базовый запрос
-        query = db.query(func.sum(Stocks.quantity))
-        
-        # Добавляем фильтрацию по WB кабинетам если указаны
-        if wb_lk_ids and wb_lk_ids.strip():
-            wb_lk_id_list = [int(id.strip()) for id in wb_lk_ids.split(',') if id.strip()]
-            if wb_lk_id_list:
-                query = query.filter(Stocks.lk_id.in_(wb_lk_id_list))
-            else:
-                # Если wb_lk_ids пустая строка или содержит только пробелы - возвращаем пустые данные
-                query = query.filter(Stocks.lk_id == -1)  # Несуществующий ID
-        
         # Сумма всех остатков
-        total_stocks = query.scalar()
+        total_stocks = stocks_total_query(db, parse_lk_ids(wb_lk_ids)).scalar()
         
         return {
             "total_stocks": int(total_stocks or 0)
@@ -457,68 +481,7 @@ async def get_products(
         start_date = datetime.strptime(date_from, '%Y-%m-%d')
         end_date = datetime.strptime(date_to, '%Y-%m-%d')
 
-        last_7_days = datetime.now() - timedelta(days=7)
-
-        # Подготавливаем условия для JOIN с WbOrders
-        join_conditions = [
-            Nmids.nmid == WbOrders.nmid,
-            WbOrders.date >= start_date,
-            WbOrders.date <= end_date + timedelta(days=1)
-        ]
-        
-        join_condition = and_(*join_conditions)
-        
-        # Фильтрация артикулов по выбранным ЛК
-        nmids_filter = Nmids.is_active == True
-        if wb_lk_ids and wb_lk_ids.strip():
-            wb_lk_id_list = [int(id.strip()) for id in wb_lk_ids.split(',') if id.strip()]
-            if wb_lk_id_list:
-                nmids_filter = nmids_filter & (Nmids.lk_id.in_(wb_lk_id_list))
-            else:
-                # Если wb_lk_ids пустая строка - возвращаем пустые данные
-                nmids_filter = nmids_filter & (Nmids.lk_id == -1)
-        
-        # Подготавливаем условия для Stocks
-        stocks_query = db.query(func.sum(Stocks.quantity)).filter(Stocks.nmid == Nmids.nmid)
-        if wb_lk_ids and wb_lk_ids.strip():
-            wb_lk_id_list = [int(id.strip()) for id in wb_lk_ids.split(',') if id.strip()]
-            if wb_lk_id_list:
-                stocks_query = stocks_query.filter(Stocks.lk_id.in_(wb_lk_id_list))
-            else:
-                # Если wb_lk_ids пустая строка или содержит только пробелы - возвращаем пустые данные
-                stocks_query = stocks_query.filter(Stocks.lk_id == -1)
-
-        products = db.query(
-            Nmids.nmid,
-            func.count(func.distinct(WbOrders.id)).label('orders'),
-            func.coalesce(
-                func.coalesce(
-                    stocks_query.as_scalar(),
-                    0
-                ),
-                0
-            ).label('quantity'),
-            # количество заказов за последние 7 дней / 7
-            (
-                    func.count(
-                        func.distinct(
-                            case(
-                                (
-                                    WbOrders.date >= last_7_days,
-                                    WbOrders.id
-                                )
-                            )
-                        )
-                    ) / 7.0
-            ).label("orders_per_day_7d")
-        ).outerjoin(
-            WbOrders,
-            join_condition
-        ).filter(
-            nmids_filter
-        ).group_by(
-            Nmids.nmid
-        ).all()
+        products = products_query(db, start_date, end_date, parse_lk_ids(wb_lk_ids)).all()
 
         return {
             "products": [
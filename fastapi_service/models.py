@@ -1,5 +1,5 @@
 # marketplace/fastapi_service/models.py
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, BigInteger, Float, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, DateTime, Date, Boolean, BigInteger, Float, ForeignKey, Table, Computed
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -89,6 +89,23 @@ class WbOrders(Base):
     gnumber = Column(String(255), nullable=False)
     srid = Column(String(255), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now())
+    # день заказа по МСК (WB отдаёт МСК без пояса, пишем как есть), хранимая колонка
+    order_day = Column(Date, Computed("(date AT TIME ZONE 'UTC')::date", persisted=True))
+
+
+class OrdersDaily(Base):
+    # дневные итоги заказов, ведёт бэкенд (database/orders_daily.py).
+    # Таблицу с уникальным ключом (lk_id, nmid, day) создаёт миграция Django, create_tables её пропускает
+    __tablename__ = "wb_ordersdaily"
+    __table_args__ = {"info": {"skip_create": True}}
+
+    id = Column(Integer, primary_key=True, index=True)
+    lk_id = Column(Integer, nullable=False)
+    nmid = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)
+    orders = Column(Integer, nullable=False, default=0)
+    cancels = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
 
 
 class Stocks(Base):
@@ -0,0 +1,68 @@
+# marketplace/fastapi_service/tests/test_query_plans.py
+"""
+Запросы /analytics/* на синтетических данных (фикстура plan_db) должны идти по своим индексам:
+index-only scan по дневным итогам и остаткам, без seq scan.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from main import orders_chart_queries, stocks_total_query, products_query
+
+
+# таблицы, которые аналитика не должна читать целиком
+TABLES = ("wb_ordersdaily", "wb_stocks", "wb_nmids")
+LK_IDS = [1, 2]
+
+
+def explain(db, query):
+    """EXPLAIN (FORMAT JSON) запроса SQLAlchemy -> список узлов плана {"node", "relation", "index"}"""
+    compiled = query.statement.compile(
+        dialect=postgresql.psycopg2.dialect(), compile_kwargs={"render_postcompile": True}
+    )
+    plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+
+    nodes = []
+
+    def walk(node):
+        nodes.append({
+            "node": node["Node Type"],
+            "relation": node.get("Relation Name"),
+            "index": node.get("Index Name"),
+        })
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return nodes
+
+
+def build(db, name):
+    end = datetime.now()
+    start = end - timedelta(days=29)
+    by_day, totals = orders_chart_queries(db, start, end, LK_IDS)
+    return {
+        "orders-chart по дням": by_day,
+        "orders-chart итоги": totals,
+        "stocks": stocks_total_query(db, LK_IDS),
+        "products": products_query(db, start, end, LK_IDS),
+    }[name]
+
+
+@pytest.mark.parametrize("name, index_only", [
+    ("orders-chart по дням", ["wb_ordersdaily"]),
+    ("orders-chart итоги", ["wb_ordersdaily"]),
+    ("stocks", ["wb_stocks"]),
+    ("products", ["wb_ordersdaily", "wb_stocks"]),
+])
+def test_index_only(plan_db, name, index_only):
+    nodes = explain(plan_db, build(plan_db, name))
+    plan = ", ".join(f"{n['node']}({n['relation']}/{n['index']})" for n in nodes if n["relation"])
+
+    seq_scans = [n["relation"] for n in nodes if n["node"] == "Seq Scan" and n["relation"] in TABLES]
+    assert not seq_scans, f"Seq Scan по {seq_scans}: {plan}"
+    for table in index_only:
+        scans = [n for n in nodes if n["relation"] == table]
+        assert scans, f"{table} нет в плане: {plan}"
+        assert all(n["node"] == "Index Only Scan" for n in scans), f"{table} не index-only: {plan}"